@@ -0,0 +1,86 @@
+'''
+Import-time benchmark for CluStR.
+
+Times `import clustr` and `clustr.py --help` in fresh interpreters and checks
+that none of the heavy dependencies are pulled in at import. Exits with a
+non-zero status if either check regresses, so it can be run from CI or a
+scheduler pre-flight:
+
+    python benchmarks/bench_import.py --max-import 0.5 --max-help 0.5
+'''
+
+from argparse import ArgumentParser
+import os
+import subprocess
+import sys
+import time
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Modules that must only be loaded when they are actually needed.
+HEAVY = ['astropy', 'matplotlib', 'linmix', 'yaml', 'pyfiglet', 'scipy',
+         'PyPDF2', 'plotlib']
+
+def time_command(cmd, repeat):
+    '''Best wall-clock time of `cmd` over `repeat` fresh runs.'''
+
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run(cmd, cwd=REPO, stdout=subprocess.DEVNULL,
+                       stderr=subprocess.DEVNULL, check=False)
+        best = min(best, time.perf_counter() - start)
+
+    return best
+
+def heavy_modules_loaded():
+    '''Heavy modules present in sys.modules after `import clustr`.'''
+
+    code = (
+        'import sys, clustr; '
+        'print(" ".join(m for m in {!r} if m in sys.modules))'
+        .format(HEAVY)
+    )
+    out = subprocess.run([sys.executable, '-c', code], cwd=REPO,
+                         capture_output=True, text=True, check=True)
+
+    return out.stdout.split()
+
+def main():
+    parser = ArgumentParser()
+    parser.add_argument('--repeat', type=int, default=5,
+        help='number of fresh interpreters to time')
+    parser.add_argument('--max-import', type=float, default=0.5,
+        help='maximum allowed seconds for `import clustr`')
+    parser.add_argument('--max-help', type=float, default=0.5,
+        help='maximum allowed seconds for `clustr.py --help`')
+    args = parser.parse_args()
+
+    t_base = time_command([sys.executable, '-c', 'pass'], args.repeat)
+    t_import = time_command([sys.executable, '-c', 'import clustr'], args.repeat)
+    t_help = time_command([sys.executable, 'clustr.py', '--help'], args.repeat)
+    loaded = heavy_modules_loaded()
+
+    print(f'interpreter startup:  {t_base:.3f} s')
+    print(f'import clustr:        {t_import:.3f} s')
+    print(f'clustr.py --help:     {t_help:.3f} s')
+    print(f'heavy modules loaded: {", ".join(loaded) or "none"}')
+
+    failed = False
+    if t_import > args.max_import:
+        print(f'FAIL: import took longer than {args.max_import} s')
+        failed = True
+    if t_help > args.max_help:
+        print(f'FAIL: --help took longer than {args.max_help} s')
+        failed = True
+    if loaded:
+        print('FAIL: heavy modules are imported at load time')
+        failed = True
+
+    if failed:
+        raise SystemExit(1)
+
+    return
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,168 @@
+'''
+End-to-end pipeline benchmark for CluStR.
+
+Writes synthetic catalogs of the requested sizes with mocklib, then times
+each stage of the pipeline (Catalog loading, Data and its cuts, the linmix fit
+and, optionally, plotlib.make_plots) and records throughput and peak memory.
+Results can be stored as a baseline and later runs on the same machine
+compared against it (no baseline ships with the repository, as timings do
+not carry over between machines); the script exits with a non-zero status if
+any stage got slower than the allowed tolerance:
+
+    python benchmarks/bench_pipeline.py config.yml --sizes 1e2 1e4 1e6 \\
+        --save-baseline baseline.json
+    python benchmarks/bench_pipeline.py config.yml --sizes 1e2 1e4 1e6 \\
+        --baseline baseline.json
+'''
+
+from argparse import ArgumentParser, Namespace
+import contextlib
+import io
+import json
+import os
+import sys
+import tempfile
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO)
+
+import clustr  # pylint: disable=wrong-import-position
+import mocklib  # pylint: disable=wrong-import-position
+import proflib  # pylint: disable=wrong-import-position
+
+def run_size(n, args, workdir):
+    '''Runs every pipeline stage on a synthetic catalog of n clusters.'''
+
+    import yaml
+
+    with open(args.config_file, 'r') as stream:
+        raw = yaml.safe_load(stream)
+
+    cat_filename = os.path.join(workdir, f'mock-{int(n)}.fits')
+    axes = None if args.all_columns else (args.x, args.y)
+    mocklib.write_mock_catalog(cat_filename, n, raw, axes=axes, seed=args.seed)
+
+    cli = Namespace(config_file=args.config_file, x=args.x, y=args.y,
+                    prefix=os.path.join(workdir, ''), cat_filename=cat_filename)
+    config = clustr.Config(cli)
+    config['Nmin'] = args.nmin
+    config['Nmax'] = args.nmax
+
+    profiler = proflib.Profiler()
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        with profiler.stage('catalog'):
+            catalog = clustr.Catalog(cat_filename, config)
+
+        with profiler.stage('data'):
+            data = clustr.Data(config, catalog)
+
+        with profiler.stage('cuts'):
+            data.create_cuts(config, catalog)
+
+        with profiler.stage('fit'):
+            fitter = clustr.Fitter(data, config)
+
+        if args.plots:
+            import matplotlib
+            matplotlib.use('Agg')
+            import plotlib
+
+            cwd = os.getcwd()
+            os.chdir(workdir)
+            try:
+                with profiler.stage('plots'):
+                    plotlib.make_plots(cli, config, fitter)
+            finally:
+                os.chdir(cwd)
+
+    results = {
+        s['name']: {'seconds': s['seconds'], 'peak_mb': s['peak_traced_mb']}
+        for s in profiler.stages
+    }
+
+    for name in ('catalog', 'data', 'cuts'):
+        results[name]['rows_per_s'] = n / results[name]['seconds']
+
+    results['fit']['clusters'] = len(data.x)
+    if fitter.mcmc_iterations:
+        results['fit']['iterations_per_s'] = fitter.mcmc_iterations / fitter.fit_seconds
+
+    return results
+
+def compare(results, baseline, tolerance):
+    '''Prints the change against the baseline; returns the regressed stages.'''
+
+    regressions = []
+    for size, stages in results.items():
+        for name, r in stages.items():
+            try:
+                old = baseline[size][name]['seconds']
+            except KeyError:
+                continue
+            ratio = r['seconds'] / old
+            flag = ''
+            if ratio > 1. + tolerance:
+                flag = '  <-- REGRESSION'
+                regressions.append((size, name))
+            print(f'{size:>10} {name:>8}: {old:9.4f} s -> {r["seconds"]:9.4f} s '
+                  f'({ratio:5.2f}x){flag}')
+
+    return regressions
+
+def main():
+    parser = ArgumentParser()
+    parser.add_argument('config_file', help='config to benchmark with')
+    parser.add_argument('--x', default='lambda', choices=clustr.valid_axes,
+        help='x axis')
+    parser.add_argument('--y', default='tr2500', choices=clustr.valid_axes,
+        help='y axis')
+    parser.add_argument('--sizes', nargs='+', type=float, default=[1e2, 1e3, 1e4],
+        help='catalog sizes to benchmark (1e2 to 1e7)')
+    parser.add_argument('--nmin', type=int, default=5000,
+        help='minimum linmix iterations')
+    parser.add_argument('--nmax', type=int, default=10000,
+        help='maximum linmix iterations')
+    parser.add_argument('--plots', action='store_true',
+        help='also time plotlib.make_plots')
+    parser.add_argument('--all-columns', action='store_true',
+        help='write every column in the config, not just the two axes')
+    parser.add_argument('--seed', type=int, default=42, help='random seed')
+    parser.add_argument('-o', '--output', help='write results to this JSON file')
+    parser.add_argument('--baseline', help='compare against this JSON file')
+    parser.add_argument('--save-baseline', help='store results as a baseline')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+        help='allowed fractional slowdown before a stage counts as regressed')
+    args = parser.parse_args()
+
+    results = {}
+    with tempfile.TemporaryDirectory() as workdir:
+        for n in args.sizes:
+            size = str(int(n))
+            print(f'Benchmarking {size} clusters...')
+            results[size] = run_size(n, args, workdir)
+            for name, r in results[size].items():
+                extra = ', '.join(
+                    f'{k} = {v:.4g}' for k, v in r.items()
+                    if k not in ('seconds', 'peak_mb')
+                )
+                print(f'  {name:>8}: {r["seconds"]:9.4f} s, '
+                      f'peak {r["peak_mb"]:8.1f} MB  {extra}')
+
+    print(f'Peak RSS: {proflib.peak_rss_mb():.1f} MB')
+
+    for filename in (args.output, args.save_baseline):
+        if filename:
+            with open(filename, 'w') as f:
+                json.dump(results, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline, 'r') as f:
+            baseline = json.load(f)
+        if compare(results, baseline, args.tolerance):
+            raise SystemExit(1)
+
+    return
+
+if __name__ == '__main__':
+    main()
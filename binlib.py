@@ -0,0 +1,273 @@
+''' Binned fit library for CluStR '''
+
+# Fits the same relation in slices of another column (usually redshift) to
+# test for evolution. The cut Data is partitioned once, every bin is fit on
+# a process pool and the trend of intercept, slope and scatter across the
+# bins is reported:
+#
+#   python clustr.py cat.fits lambda tr2500 config.yml --bin-by Redshift \
+#       --bins 0.1 0.3 0.5 0.8 --workers 3
+#
+# A single --bins value is a number of equal-occupancy bins. Fits are cached
+# by a digest of the bin's contents and fit settings, so bins that did not
+# change since a previous run (or duplicate bins) are not refit.
+
+from concurrent.futures import ProcessPoolExecutor
+import hashlib
+import json
+import os
+import numpy as np
+
+# pylint: disable=invalid-name
+
+# Config keys that change a bin's fit, included in its digest.
+fit_config_keys = ('piv_type', 'piv_value', 'Nmin', 'Nmax', 'burn', 'fit_method',
+                   'pt_temps', 'pt_ladders')
+
+params = ('intercept', 'slope', 'sigma')
+
+def partition(values, bins):
+    '''
+    Splits clusters into bins of `values` with a single sort. `bins` is
+    either a number of equal-occupancy bins or a sequence of bin edges;
+    clusters outside the edges or with a NaN value are left out. Returns the
+    edges and the cluster indices of every bin. Raises ValueError if that
+    would not give at least one bin.
+    '''
+
+    values = np.asarray(values, dtype=float)
+    order = np.argsort(values, kind='stable')
+    ordered = values[order]
+
+    # NaNs sort to the end.
+    nfinite = np.count_nonzero(~np.isnan(ordered))
+    if nfinite == 0:
+        raise ValueError('No finite values to bin.')
+
+    if np.ndim(bins) == 0:
+        if int(bins) != bins or int(bins) < 1:
+            raise ValueError(f'The number of bins must be a positive integer, not {bins:g}.')
+        bounds = np.linspace(0, nfinite, int(bins)+1).astype(int)
+        edges = np.append(ordered[bounds[:-1]], ordered[nfinite-1])
+    else:
+        edges = np.asarray(bins, dtype=float)
+        if np.size(edges) < 2:
+            raise ValueError('Bin edges need at least two values.')
+        if np.any(np.diff(edges) <= 0):
+            raise ValueError('Bin edges must be increasing.')
+        bounds = np.searchsorted(ordered[:nfinite], edges, side='left')
+        # The last bin includes its upper edge.
+        bounds[-1] = np.searchsorted(ordered[:nfinite], edges[-1], side='right')
+
+    return edges, [order[lo:hi] for lo, hi in zip(bounds[:-1], bounds[1:])]
+
+def digest(data, config):
+    '''Content digest of a bin's clusters and the settings it is fit with.'''
+
+    h = hashlib.sha256()
+    h.update(f'{data.xlabel}\0{data.ylabel}\0'.encode())
+    for col in data.columns:
+        h.update(np.ascontiguousarray(getattr(data, col)).tobytes())
+    for key in fit_config_keys:
+        h.update(repr(config[key] if key in config else None).encode())
+
+    return h.hexdigest()
+
+def _fit_bin(data, config, seed):
+    '''
+    Worker: fits one bin with the RNG stream `seed` (a SeedSequence) and
+    returns its chains.
+    '''
+
+    import clustr
+
+    # linmix draws from the global NumPy RNG, which forked workers share.
+    np.random.seed(np.random.default_rng(seed).integers(2**32))
+
+    fitter = clustr.Fitter(data, config)
+
+    return {
+        'piv': float(fitter.piv),
+        'intercept': np.asarray(fitter.kelly_b),
+        'slope': np.asarray(fitter.kelly_m),
+        'sigma': np.asarray(fitter.kelly_sigsqr),
+    }
+
+def _load_cached(cache_dir, key):
+    filename = os.path.join(cache_dir, f'{key}.npz')
+    if not os.path.exists(filename):
+        return None
+
+    with np.load(filename) as f:
+        return {k: f[k] if k != 'piv' else float(f[k]) for k in f.files}
+
+def _save_cached(cache_dir, key, fit):
+    os.makedirs(cache_dir, exist_ok=True)
+
+    # Write to a temporary file first so readers never see a partial fit.
+    filename = os.path.join(cache_dir, f'{key}.npz')
+    tmp = os.path.join(cache_dir, f'.{key}.{os.getpid()}.npz')
+    np.savez(tmp, **fit)
+    os.replace(tmp, filename)
+
+    return
+
+def binned_fits(data, config, values, bins, workers=None, cache_dir=None,
+                min_clusters=10, seed=None):
+    # pylint: disable = too-many-arguments
+    # pylint: disable = too-many-locals
+    '''
+    Fits every bin of `values` (one per cluster of `data`, see partition())
+    on a pool of `workers` processes. All bins share the pivot of the full
+    sample so their intercepts can be compared. Bins with identical digests
+    are fit once, and with a `cache_dir` fits are also stored there and
+    reused by later calls. Bins with fewer than `min_clusters` clusters are
+    skipped. Bin i is fit with the i-th child of SeedSequence(seed) (by
+    default seeded from the global NumPy RNG). Returns a list with a
+    dictionary per bin.
+    '''
+
+    import clustr
+
+    edges, indices = partition(values, bins)
+    values = np.asarray(values, dtype=float)
+
+    # Common pivot, and no per-bin chain stores or streamed bands.
+    if config['piv_type'] == 'median':
+        piv_value = float(np.median(data.x))
+    else:
+        piv_value = config['piv_value']
+    bin_config = clustr.Config.from_dict(
+        dict(config.to_dict(), piv_type='value', piv_value=piv_value,
+             chain_store=None, stream_bands=False),
+        config.x, config.y, config.prefix)
+
+    if seed is None:
+        seed = np.random.randint(2**31)
+    seeds = np.random.SeedSequence(seed).spawn(len(indices))
+
+    results = []
+    pending = {}
+    for i, idx in enumerate(indices):
+        result = {
+            'bin': i,
+            'lo': float(edges[i]),
+            'hi': float(edges[i+1]),
+            'n': int(np.size(idx)),
+            'center': float(np.median(values[idx])) if np.size(idx) else np.nan,
+        }
+        results.append(result)
+
+        if np.size(idx) < min_clusters:
+            print(f'Skipping bin {i} [{result["lo"]:g}, {result["hi"]:g}]: '
+                  f'only {np.size(idx)} clusters.')
+            continue
+
+        subset = data.take(idx)
+        key = digest(subset, bin_config)
+        result['digest'] = key
+
+        fit = _load_cached(cache_dir, key) if cache_dir else None
+        result['cached'] = fit is not None
+        if fit is not None:
+            result.update(fit)
+        else:
+            pending.setdefault(key, (subset, seeds[i], []))[2].append(result)
+
+    if pending:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = {
+                key: pool.submit(_fit_bin, subset, bin_config, bin_seed)
+                for key, (subset, bin_seed, _) in pending.items()
+            }
+            for key, future in futures.items():
+                fit = future.result()
+                if cache_dir:
+                    _save_cached(cache_dir, key, fit)
+                for result in pending[key][2]:
+                    result.update(fit)
+
+    return results
+
+def summarize(results):
+    '''Posterior mean and standard deviation of each parameter in every bin.'''
+
+    for r in results:
+        if 'slope' not in r:
+            continue
+        for p in params:
+            r[f'{p}_mean'] = float(np.mean(r[p]))
+            r[f'{p}_std'] = float(np.std(r[p]))
+
+    return results
+
+def trend(results):
+    '''
+    Weighted least-squares linear trend of every parameter's posterior mean
+    against the bin centres: d(param)/d(column), its error and the chi^2 of
+    the straight line. A slope consistent with zero means no evolution.
+    '''
+
+    fitted = [r for r in summarize(results) if 'slope' in r]
+
+    trends = {}
+    if len(fitted) < 2:
+        return trends
+
+    z = np.array([r['center'] for r in fitted])
+    for p in params:
+        y = np.array([r[f'{p}_mean'] for r in fitted])
+        w = 1. / np.maximum(np.array([r[f'{p}_std'] for r in fitted]), 1e-12)**2
+
+        A = np.vstack((np.ones_like(z), z)).T
+        cov = np.linalg.inv(A.T @ (w[:, None] * A))
+        coef = cov @ (A.T @ (w * y))
+        chi2 = float(np.sum(w * (y - A @ coef)**2))
+
+        trends[p] = {
+            'value': float(coef[0]),
+            'slope': float(coef[1]),
+            'slope_err': float(np.sqrt(cov[1, 1])),
+            'chi2': chi2,
+            'dof': len(fitted) - 2,
+        }
+
+    return trends
+
+def report(results, trends, column):
+    '''Human-readable table of the binned fits and their trends.'''
+
+    lines = ['{:>4} {:>21} {:>7} {:>18} {:>18} {:>18}'.format(
+        'Bin', column[:21], 'N', 'Intercept', 'Slope', 'Sigma')]
+    for r in results:
+        row = '{:>4} {:>21} {:>7}'.format(
+            r['bin'], '[{:.4g}, {:.4g}]'.format(r['lo'], r['hi']), r['n'])
+        if 'slope' in r:
+            row += ''.join(
+                ' {:>18}'.format('{:.3f} +/- {:.3f}'.format(
+                    r[f'{p}_mean'], r[f'{p}_std']))
+                for p in params)
+            if r.get('cached'):
+                row += '  (cached)'
+        lines.append(row)
+
+    for p, t in trends.items():
+        lines.append(
+            'd({})/d({}) = {:.4g} +/- {:.4g} (chi2 = {:.3g}, dof = {})'
+            .format(p, column, t['slope'], t['slope_err'], t['chi2'], t['dof']))
+
+    return '\n'.join(lines)
+
+def write_report(filename, results, trends, column):
+    '''Writes the per-bin summaries and trends to a JSON file.'''
+
+    bins = [
+        {k: v for k, v in r.items() if k not in params}
+        for r in results
+    ]
+
+    with open(filename, 'w') as f:
+        json.dump({'column': column, 'bins': bins, 'trends': trends}, f,
+                  indent=2)
+
+    return
@@ -1,37 +1,91 @@
 from argparse import ArgumentParser
+import importlib
 import os
-from astropy.table import Table
+import sys
+import time
 import numpy as np
 import reglib  # Regression library
-import matplotlib.pyplot as plt
-import linmix
-import yaml
-import plotlib
-import pyfiglet as pfig
+import proflib  # Profiling library
 from datetime import datetime
 
-''' Parse command line arguments '''
-parser = ArgumentParser()
-# Required argument for catalog
-parser.add_argument('cat_filename', help='FITS catalog to open')
-# Required arguement for axes
+# Heavy dependencies (astropy, yaml, matplotlib, linmix, pyfiglet) are
+# imported where they are used so that `--help`, argument errors and library
+# use do not pay for them.
+
 valid_axes = ['l500kpc', 'lr2500', 'lr500', 'lr500cc', 't500kpc', 'tr2500',
               'tr500', 'tr500cc', 'lambda', 'lambdaxmm', 'lambdamatcha', 'lx', 'LAMBDA',
               'lam', 'txmm', 'tr2500matcha', 'tr500matcha', 'tr2500xmm', 'tr500xmm', 'kt', 'lambdachisq','R2500', 'sigma_bi']
-parser.add_argument('x', help='what to plot on x axis', choices=valid_axes)
-parser.add_argument('y', help='what to plot on y axis', choices=valid_axes)
-parser.add_argument('config_file',
-    help = 'the filename of the config to run')
-# Optional argument for file prefix
-parser.add_argument('-p', '--prefix', help='prefix for output file')
+
+# Subcommands that take over the command line, e.g. `clustr.py serve ...`,
+# mapped to the module whose main() handles them.
+subcommands = {
+    'serve': 'serverlib',
+    'mock': 'mocklib',
+    'inject': 'injectlib',
+    'queue': 'queuelib',
+    'watch': 'telemlib',
+    'check': 'preflightlib',
+}
+
+def build_parser():
+    ''' Parse command line arguments '''
+    parser = ArgumentParser()
+    # Required argument for catalog
+    parser.add_argument('cat_filename', help='FITS catalog to open')
+    # Required arguement for axes
+    parser.add_argument('x', help='what to plot on x axis', choices=valid_axes)
+    parser.add_argument('y', help='what to plot on y axis', choices=valid_axes)
+    parser.add_argument('config_file',
+        help = 'the filename of the config to run')
+    # Optional argument for file prefix
+    parser.add_argument('-p', '--prefix', help='prefix for output file')
+    parser.add_argument('--no-banner', action='store_true',
+        help='do not print the CluStR banner')
+    parser.add_argument('--incremental', metavar='ARCHIVE',
+        help='refit only the clusters not seen by the run saved in ARCHIVE, '
+             'warm-starting from its posterior (needs `id_column`)')
+    parser.add_argument('--profile', nargs='?', const='', metavar='REPORT',
+        help='time each stage and write a JSON report '
+             '(default: Profile-<prefix><y>-<x>.json)')
+    parser.add_argument('--bin-by', metavar='COLUMN',
+        help='fit the relation separately in bins of this catalog column '
+             '(e.g. the redshift column) and report the trend')
+    parser.add_argument('--bins', nargs='+', type=float, default=[3],
+        help='bin edges, or a single number of equal-occupancy bins')
+    parser.add_argument('--join', nargs='+', default=[], metavar='CATALOG',
+        help='FITS catalogs to join to cat_filename on the `Join` key column')
+    parser.add_argument('-w', '--workers', type=int,
+        help='number of bins to fit in parallel (default: all CPUs)')
+    parser.add_argument('--joint', nargs='+', metavar='Y', choices=valid_axes,
+        help='fit these y axes together with y against x in one sampler, '
+             'with a full intrinsic scatter covariance (error columns from '
+             '`y_err_columns`)')
+
+    return parser
 
 #----------------------CluStR----------------------------------------
 
-def Ez(z):
-    Om = 0.3
-    H_0 = 0.7
-    h = H_0/100
-    return np.sqrt(Om*(1.+z)**3 + h)
+def Ez(z, Om=0.3):
+    ''' E(z) of a flat LambdaCDM cosmology, see cosmolib. '''
+
+    import cosmolib
+
+    return cosmolib.Cosmology(Om).Ez(z)
+
+# Settings that in-memory configs may leave out. They match the "no cuts,
+# no censoring, no scaling" choices in config.yml.
+default_config = {
+    'piv_type': 'median',
+    'scale_x_by_ez': False,
+    'scale_y_by_ez': False,
+    'Censored': {False: None},
+    'asymmetric_err': False,
+    'Bool_Flag': {False: {}},
+    'Cutoff_Flag': {},
+    'Range_Flag': {},
+    'scale_line': 1.75,
+    'burn': 0,
+}
 
 # We'll define useful classes here
 class Config:
@@ -48,11 +102,37 @@ class Config:
         self.y = args.y
         self.prefix = args.prefix
 
+        import yaml
+
         with open(self.filename, 'r') as stream:
             self._config = yaml.safe_load(stream)
 
         return
 
+    @classmethod
+    def from_dict(cls, config_dict, x, y, prefix=None):
+        """
+        Builds a config from an in-memory dictionary instead of a YAML file.
+        Missing keys fall back to `default_config`, and x/y may be raw column
+        names rather than keys of `Column_Names`.
+        """
+
+        self = cls.__new__(cls)
+        self.filename = None
+        self.args = None
+        self.x = x
+        self.y = y
+        self.prefix = prefix
+
+        self._config = dict(default_config, **config_dict)
+
+        column_names = dict(self._config.get('Column_Names', {}))
+        for axis in (x, y):
+            column_names.setdefault(axis, axis)
+        self._config['Column_Names'] = column_names
+
+        return self
+
     # Methods used to access values/keys from config.
     def __getitem__(self, key):
         return self._config[key]
@@ -71,39 +151,140 @@ class Config:
 
     def __repr__(self):
         return repr(self._config)
+
+    def to_dict(self):
+        """The config keys and values, as a new (shallow-copied) dictionary."""
+
+        return dict(self._config)
       
 class Catalog:
     """
     Read/Load the fits table that contains the data.
 
+    Columns are returned as read-only views of the loaded table, so one
+    Catalog can back many concurrent Data/Fitter instances (e.g. the worker
+    threads of serverlib). Columns set on a Catalog are kept per instance,
+    on top of the shared table; see view().
     """
 
-    def __init__(self, cat_file_name, config):
-        self.file_name = cat_file_name
+    def __init__(self, cat_file_name, config, extra=()):
+        # A list of catalogs is joined to the first one, see joinlib; `extra`
+        # columns (e.g. --bin-by) are joined along with those of the config.
+        import preflightlib
+
+        self.file_name, joined, join = preflightlib.join_settings(config, cat_file_name)
+        self._derived = {}
 
         self._load_catalog()
 
+        if joined:
+            self._join(joined, join, config, extra)
+
         return
 
+    @classmethod
+    def from_table(cls, table):
+        """
+        Wraps an in-memory astropy Table, structured array or dictionary of
+        column arrays without going through a FITS file.
+        """
+
+        from astropy.table import Table
+
+        self = cls.__new__(cls)
+        self.file_name = None
+        self._derived = {}
+        self._catalog = Table(table, copy=False)
+
+        return self
+
+    def view(self):
+        """
+        A Catalog sharing this one's table (without copying it) but with its
+        own derived columns.
+        """
+
+        other = self.__class__.__new__(self.__class__)
+        other.file_name = self.file_name
+        other._catalog = self._catalog
+        other._derived = dict(self._derived)
+
+        return other
+
+    def take(self, rows):
+        """A new Catalog of the given rows (a copy)."""
+
+        other = self.__class__.from_table(self._catalog[rows])
+        for key, value in self._derived.items():
+            other._derived[key] = _readonly(value[rows])
+
+        return other
+
     def _load_catalog(self):
         """Method used to open catalog."""
 
+        from astropy.table import Table
+
         self._catalog = Table.read(self.file_name)
 
         return
 
+    def _join(self, filenames, join, config, extra=()):
+        """
+        Joins the needed columns of other FITS catalogs on a key column, as
+        set in the `Join` section of the config (see joinlib).
+        """
+
+        import joinlib
+        import preflightlib
+
+        key = join.get('key') or (config['id_column'] if 'id_column' in config else None)
+        how = join.get('how', 'inner')
+        if not key:
+            raise ValueError('Joining catalogs needs a `key` in `Join` (or `id_column`).')
+
+        N = len(self._catalog)
+        rows, matches = joinlib.join_index(
+            np.asarray(self._catalog[key]), filenames, key, how,
+            cache_dir=join.get('cache'), main_filename=self.file_name)
+        names = joinlib.needed_columns(config, self._catalog.colnames,
+                                       list(join.get('columns') or []) + list(extra))
+
+        table = self._catalog[rows] if how == 'inner' else self._catalog
+        for filename, match in zip(filenames, matches):
+            available = preflightlib.header_columns(filename) or {}
+            take = [n for n in names if n in available and n not in table.colnames]
+            for name, values in joinlib.read_columns(filename, take).items():
+                table[name] = joinlib.gather(values, match)
+
+        print(f'Joined {len(filenames)} catalogs on `{key}` ({how}): '
+              f'kept {len(table)} of {N} rows')
+        self._catalog = table
+
+        return
+
     # Methods used to access values/keys.
     def __getitem__(self, key):
-        return self._catalog[key]
+        if key in self._derived:
+            return self._derived[key]
+        return _readonly(self._catalog[key])
 
     def __setitem__(self, key, value):
-        self._catalog[key] = value
+        # Copy on write: the shared table is never modified.
+        value = np.ma.array(value, copy=True) if np.ma.isMaskedArray(value) \
+            else np.array(value, copy=True)
+        if value.shape[:1] != (len(self),):
+            raise ValueError(
+                f'Column `{key}` has {len(value)} rows, the catalog {len(self)}.')
+        self._derived[key] = _readonly(value)
 
     def __delitem__(self, key):
-        del self._catalog[key]
+        if key not in self._derived:
+            raise KeyError(f'`{key}` is not a derived column; catalog columns are read-only.')
+        del self._derived[key]
 
     def __contains__(self, key):
-        return key in self._catalog
+        return key in self._derived or key in self._catalog.colnames
 
     def __len__(self):
         return len(self._catalog)
@@ -111,6 +292,19 @@ class Catalog:
     def __repr__(self):
         return repr(self._catalog)
 
+def _readonly(column):
+    '''A read-only view of a (masked) column, without copying it.'''
+
+    if np.ma.isMaskedArray(column):
+        values = np.ma.MaskedArray(np.asarray(column.data), mask=np.ma.getmaskarray(column),
+                                   copy=False)
+        values.mask.flags.writeable = False
+    else:
+        values = np.asarray(column).view()
+    values.flags.writeable = False
+
+    return values
+
 class Data:
     '''
     This class takes a catalog table and grabs only the relevant columns
@@ -119,11 +313,54 @@ class Data:
     Config is expected to act like a dictionary
     '''
 
+    # Per-cluster arrays, in the order they are stored.
+    columns = ('x', 'y', 'x_err', 'y_err', 'x_err_low', 'x_err_high',
+               'y_err_low', 'y_err_high', 'delta_', 'ids')
+
     def __init__(self, config, catalog):
         self._load_data(config, catalog)
 
         return
 
+    @classmethod
+    def from_arrays(cls, xlabel, ylabel, **arrays):
+        '''
+        Builds Data from already-cut arrays (see `Data.columns`), e.g. those
+        saved in a results archive.
+        '''
+
+        self = cls.__new__(cls)
+        self.xlabel = xlabel
+        self.ylabel = ylabel
+        for col in cls.columns:
+            setattr(self, col, np.asarray(arrays[col]))
+        # Not loaded from a catalog, so there are no catalog rows.
+        self.rows = None
+
+        return self
+
+    @classmethod
+    def concatenate(cls, datas):
+        '''Stacks the clusters of several Data objects with the same axes.'''
+
+        return cls.from_arrays(
+            datas[0].xlabel, datas[0].ylabel,
+            **{col: np.concatenate([getattr(d, col) for d in datas])
+               for col in cls.columns}
+        )
+
+    def take(self, indices):
+        '''New Data holding only the clusters at `indices`.'''
+
+        subset = self.from_arrays(
+            self.xlabel, self.ylabel,
+            **{col: getattr(self, col)[indices] for col in self.columns}
+        )
+        if self.rows is not None:
+            subset.rows = self.rows[indices]
+
+        return subset
+
     def create_cuts(self, config, catalog):
             """
             Apply cuts to data. Will remove flags of type Boolean, Cutoff, and Range.
@@ -152,8 +389,9 @@ class Data:
                         print(
                         "Warning: Boolean type must be `True` or  `False` - "
                         "you entered `{}`. Ignoring `{}` flag."
-                        .format(bool_type, bflag)
+                        .format(bool_type, bflag_)
                         )
+                        continue
 
                     # Include flag cut into mask array.
                     mask |= cutb
@@ -180,22 +418,15 @@ class Data:
                     cutoff = cvalues[0]
                     cut_type = cvalues[1]
 
+                    # NaN compares False, so NaN rows are never cut here
+                    # (the catalog column is read-only and left alone).
+
                     # Remove rows below cutoff value.
                     if cut_type == 'above':
-
-                        # Nan's interfere with evaluation. Set them to dummy value.
-                        nan_cut = np.where(np.isnan(catalog[cflag_]))
-                        catalog[cflag_][nan_cut] = 2*(cutoff)
-
                         cutc = catalog[cflag_] < cutoff
 
                     # Remove rows above cutoff value.
                     elif cut_type == 'below':
-
-                        # NaN's interfere with evaluation. Set them to dummy value.
-                        nan_cut = np.where(np.isnan(catalog[cflag_]))
-                        catalog[cflag_][nan_cut] = -2*(cutoff)
-
                         cutc = catalog[cflag_] > cutoff
 
                     else:
@@ -203,6 +434,7 @@ class Data:
                             'WARNING: Cutoff type must be `above` or `below` - '
                             'you entered `{}`. Ignoring `{}` flag.'
                             .format(cut_type, cflag_))
+                        continue
 
                     mask |= cutc
 
@@ -295,6 +527,15 @@ class Data:
         else:
             delta_ = np.ones(N)
 
+        # Stable cluster IDs, used by incremental refits.
+        if 'id_column' in config and config['id_column'] in catalog:
+            ids = np.asarray(catalog[config['id_column']])
+        else:
+            ids = np.arange(N)
+
+        # Catalog row of every cluster, to look up other columns later.
+        rows = np.arange(N)
+
         # Cut out any NaNs
         cuts = np.where( (~np.isnan(x)) &
                          (~np.isnan(y)) &
@@ -319,15 +560,28 @@ class Data:
         y_err_low = y_err_low[cuts]
         y_err_high = y_err_high[cuts]
         delta_ = delta_[cuts]
+        ids = ids[cuts]
+        rows = rows[cuts]
 
-        # Scale data
-        if config['scale_x_by_ez'] == True:
+        # Scale data (and errors) by E(z)^power, see cosmolib. Never in
+        # place, so catalog columns are left alone.
+        if config['scale_x_by_ez'] == True or config['scale_y_by_ez'] == True:
+            import cosmolib
+
+            cosmology = cosmolib.Cosmology.from_config(config)
             redshift = config['Redshift']
-            x /= Ez(catalog[redshift][cuts])
+
+        if config['scale_x_by_ez'] == True:
+            power = config['ez_power_x'] if 'ez_power_x' in config else -1
+            scale = cosmolib.ez_scaling(catalog, redshift, cosmology, power)[cuts]
+            x, x_err = x * scale, x_err * scale
+            x_err_low, x_err_high = x_err_low * scale, x_err_high * scale
 
         if config['scale_y_by_ez'] == True:
-            redshift = config['Redshift']
-            y /= Ez(catalog[redshift][cuts])
+            power = config['ez_power_y'] if 'ez_power_y' in config else -1
+            scale = cosmolib.ez_scaling(catalog, redshift, cosmology, power)[cuts]
+            y, y_err = y * scale, y_err * scale
+            y_err_low, y_err_high = y_err_low * scale, y_err_high * scale
 
         # Set all masked values to negative one.
         mask = self.create_cuts(config, catalog)
@@ -354,6 +608,8 @@ class Data:
         self.y_err_low = y_err_low[good_rows]
         self.y_err_high = y_err_high[good_rows]
         self.delta_ = delta_[good_rows]
+        self.ids = ids[good_rows]
+        self.rows = rows[good_rows]
 
         print('Accepted {} data out of {}\n'.format(np.size(self.x), N))
 
@@ -382,12 +638,22 @@ class Data:
 class Fitter:
     """Runs linmix alogirthm using the regression library."""
 
-    def __init__(self, data, config):
+    def __init__(self, data, config, init=None, progress=None):
         """ Here we can use the super method to inherit 
             the attributes from the Data class.
+
+            init: optional dictionary of 'alpha', 'beta' and 'sigsqr' draws
+                  to warm-start the sampler from, e.g. a previous posterior.
+            progress: optional function called with every telemetry line (a
+                      dictionary, see telemlib.Telemetry) instead of writing
+                      them to the `telemetry` file.
         """
 
-        self.algorithm = 'linmix'
+        # 'linmix' (Gibbs sampling), 'map' (MAP fit with Laplace errors) or
+        # 'tempering' (parallel tempering, see ptlib).
+        self.algorithm = config['fit_method'] if 'fit_method' in config else 'linmix'
+        if self.algorithm not in ('linmix', 'map', 'tempering'):
+            raise ValueError(f'Unknown fit_method `{self.algorithm}`.')
         self.data_x = data.x
         self.data_y = data.y
         self.data_x_err_obs = data.x_err
@@ -398,8 +664,45 @@ class Fitter:
         self.data_y_err_high_obs = data.y_err_high
         self.data_xlabel = data.xlabel
         self.data_ylabel = data.ylabel
+        self.data_delta = data.delta_
         self._constant = config['scale_line']
+        # Minimum and maximum MCMC iterations passed to linmix.
+        self.Nmin = config['Nmin'] if 'Nmin' in config else 5000
+        self.Nmax = config['Nmax'] if 'Nmax' in config else 10000
+        if init is not None and 'warm_Nmin' in config and self.algorithm == 'linmix':
+            self.Nmin = config['warm_Nmin']
+        # Binned posteriors for the corner plot, see plotlib.corner_histograms
+        self.corner_hists = {}
         self.log_data(config)
+        self.init = self._shift_init(init)
+        # Directory for disk-backed chains, see iolib.ChainStore.
+        self.chain_store = config['chain_store'] if 'chain_store' in config else None
+        # Streaming percentiles of the line without (False) and with (True)
+        # intrinsic scatter at every scaled_x point, see _bandQuantiles.
+        self.bands = {}
+        self.stream_bands = config['stream_bands'] if 'stream_bands' in config else False
+        # (first, last) iteration the bands were streamed from, or None if
+        # they are built from the chains.
+        self._streamed = None
+        # JSON-lines progress stream of the sampler, see telemlib.Telemetry.
+        self.telemetry = config['telemetry'] if 'telemetry' in config else None
+        self.progress = progress
+        self.telemetry_interval = (config['telemetry_interval']
+                                   if 'telemetry_interval' in config else 10.)
+        # Residuals beyond this many sigma count as outlying.
+        self.outlier_nsigma = config['outlier_nsigma'] if 'outlier_nsigma' in config else 3.
+        self._residual_scores = None
+        # Posterior samples used by the posterior predictive check, and the
+        # seed of its replicas.
+        self.ppc_samples = config['ppc_samples'] if 'ppc_samples' in config else 2000
+        self.ppc_seed = config['ppc_seed'] if 'ppc_seed' in config else 0
+        self._ppc = None
+        # Temperatures per ladder and independent ladders (processes) for
+        # fit_method `tempering`, and the exchange statistics and evidence
+        # of that run.
+        self.pt_temps = config['pt_temps'] if 'pt_temps' in config else 20
+        self.pt_ladders = config['pt_ladders'] if 'pt_ladders' in config else 2
+        self.tempering = None
         self.fit(data)
         self.scaled_fit_to_data()
         return
@@ -407,23 +710,121 @@ class Fitter:
     def fit(self, data):
         '''
         Calculates fit parameters using the Kelly method (linmix) and returns
-        intercept, slope, and sigma_sqr.
+        intercept, slope, and sigma_sqr. With fit_method `map` the chains are
+        instead Nmin draws from the Laplace approximation around the MAP fit
+        of the same model (see reglib.run_map); with `tempering` they are the
+        beta = 1 chains of parallel tempering ladders (see ptlib).
         '''
 
-        self.kelly_b, self.kelly_m, self.kelly_sigsqr = reglib.run_linmix(
+        start = time.perf_counter()
+        # Sampler iterations summed over all chains; none for `map`.
+        self.mcmc_iterations = None
+
+        if self.algorithm == 'tempering':
+            import ptlib
+
+            if self.init is not None:
+                print('WARNING: fit_method `tempering` cannot be warm-started; '
+                      'the previous posterior is ignored.')
+            if self.chain_store:
+                print('WARNING: fit_method `tempering` keeps its chains in '
+                      'memory; `chain_store` is ignored.')
+            telemetry = self._telemetry(None)
+            self.tempering = ptlib.run_tempering(x=self.log_x,
+                                                 y=self.log_y,
+                                                 err_x=self.log_x_err,
+                                                 err_y=self.log_y_err,
+                                                 delta=data.delta_,
+                                                 Nmin=self.Nmin,
+                                                 Nmax=self.Nmax,
+                                                 ntemps=self.pt_temps,
+                                                 nladders=self.pt_ladders)
+            self.kelly_b = self.tempering['alpha']
+            self.kelly_m = self.tempering['beta']
+            self.kelly_sigsqr = self.tempering['sigma']
+            self.mcmc_iterations = (self.tempering['niter']
+                                    * np.size(self.tempering['betas']))
+            if telemetry is not None:
+                telemetry.niter = self.tempering['niter']
+                telemetry.close()
+        elif self.algorithm == 'map':
+            if self.init is not None:
+                print('WARNING: fit_method `map` cannot be warm-started; '
+                      'the previous posterior is ignored.')
+            telemetry = self._telemetry(None)
+            self.kelly_b, self.kelly_m, self.kelly_sigsqr = reglib.run_map(
+                                                            x=self.log_x,
+                                                            y=self.log_y,
+                                                            err_x=self.log_x_err,
+                                                            err_y=self.log_y_err,
+                                                            delta=data.delta_,
+                                                            nsamples=self.Nmin)
+            if telemetry is not None:
+                telemetry.close()
+        else:
+            callbacks = []
+            if self.stream_bands:
+                # Fill the band histograms while sampling.
+                self.bands = {
+                    s: reglib.HistogramQuantiles(len(self.scaled_x))
+                    for s in (False, True)
+                }
+                callbacks.append(self._streamBands)
+                self._streamed = None
+            telemetry = self._telemetry(self.telemetry_interval)
+            if telemetry is not None:
+                callbacks.append(telemetry)
+
+            def callback(niter, block):
+                for c in callbacks:
+                    c(niter, block)
+            if not callbacks:
+                # Let linmix run its own sampling loop.
+                callback = None
+
+            stats = {}
+            self.kelly_b, self.kelly_m, self.kelly_sigsqr = reglib.run_linmix(
                                                             x=self.log_x,
                                                             y=self.log_y,
                                                             err_x=self.log_x_err,
                                                             err_y=self.log_y_err,
-                                                            delta=data.delta_)
+                                                            delta=data.delta_,
+                                                            Nmin=self.Nmin,
+                                                            Nmax=self.Nmax,
+                                                            init=self.init,
+                                                            callback=callback,
+                                                            store=self.chain_store,
+                                                            stats=stats)
+            self.mcmc_iterations = stats['niter'] * stats['nchains']
+            if telemetry is not None:
+                telemetry.close()
+            if self.stream_bands and (not self._streamed
+                                      or self._streamed[0] != self._streamed[1] // 2):
+                # The chains ran past Nmin, so the histograms hold draws that
+                # are not in the returned second half; rebuild from the chains.
+                self.bands = {}
+                self._streamed = None
 
         self.mean_int = np.mean(self.kelly_b)
         self.mean_slope = np.mean(self.kelly_m)
         self.mean_sigsqr = np.mean(self.kelly_sigsqr)
 
-        
+        # Wall time spent fitting, reported by `--profile`.
+        self.fit_seconds = time.perf_counter() - start
+
         return
 
+    def _shift_init(self, init):
+        '''Moves warm-start intercepts from their old pivot to this one.'''
+
+        if init is None or 'piv' not in init:
+            return init
+
+        init = dict(init)
+        init['alpha'] = init['alpha'] + init['beta'] * (self.piv - init.pop('piv'))
+
+        return init
+
     def log_data(self, config):
         ''' Scale data to log'''
 
@@ -443,6 +844,9 @@ class Fitter:
         self.xmin = np.min(self.log_x)
         self.xmax = np.max(self.log_x)
 
+        # Grid the fitted line and its bands are evaluated on.
+        self.scaled_x = np.linspace(1.5*self.xmin, 1.5*self.xmax, len(self.log_x))
+
         self.log_x_err = np.log(self.data_x_err_obs + self.data_x) - xlog
         self.log_y_err = np.log(self.data_y_err_obs + self.data_y) - self.log_y
 
@@ -452,7 +856,6 @@ class Fitter:
     def scaled_fit_to_data(self):
         ''' Calculate scaled linear values. '''
 
-        self.scaled_x = np.linspace(1.5*self.xmin, 1.5*self.xmax, len(self.log_x))
         scaled_y = self.mean_int + self.mean_slope * self.scaled_x
         scaled_x_errs = np.zeros(len(self.log_x))
         scaled_y_errs = np.ones(len(self.log_y))*self.mean_slope
@@ -478,41 +881,398 @@ class Fitter:
         y = np.exp(yObs)
         return y
 
+    def _addToBands(self, B, M, S):
+        '''Adds the lines of a block of (B, M, S) draws to the band histograms.'''
+
+        y = B[:, None] + M[:, None] * self.scaled_x[None, :]
+        self.bands[False].update(y)
+
+        # One draw of intrinsic scatter per sample, shared along the line.
+        y += np.random.normal(0.0, np.sqrt(S))[:, None]
+        self.bands[True].update(y)
+
+        return
+
+    def _telemetry(self, interval):
+        '''
+        telemlib.Telemetry stream of this fit, or None without `telemetry`
+        or a `progress` function. Fits that do not report progress while
+        sampling use interval=None.
+        '''
+
+        if not self.telemetry and self.progress is None:
+            return None
+
+        import telemlib
+
+        return telemlib.Telemetry(
+            self.telemetry, label=f'{self.data_ylabel}-{self.data_xlabel}',
+            interval=interval, Nmin=self.Nmin, Nmax=self.Nmax, sink=self.progress)
+
+    def _streamBands(self, niter, block):
+        '''
+        run_linmix callback adding each block of draws past Nmin/2 to the band
+        histograms, recording the iterations streamed in self._streamed. This
+        is the posterior linmix returns whenever the chains converge by Nmin;
+        longer runs return fewer draws and the histograms are rebuilt from
+        the chains instead (see fit).
+        '''
+
+        if niter <= self.Nmin // 2:
+            return
+
+        start = self._streamed[0] if self._streamed else niter - np.shape(block['alpha'])[1]
+        self._streamed = (start, niter)
+        self._addToBands(np.ravel(block['alpha']), np.ravel(block['beta']),
+                         np.sqrt(np.ravel(block['sigsqr'])))
+
+        return
+
+    def _bandQuantiles(self, scatter=False, budget=2**27):
+        '''
+        Streaming percentiles of the fitted line (plus a draw of intrinsic
+        scatter per sample if `scatter`) at every scaled_x point. Unless they
+        were filled while sampling (`stream_bands`), the histograms are built
+        in one pass over the chains, in sample blocks small enough that the
+        samples x grid block stays below `budget` bytes.
+        '''
+
+        if scatter not in self.bands:
+            self.bands = {
+                s: reglib.HistogramQuantiles(len(self.scaled_x))
+                for s in (False, True)
+            }
+            nrow = max(1, budget // (8 * len(self.scaled_x)))
+            for start in range(0, np.size(self.kelly_b), nrow):
+                end = start + nrow
+                self._addToBands(np.asarray(self.kelly_b[start:end]),
+                                 np.asarray(self.kelly_m[start:end]),
+                                 np.asarray(self.kelly_sigsqr[start:end]))
+
+        return self.bands[scatter]
+
+    def residual_scores(self):
+        '''
+        Per-cluster residual posteriors and outlier scores over the full
+        chains (see reglib.residual_scores), computed once and cached.
+        '''
+
+        if self._residual_scores is None:
+            self._residual_scores = reglib.residual_scores(
+                self.log_x, self.log_y, self.log_x_err, self.log_y_err,
+                self.kelly_b, self.kelly_m, self.kelly_sigsqr,
+                delta=self.data_delta, nsigma=self.outlier_nsigma)
+
+        return self._residual_scores
+
+    def posterior_predictive(self):
+        '''
+        Posterior predictive check of the fit over `ppc_samples` posterior
+        samples (see ppclib.posterior_predictive), computed once and cached.
+        '''
+
+        if self._ppc is None:
+            import ppclib
+
+            self._ppc = ppclib.posterior_predictive(
+                self.log_x, self.log_y, self.log_x_err, self.log_y_err,
+                self.kelly_b, self.kelly_m, self.kelly_sigsqr,
+                delta=self.data_delta, nsamples=self.ppc_samples,
+                seed=self.ppc_seed)
+
+        return self._ppc
+
     def confInterval(self, low, high):
         "This method will calculate confidence interval from y distribution."
 
-        y = []
-        _x = np.linspace(1.5*self.xmin, 1.5*self.xmax, len(self.log_x))
-        for i, s in zip(self.kelly_b, self.kelly_m):
-            y += [i + s * self.scaled_x]
-
-        y = np.array(y)
-        yMed = np.percentile(y, 50, axis=0)
-        yLow = np.percentile(y, low, axis=0)
-        yUp  = np.percentile(y, high, axis=0)
+        yMed, yLow, yUp = self._bandQuantiles().percentiles([50, low, high])
 
         return yMed, yUp, yLow
 
     def sigmaBands(self, low, high):
         " This method calulates sigma bands."
 
-        y = []
-        _x = np.linspace(1.5*self.xmin, 1.5*self.xmax, len(self.log_x))
-        for i, s, sig in zip(self.kelly_b, self.kelly_m, np.sqrt(self.kelly_sigsqr)):
-            y += [i + s * self.scaled_x + np.random.normal(0.0, sig)]
-
-        y = np.array(y)
-        yMed = np.percentile(y, 50, axis=0)
-        yLow = np.percentile(y, low, axis=0)
-        yUp = np.percentile(y, high, axis=0)
-        # print (yMed-yLow)[::5]
-        # print (yUp-yMed)[::5]
+        yMed, yLow, yUp = self._bandQuantiles(scatter=True).percentiles([50, low, high])
+
         return yMed, yUp, yLow
 
+def joint_data(config, catalog, axes):
+    """
+    Data for every y axis in `axes`, against config.x, holding only the
+    clusters that pass the cuts of all of them, in the same order. The
+    error columns of each axis come from `y_err_columns` in the config
+    (axis -> [low, high]); the main y axis may use `ylabel_err_low/high`.
+    """
+
+    err_columns = config['y_err_columns'] if 'y_err_columns' in config else None
+    err_columns = err_columns or {}
+
+    datas = []
+    for axis in axes:
+        if axis in err_columns:
+            low, high = err_columns[axis]
+        elif axis == config.y:
+            low, high = config['ylabel_err_low'], config['ylabel_err_high']
+        else:
+            raise SystemExit(
+                f'ERROR: No error columns for `{axis}`; add it to `y_err_columns`.')
+
+        axis_config = Config.from_dict(
+            dict(config.to_dict(), ylabel_err_low=low, ylabel_err_high=high),
+            config.x, axis, config.prefix)
+        print(f'Cutting {axis}:')
+        datas.append(Data(axis_config, catalog))
+
+    # Clusters kept for every response, by catalog row.
+    common = datas[0].rows
+    for d in datas[1:]:
+        common = np.intersect1d(common, d.rows)
+    print(f'{np.size(common)} clusters pass the cuts of all {len(axes)} responses\n')
+
+    return [d.take(np.searchsorted(d.rows, common)) for d in datas]
+
+class JointFitter:
+    """
+    Fits several responses against one x in a single sampler (see
+    reglib.run_joint_linmix), sharing the covariate draws. Chains have a
+    column per response; kelly_cov holds the intrinsic scatter covariance
+    and kelly_corr its correlation matrices, e.g. the `r` of
+    eslib.obsScalingRelation.
+    """
+
+    def __init__(self, datas, config):
+        self.datas = datas
+        self.data_xlabel = datas[0].xlabel
+        self.data_ylabels = [d.ylabel for d in datas]
+        self.Nmin = config['Nmin'] if 'Nmin' in config else 5000
+        self.Nmax = config['Nmax'] if 'Nmax' in config else 10000
+        # The joint sampler only reports its start and end, see telemlib.
+        self.telemetry = config['telemetry'] if 'telemetry' in config else None
+
+        x = np.asarray(datas[0].x, dtype=float)
+        if config['piv_type'] == 'median':
+            self.piv = np.log(np.median(x))
+        else:
+            self.piv = np.log(config['piv_value'])
+
+        # Same log transform as Fitter.log_data, one column per response.
+        self.log_x = np.log(x) - self.piv
+        self.log_x_err = np.log(np.asarray(datas[0].x_err) + x) - np.log(x)
+        y = np.column_stack([np.asarray(d.y, dtype=float) for d in datas])
+        y_err = np.column_stack([np.asarray(d.y_err, dtype=float) for d in datas])
+        self.log_y = np.log(y)
+        self.log_y_err = np.log(y_err + y) - self.log_y
+        self.delta = np.column_stack([d.delta_ for d in datas])
+
+        self.fit()
+
+        return
+
+    def fit(self):
+        start = time.perf_counter()
+
+        telemetry = None
+        if self.telemetry:
+            import telemlib
+
+            telemetry = telemlib.Telemetry(
+                self.telemetry,
+                label='{}-{}'.format('+'.join(self.data_ylabels), self.data_xlabel),
+                interval=None, Nmin=self.Nmin, Nmax=self.Nmax)
+
+        stats = {}
+        chains = reglib.run_joint_linmix(self.log_x, self.log_y, self.log_x_err,
+                                         self.log_y_err, delta=self.delta,
+                                         Nmin=self.Nmin, Nmax=self.Nmax,
+                                         stats=stats)
+        if telemetry is not None:
+            telemetry.niter = stats['niter']
+            telemetry.close()
+
+        self.kelly_b = chains['alpha']
+        self.kelly_m = chains['beta']
+        self.kelly_cov = chains['cov']
+        # Intrinsic scatter (not variance) of each response, as in Fitter.
+        self.kelly_sigsqr = np.sqrt(np.diagonal(chains['cov'], axis1=1, axis2=2))
+        self.kelly_corr = (self.kelly_cov / self.kelly_sigsqr[:, :, None]
+                           / self.kelly_sigsqr[:, None, :])
+
+        self.fit_seconds = time.perf_counter() - start
+
+        return
+
+    def summary(self):
+        """Table of every relation and the scatter correlations."""
+
+        lines = ['{:<32} {:>18} {:>18} {:>18}'.format(
+            f'Response (vs {self.data_xlabel})'[:32], 'Intercept', 'Slope', 'Sigma')]
+        for j, label in enumerate(self.data_ylabels):
+            lines.append('{:<32}'.format(label[:32]) + ''.join(
+                ' {:>18}'.format('{:.4g} +/- {:.2g}'.format(
+                    np.mean(c[:, j]), np.std(c[:, j])))
+                for c in (self.kelly_b, self.kelly_m, self.kelly_sigsqr)))
+
+        M = len(self.data_ylabels)
+        for j in range(M):
+            for k in range(j+1, M):
+                r = self.kelly_corr[:, j, k]
+                lines.append('Scatter correlation r({}, {}) = {:.3f} +/- {:.3f}'.format(
+                    self.data_ylabels[j], self.data_ylabels[k], np.mean(r), np.std(r)))
+
+        return '\n'.join(lines)
+
+    def save(self, filename):
+        """Writes the chains, pivot and labels to an .npz file."""
+
+        np.savez(filename, piv=self.piv, xlabel=self.data_xlabel,
+                 ylabels=np.array(self.data_ylabels), intercept=self.kelly_b,
+                 slope=self.kelly_m, sigma=self.kelly_sigsqr, cov=self.kelly_cov,
+                 corr=self.kelly_corr)
+
+        return
+
+class FitResult:
+    """
+    Chains and summary statistics of a single fit, as returned by run_fit().
+    """
+
+    def __init__(self, fitter):
+        self.fitter = fitter
+        self.xlabel = fitter.data_xlabel
+        self.ylabel = fitter.data_ylabel
+        self.piv = fitter.piv
+        self.intercept = fitter.kelly_b
+        self.slope = fitter.kelly_m
+        self.sigma = fitter.kelly_sigsqr
+
+        return
+
+    @property
+    def chains(self):
+        return {
+            'intercept': self.intercept,
+            'slope': self.slope,
+            'sigma': self.sigma,
+        }
+
+    def summary(self):
+        """Mean, standard deviation and 16/50/84 percentiles of each chain."""
+
+        stats = {}
+        for name, chain in self.chains.items():
+            p16, p50, p84 = np.percentile(chain, [16, 50, 84])
+            stats[name] = {
+                'mean': np.mean(chain),
+                'std': np.std(chain),
+                'median': p50,
+                'p16': p16,
+                'p84': p84,
+            }
+
+        return stats
+
+    def __repr__(self):
+        s = self.summary()
+        return (
+            'FitResult({} vs {}: intercept={:.3g}, slope={:.3g}, sigma={:.3g})'
+            .format(self.ylabel, self.xlabel, s['intercept']['mean'],
+                    s['slope']['mean'], s['sigma']['mean'])
+        )
+
+def run_fit(table_or_arrays, config_dict, x, y, prefix=None, progress=None):
+    """
+    Runs a fit in-process, without YAML or FITS round-trips.
+
+    table_or_arrays may be a Catalog, an astropy Table, a structured array or
+    a dictionary of column arrays; config_dict is a plain dictionary with the
+    same keys as config.yml. Sampler progress is passed to `progress`, see
+    Fitter. Returns a FitResult.
+    """
+
+    config = Config.from_dict(config_dict, x, y, prefix)
+
+    if isinstance(table_or_arrays, Catalog):
+        catalog = table_or_arrays
+    else:
+        catalog = Catalog.from_table(table_or_arrays)
+
+    data = Data(config, catalog)
+
+    fitter = Fitter(data, config, progress=progress)
+
+    return FitResult(fitter)
+
+# Config keys that decide which clusters are kept and how they are scaled. An
+# incremental refit is only valid if they match the previous run.
+data_config_keys = ('Column_Names', 'xlabel_err_low', 'xlabel_err_high',
+                    'ylabel_err_low', 'ylabel_err_high', 'Censored',
+                    'Bool_Flag', 'Cutoff_Flag', 'Range_Flag', 'scale_x_by_ez',
+                    'scale_y_by_ez', 'ez_power_x', 'ez_power_y', 'Om', 'Redshift',
+                    'id_column')
+
+def incremental_data(config, catalog, archive):
+    """
+    Builds Data for an incremental refit against a previous run's archive
+    (see iolib). Only catalog rows whose `id_column` value the previous run
+    had not seen are cut; the survivors are appended to the archived data.
+    Rows edited in place under an existing ID are not picked up.
+
+    Returns the combined Data and the previous posterior to warm-start the
+    Fitter from, or (None, None) if the archive does not match this config.
+    """
+
+    old = archive.config
+
+    if ('id_column' not in config or config['id_column'] not in catalog
+            or 'seen_ids' not in archive):
+        print('WARNING: Incremental refits need `id_column` in the config '
+              'and in the previous run. Running a full fit.')
+        return None, None
+
+    changed = [
+        k for k in data_config_keys
+        if old.get(k) != (config[k] if k in config else None)
+    ]
+    if list(archive['config_axes']) != [config.x, config.y] or changed:
+        print('WARNING: The previous run used different axes or cuts ({}). '
+              'Running a full fit.'.format(', '.join(changed) or 'axes'))
+        return None, None
+
+    from iolib import data_arrays
+
+    previous = Data.from_arrays(
+        str(archive['xlabel']), str(archive['ylabel']),
+        **{attr: archive[name] for name, attr in data_arrays.items()}
+    )
+
+    ids = np.asarray(catalog[config['id_column']])
+    new = ~np.isin(ids, archive['seen_ids'])
+    print(f'Found {np.count_nonzero(new)} new clusters out of {len(ids)}.')
+
+    datas = [previous]
+    if np.any(new):
+        try:
+            datas.append(Data(config, catalog.take(new)))
+        except SystemExit:
+            print('No new clusters survived flag removal.')
+
+    data = Data.concatenate(datas)
+
+    init = {
+        'alpha': archive['chain_intercept'],
+        'beta': archive['chain_slope'],
+        'sigsqr': np.asarray(archive['chain_sigma'])**2,
+        'piv': archive['piv'],
+    }
+
+    return data, init
+
 class Banner():
     """Contains Program Banner"""
 
     def __init__(self):
+        import pyfiglet as pfig
+
         #CluStR Banner
         ascii_banner = pfig.figlet_format("CluStR")
         print(ascii_banner)
@@ -526,26 +1286,203 @@ class Banner():
         print("-----------------------------------")
         print("\n")
 
-def main():
+def main_binned(args, config, catalog, data, profiler):
+    '''Binned-fit mode of main(): fits each bin of `--bin-by` in parallel.'''
 
-    #CluStR Banner
-    Banner()
+    import binlib
 
-    #CluStR args
-    args = parser.parse_args()
+    if data.rows is None:
+        raise SystemExit('--bin-by needs a full fit, not --incremental.')
 
-    config = Config(args)
+    column = args.bin_by
+    values = np.asarray(catalog[column])[data.rows]
+    bins = args.bins[0] if len(args.bins) == 1 else args.bins
 
-    catalog = Catalog(args.cat_filename, config)
+    with profiler.stage('Binned fits') as info:
+        try:
+            results = binlib.binned_fits(
+                data, config, values, bins, workers=args.workers,
+                cache_dir=config['bin_cache'] if 'bin_cache' in config else None)
+        except ValueError as e:
+            raise SystemExit(f'ERROR: {e}')
+        info['bins'] = len(results)
+        info['cached'] = sum(bool(r.get('cached')) for r in results)
 
-    data = Data(config, catalog)
+    trends = binlib.trend(results)
+    print('\n' + binlib.report(results, trends, column) + '\n')
+
+    report = 'Trend-{}{}-{}-{}.json'.format(
+        args.prefix, data.ylabel, data.xlabel, column)
+    binlib.write_report(report, results, trends, column)
+    print(f'Wrote binned fits to {report}')
+
+    import plotlib
 
-    fitter = Fitter(data, config)
+    with profiler.stage('plotlib.plot_trend'):
+        plotlib.plot_trend(args, data, results, trends, column)
+
+    if profiler.enabled:
+        profile = args.profile or 'Profile-{}{}-{}.json'.format(
+            args.prefix, data.ylabel, data.xlabel)
+        profiler.write(profile)
+        print('\n' + profiler.summary())
+        print(f'Wrote profile to {profile}')
+
+    print('Done!')
+
+    return
+
+def main_joint(args, config, catalog, profiler):
+    """Joint mode of main(): fits y and the `--joint` axes in one sampler."""
+
+    axes = [args.y] + [a for a in args.joint if a != args.y]
+
+    with profiler.stage('Data') as info:
+        datas = joint_data(config, catalog, axes)
+        info['rows'] = np.size(datas[0].x)
+
+    with profiler.stage('JointFitter') as info:
+        fitter = JointFitter(datas, config)
+        info['fit_seconds'] = fitter.fit_seconds
+        info['samples'] = len(fitter.kelly_b)
+
+    print(f"x-pivot = {fitter.piv}")
+    print(fitter.summary() + '\n')
+
+    filename = 'Joint-{}{}-{}.npz'.format(
+        args.prefix or '', '-'.join(fitter.data_ylabels), fitter.data_xlabel)
+    fitter.save(filename)
+    print(f'Saved joint chains to {filename}')
+
+    if profiler.enabled:
+        report = args.profile or 'Profile-{}{}-{}.json'.format(
+            args.prefix, '-'.join(fitter.data_ylabels), fitter.data_xlabel)
+        profiler.write(report)
+        print('\n' + profiler.summary())
+        print(f'Wrote profile to {report}')
+
+    print('Done!')
+
+    return
+
+def main(argv=None):
+
+    if argv is None:
+        argv = sys.argv[1:]
+
+    if argv and argv[0] in subcommands:
+        return importlib.import_module(subcommands[argv[0]]).main(argv[1:])
+
+    #CluStR args
+    args = build_parser().parse_args(argv)
+
+    #CluStR Banner
+    if not args.no_banner:
+        Banner()
+
+    profiler = proflib.Profiler(enabled=args.profile is not None)
+
+    with profiler.stage('Config'):
+        config = Config(args)
+
+    # Columns needed besides those the config refers to.
+    extra = [args.bin_by] if args.bin_by else []
+
+    # Check the config against the catalog header before loading any data.
+    with profiler.stage('Preflight'):
+        import preflightlib
+
+        try:
+            preflightlib.preflight(config, [args.cat_filename] + args.join,
+                                   joint=args.joint or (), extra=extra)
+        except preflightlib.PreflightError as e:
+            raise SystemExit(f'ERROR: {args.config_file} failed preflight checks:\n{e}')
+
+    with profiler.stage('Catalog') as info:
+        catalog = Catalog([args.cat_filename] + args.join, config, extra=extra)
+        info['rows'] = len(catalog)
+
+    if args.joint:
+        if args.incremental or args.bin_by:
+            raise SystemExit('--joint cannot be combined with --incremental or --bin-by.')
+        return main_joint(args, config, catalog, profiler)
+
+    data, init = None, None
+    with profiler.stage('Data') as info:
+        if args.incremental:
+            import iolib
+
+            with iolib.open_archive(args.incremental) as archive:
+                data, init = incremental_data(config, catalog, archive)
+        if data is None:
+            data = Data(config, catalog)
+        info['rows'] = np.size(data.x)
+
+    if args.bin_by:
+        return main_binned(args, config, catalog, data, profiler)
+
+    # Seed of the subsample and the sampler, for reproducible chains.
+    seed = config['seed'] if 'seed' in config else None
+
+    full_data = None
+    if 'coreset_size' in config and config['coreset_size']:
+        import coresetlib
+
+        # Fit a stratified subsample only, then check it against the rest.
+        with profiler.stage('Coreset') as info:
+            full_data = data
+            data, validation = coresetlib.split(full_data, config['coreset_size'],
+                                                seed=seed)
+            info['rows'] = np.size(data.x)
+
+    with profiler.stage('Fitter') as info:
+        if seed is not None:
+            np.random.seed(seed)
+        fitter = Fitter(data, config, init=init)
+        info['fit_seconds'] = fitter.fit_seconds
+        info['samples'] = np.size(fitter.kelly_b)
+
+    if full_data is not None:
+        with profiler.stage('Coreset validation'):
+            fitter.coreset_report = coresetlib.validate(fitter, full_data, validation)
+        print('\n' + coresetlib.summary(fitter.coreset_report) + '\n')
+
+    if fitter.mcmc_iterations:
+        profiler.metrics['mcmc_iterations_per_s'] = fitter.mcmc_iterations / fitter.fit_seconds
+
+    if config['save_data'] is True:
+        import iolib
+
+        compress = 'compress_archive' in config and config['compress_archive'] is True
+        with profiler.stage('Archive'):
+            if 'corner' in config and config['corner'] is True:
+                import plotlib
+
+                # Bin the corner plot now, so the archive holds it as well.
+                plotlib.corner_histograms(fitter, config)
+            filename = iolib.save_archive(
+                iolib.archive_filename(config), config, data, fitter,
+                catalog=catalog, full_data=full_data, compress=compress)
+        print(f'Saved data and chains to {filename}\n')
 
     print(f"x-pivot = {fitter.piv}")
     print(f"Mean Intercept: {np.mean(fitter.kelly_b)}")
     print(f"Mean Slope: {np.mean(fitter.kelly_m)}")
     print(f"Mean Variance: {np.mean(fitter.kelly_sigsqr)}")
+    outliers = fitter.residual_scores()['outlier_prob'] > 0.5
+    print(f"Likely outliers (beyond {fitter.outlier_nsigma:g} sigma): {np.sum(outliers)}")
+
+    if fitter.tempering is not None:
+        import ptlib
+
+        print('\n' + ptlib.summary(fitter.tempering))
+
+    if 'ppc' in config and config['ppc'] is True:
+        import ppclib
+
+        with profiler.stage('Posterior predictive') as info:
+            info['samples'] = fitter.posterior_predictive()['nsamples']
+        print('\n' + ppclib.summary(fitter.posterior_predictive()))
 
     print('\n')
 
@@ -553,7 +1490,16 @@ def main():
 
     print('\nMaking Plots...')
 
-    plotlib.make_plots(args, config, fitter)
+    import plotlib
+
+    plotlib.make_plots(args, config, fitter, profiler)
+
+    if profiler.enabled:
+        report = args.profile or 'Profile-{}{}-{}.json'.format(
+            args.prefix, fitter.data_ylabel, fitter.data_xlabel)
+        profiler.write(report)
+        print('\n' + profiler.summary())
+        print(f'Wrote profile to {report}')
 
     print('Done!')
 
@@ -0,0 +1,170 @@
+''' Coreset library for CluStR '''
+
+# Approximate fits of very large samples. A stratified subsample of the cut
+# Data (in x and in measurement error) is fit instead of every cluster, and
+# the result is checked against the MAP fit of the full sample and on a
+# held-out validation split of the same design. Enabled by `coreset_size`
+# in config.yml.
+
+import numpy as np
+import reglib
+
+# pylint: disable=invalid-name
+
+params = ('intercept', 'slope', 'sigma')
+
+def strata(data, xbins=10, errbins=4):
+    '''
+    Stratum of every cluster: quantile bins of ln(x) crossed with quantile
+    bins of its total fractional (log-space) error in x and y.
+    '''
+
+    x, y = np.asarray(data.x, dtype=float), np.asarray(data.y, dtype=float)
+    lx = np.log(x)
+    err = np.hypot(np.asarray(data.x_err) / x, np.asarray(data.y_err) / y)
+
+    def qbin(v, n):
+        edges = np.quantile(v, np.linspace(0, 1, n+1)[1:-1])
+        return np.searchsorted(edges, v, side='right')
+
+    return qbin(lx, xbins) * errbins + qbin(err, errbins)
+
+def _allocate(counts, size):
+    '''Splits `size` over strata in proportion to counts (largest remainder).'''
+
+    exact = counts * size / np.sum(counts)
+    n = np.floor(exact).astype(int)
+    short = size - np.sum(n)
+    if short > 0:
+        n[np.argsort(n - exact)[:short]] += 1
+
+    return np.minimum(n, counts)
+
+def split(data, size, validation_size=None, xbins=10, errbins=4, seed=None):
+    # pylint: disable = too-many-arguments
+    # pylint: disable = too-many-locals
+    '''
+    Draws a proportionally allocated stratified subsample of `size` clusters
+    (the coreset) and a disjoint validation split of `validation_size`
+    (default: the same size, or what is left) with the same design. Every
+    cluster is equally likely to be picked, so the subsample needs no
+    weights. Returns (coreset, validation) as Data.
+    '''
+
+    rng = np.random.default_rng(seed)
+
+    N = np.size(data.x)
+    size = min(int(size), N)
+    if validation_size is None:
+        validation_size = size
+    validation_size = min(int(validation_size), N - size)
+
+    s = strata(data, xbins, errbins)
+    nstrata = xbins * errbins
+
+    # Random order within each stratum, from a single sort.
+    order = np.lexsort((rng.random(N), s))
+    s_sorted = s[order]
+    counts = np.bincount(s, minlength=nstrata)
+    starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+    rank = np.arange(N) - starts[s_sorted]
+
+    n_core = _allocate(counts, size)
+    n_val = _allocate(counts - n_core, validation_size)
+
+    core = order[rank < n_core[s_sorted]]
+    val = order[(rank >= n_core[s_sorted])
+                & (rank < (n_core + n_val)[s_sorted])]
+
+    return data.take(np.sort(core)), data.take(np.sort(val))
+
+def log_arrays(data, piv):
+    '''ln-space x, y and errors of Data, as Fitter.log_data computes them.'''
+
+    x, y = np.asarray(data.x, dtype=float), np.asarray(data.y, dtype=float)
+    lx, ly = np.log(x), np.log(y)
+
+    return (lx - piv, ly, np.log(np.asarray(data.x_err) + x) - lx,
+            np.log(np.asarray(data.y_err) + y) - ly)
+
+def validate(fitter, data, validation):
+    '''
+    Compares a coreset fit with the full sample `data`. The full sample is
+    fit with reglib.fit_map (fast even for millions of clusters), and each
+    coreset parameter's shift from it is given in units of the coreset
+    posterior width. The mean log-likelihood per held-out `validation`
+    cluster under the coreset parameters is compared with that under the
+    full fit; a difference near zero means the coreset predicts unseen
+    clusters as well as the full fit does.
+    '''
+
+    full = reglib.fit_map(*log_arrays(data, fitter.piv), delta=data.delta_)
+    theta = full['theta']
+    errors = np.sqrt(np.diag(full['cov']))
+
+    coreset = {
+        'intercept': np.asarray(fitter.kelly_b),
+        'slope': np.asarray(fitter.kelly_m),
+        'sigma': np.asarray(fitter.kelly_sigsqr),
+    }
+    full_values = {
+        'intercept': (theta[0], errors[0]),
+        'slope': (theta[1], errors[1]),
+        # sigma = exp(ln sigma), to first order.
+        'sigma': (np.exp(theta[2]), np.exp(theta[2]) * errors[2]),
+    }
+
+    report = {
+        'n_full': int(np.size(data.x)),
+        'n_coreset': int(np.size(fitter.data_x)),
+        'n_validation': int(np.size(validation.x)),
+    }
+    for p in params:
+        mean, std = np.mean(coreset[p]), np.std(coreset[p])
+        value, err = full_values[p]
+        report[p] = {
+            'coreset': float(mean),
+            'coreset_std': float(std),
+            'full': float(value),
+            'full_err': float(err),
+            'shift_sigma': float((mean - value) / std) if std > 0 else np.nan,
+        }
+
+    if report['n_validation'] > 0:
+        arrays = log_arrays(validation, fitter.piv)
+
+        core_theta = np.array(theta)
+        core_theta[:3] = (report['intercept']['coreset'],
+                          report['slope']['coreset'],
+                          np.log(report['sigma']['coreset']))
+
+        n = report['n_validation']
+        report['validation_loglike'] = {
+            'coreset': float(reglib.kelly_loglike(
+                core_theta, *arrays, delta=validation.delta_) / n),
+            'full': float(reglib.kelly_loglike(
+                theta, *arrays, delta=validation.delta_) / n),
+        }
+
+    return report
+
+def summary(report):
+    '''Human-readable coreset validation report.'''
+
+    lines = ['Coreset of {} out of {} clusters, validated on {} more:'.format(
+        report['n_coreset'], report['n_full'], report['n_validation'])]
+    for p in params:
+        r = report[p]
+        lines.append(
+            '  {:<9} coreset {:.4g} +/- {:.2g}, full (MAP) {:.4g} +/- {:.2g}: '
+            'shift {:+.2f} sigma'.format(p, r['coreset'], r['coreset_std'],
+                                         r['full'], r['full_err'],
+                                         r['shift_sigma']))
+    if 'validation_loglike' in report:
+        v = report['validation_loglike']
+        lines.append(
+            '  Held-out log-likelihood per cluster: coreset {:.5f}, '
+            'full {:.5f} (difference {:+.2e})'.format(
+                v['coreset'], v['full'], v['coreset'] - v['full']))
+
+    return '\n'.join(lines)
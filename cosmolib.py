@@ -0,0 +1,68 @@
+''' Cosmology library for CluStR '''
+
+# E(z) = H(z)/H_0 scaling of cluster observables, for a flat LambdaCDM
+# cosmology set by `Om` and `H_0` in config.yml. Axes are multiplied by
+# E(z)^power (`ez_power_x`/`ez_power_y`, e.g. -1 for luminosities, -2/3 for
+# temperatures) when `scale_x_by_ez`/`scale_y_by_ez` are set. The scaling
+# column is computed once per catalog, cosmology and power and then shared by
+# every fit on that catalog in the process.
+
+import threading
+import weakref
+import numpy as np
+
+# pylint: disable=invalid-name
+
+class Cosmology:
+    """Flat LambdaCDM cosmology."""
+
+    def __init__(self, Om=0.3, H_0=0.7):
+        if not 0. < Om <= 1.:
+            raise ValueError(f'Om must be in (0, 1], not {Om}.')
+
+        self.Om = float(Om)
+        # Only used for absolute distances; E(z) does not depend on it.
+        self.H_0 = float(H_0)
+
+        return
+
+    @classmethod
+    def from_config(cls, config):
+        """The cosmology of the `Om` and `H_0` config keys."""
+
+        return cls(
+            Om=config['Om'] if 'Om' in config else 0.3,
+            H_0=config['H_0'] if 'H_0' in config else 0.7,
+        )
+
+    def Ez(self, z):
+        """E(z) = H(z)/H_0 = sqrt(Om (1+z)^3 + 1 - Om)."""
+
+        z = np.asarray(z, dtype=float)
+
+        return np.sqrt(self.Om * (1. + z)**3 + (1. - self.Om))
+
+    def __repr__(self):
+        return f'Cosmology(Om={self.Om}, H_0={self.H_0})'
+
+# Scaling columns already computed, per catalog (dropped with the catalog).
+_cache = weakref.WeakKeyDictionary()
+_lock = threading.Lock()
+
+def ez_scaling(catalog, column, cosmology, power):
+    '''
+    E(z)^power for every row of `catalog`, with z from `column`. Cached per
+    catalog, column, cosmology and power; the returned array is read-only,
+    as it is shared between fits.
+    '''
+
+    key = (column, cosmology.Om, float(power))
+
+    with _lock:
+        cached = _cache.setdefault(catalog, {})
+        if key not in cached:
+            scaling = cosmology.Ez(catalog[column]) ** power
+            scaling.flags.writeable = False
+            cached[key] = scaling
+
+        return cached[key]
@@ -0,0 +1,303 @@
+''' Injection-recovery library for CluStR '''
+
+# Measures the bias and credible-interval coverage of the fitted intercept,
+# slope and scatter. Every trial draws a mock sample from a known power law
+# with the measurement errors and censoring pattern of the real (cut) data,
+# and fits it through the same Fitter path as a normal run. Trials run on a
+# process pool, each with its own RNG stream, and every finished trial is
+# appended to a CSV file right away, so an interrupted run keeps its results
+# and is resumed by running the same command again:
+#
+#   python clustr.py inject cat.fits lambda tr2500 config.yml -n 1000 -w 8
+
+from argparse import ArgumentParser, Namespace
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import contextlib
+import csv
+import io
+import json
+import os
+import numpy as np
+
+# pylint: disable=invalid-name
+
+params = ('intercept', 'slope', 'sigma')
+
+# Posterior summaries recorded per parameter and trial.
+stats = ('median', 'mean', 'std', 'lo68', 'hi68', 'lo95', 'hi95')
+
+def draw_mock(data, truth, rng):
+    '''
+    Draws a mock Data from the power law ln(y) = intercept + slope *
+    (ln(x) - piv) + N(0, sigma^2), with `truth` holding the four values.
+    Clusters are resampled from `data` with replacement; each keeps the x
+    of its parent as its true x, and its fractional errors and censoring
+    flag. Observed values scatter by those errors, censored clusters report
+    an upper limit, and mocks with a non-positive x or y are dropped, as
+    they could not be log-transformed.
+    '''
+
+    import clustr
+
+    N = np.size(data.x)
+    idx = rng.integers(N, size=N)
+
+    x_true = np.asarray(data.x, dtype=float)[idx]
+    fx = np.asarray(data.x_err, dtype=float)[idx] / x_true
+    fy = np.asarray(data.y_err, dtype=float)[idx] / np.asarray(data.y, dtype=float)[idx]
+    delta = np.asarray(data.delta_)[idx]
+
+    ln_y = (truth['intercept'] + truth['slope'] * (np.log(x_true) - truth['piv'])
+            + rng.normal(0.0, truth['sigma'], N))
+    y_true = np.exp(ln_y)
+
+    x_err = fx * x_true
+    y_err = fy * y_true
+    x = x_true + rng.normal(0.0, x_err)
+    y = y_true + rng.normal(0.0, y_err)
+
+    # Undetected clusters report an upper limit, as in mocklib.
+    censored = delta == 0
+    y[censored] = y_true[censored] * np.exp(np.abs(rng.normal(0.0, 0.3, np.sum(censored))))
+
+    good = (x > 0) & (y > 0)
+
+    return clustr.Data.from_arrays(
+        data.xlabel, data.ylabel,
+        x=x[good], y=y[good], x_err=x_err[good], y_err=y_err[good],
+        x_err_low=x_err[good], x_err_high=x_err[good],
+        y_err_low=y_err[good], y_err_high=y_err[good],
+        delta_=delta[good], ids=np.asarray(data.ids)[idx][good],
+    )
+
+def run_trial(trial, data, config, truth, seed):
+    '''
+    Worker: draws and fits one mock with the RNG stream `seed` (a
+    SeedSequence). Returns a CSV row of posterior summaries and the truth,
+    with the true intercept moved to the pivot of the mock's fit.
+    '''
+
+    import clustr
+
+    rng = np.random.default_rng(seed)
+    # linmix draws from the global NumPy RNG.
+    np.random.seed(rng.integers(2**32))
+
+    mock = draw_mock(data, truth, rng)
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        fitter = clustr.Fitter(mock, config)
+
+    true = {
+        'intercept': truth['intercept'] + truth['slope'] * (fitter.piv - truth['piv']),
+        'slope': truth['slope'],
+        'sigma': truth['sigma'],
+    }
+    chains = {
+        'intercept': np.asarray(fitter.kelly_b),
+        'slope': np.asarray(fitter.kelly_m),
+        'sigma': np.asarray(fitter.kelly_sigsqr),
+    }
+
+    row = {'trial': trial, 'n': int(np.size(mock.x)), 'fit_seconds': fitter.fit_seconds}
+    for p in params:
+        lo95, lo68, median, hi68, hi95 = np.percentile(
+            chains[p], [2.5, 16, 50, 84, 97.5])
+        row.update({
+            f'{p}_truth': true[p],
+            f'{p}_median': median,
+            f'{p}_mean': np.mean(chains[p]),
+            f'{p}_std': np.std(chains[p]),
+            f'{p}_lo68': lo68,
+            f'{p}_hi68': hi68,
+            f'{p}_lo95': lo95,
+            f'{p}_hi95': hi95,
+        })
+
+    return row
+
+def fieldnames():
+    '''Columns of the trial CSV file.'''
+
+    return ['trial', 'n', 'fit_seconds'] + [
+        f'{p}_{s}' for p in params for s in ('truth',) + stats
+    ]
+
+def read_trials(filename):
+    '''Trials already recorded in a CSV file, as a list of dictionaries.'''
+
+    if not os.path.exists(filename):
+        return []
+
+    with open(filename, 'r', newline='') as f:
+        return [
+            {k: float(v) for k, v in row.items()}
+            for row in csv.DictReader(f)
+        ]
+
+def aggregate(rows):
+    '''
+    Bias, RMS error and coverage of the 68% and 95% credible intervals of
+    every parameter over the trials, using the posterior median as the
+    estimate.
+    '''
+
+    table = {'trials': len(rows)}
+    if not rows:
+        return table
+
+    for p in params:
+        truth = np.array([r[f'{p}_truth'] for r in rows])
+        est = np.array([r[f'{p}_median'] for r in rows])
+        err = est - truth
+
+        table[p] = {
+            'bias': float(np.mean(err)),
+            'bias_err': float(np.std(err) / np.sqrt(len(err))),
+            'rms': float(np.sqrt(np.mean(err**2))),
+            'mean_std': float(np.mean([r[f'{p}_std'] for r in rows])),
+            'coverage68': float(np.mean([
+                r[f'{p}_lo68'] <= r[f'{p}_truth'] <= r[f'{p}_hi68'] for r in rows])),
+            'coverage95': float(np.mean([
+                r[f'{p}_lo95'] <= r[f'{p}_truth'] <= r[f'{p}_hi95'] for r in rows])),
+        }
+
+    return table
+
+def summary(table):
+    '''Human-readable bias and coverage table.'''
+
+    lines = [f"{table['trials']} trials",
+             '{:<10} {:>18} {:>10} {:>10} {:>8} {:>8}'.format(
+                 'Parameter', 'Bias', 'RMS', 'Mean std', 'Cov68', 'Cov95')]
+    for p in params:
+        if p not in table:
+            continue
+        t = table[p]
+        lines.append('{:<10} {:>18} {:>10.4g} {:>10.4g} {:>8.3f} {:>8.3f}'.format(
+            p, '{:+.4f} +/- {:.4f}'.format(t['bias'], t['bias_err']),
+            t['rms'], t['mean_std'], t['coverage68'], t['coverage95']))
+
+    return '\n'.join(lines)
+
+def write_summary(filename, table, truth):
+    '''Writes the aggregate table, replacing the file atomically.'''
+
+    tmp = filename + '.tmp'
+    with open(tmp, 'w') as f:
+        json.dump({'truth': truth, 'table': table}, f, indent=2)
+    os.replace(tmp, filename)
+
+    return
+
+def run(data, config, truth, trials, filename, summary_file, workers=None,
+        seed=0):
+    # pylint: disable = too-many-arguments
+    '''
+    Runs `trials` injection-recovery trials on a pool of `workers` processes.
+    Trial i always uses the i-th child of SeedSequence(seed), so results are
+    reproducible however the trials are scheduled. Trials already in
+    `filename` are skipped; each new one is appended and flushed as soon as
+    it finishes, and the aggregate table in `summary_file` is rewritten.
+    Returns the aggregate table.
+    '''
+
+    rows = read_trials(filename)
+    done = {int(r['trial']) for r in rows}
+    seeds = np.random.SeedSequence(seed).spawn(trials)
+    todo = [i for i in range(trials) if i not in done]
+
+    if done:
+        print(f'Resuming: {len(done)} trials already in {filename}')
+
+    new_file = not os.path.exists(filename)
+    with open(filename, 'a', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=fieldnames())
+        if new_file:
+            writer.writeheader()
+
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = [
+                pool.submit(run_trial, i, data, config, truth, seeds[i])
+                for i in todo
+            ]
+            for future in as_completed(futures):
+                row = future.result()
+                writer.writerow(row)
+                f.flush()
+
+                rows.append(row)
+                write_summary(summary_file, aggregate(rows), truth)
+                print(f"Trial {row['trial']} done ({len(rows)}/{trials})")
+
+    table = aggregate(rows)
+    write_summary(summary_file, table, truth)
+
+    return table
+
+def main(argv=None):
+    import clustr
+    import coresetlib
+    import preflightlib
+    import reglib
+
+    parser = ArgumentParser(prog='clustr.py inject')
+    parser.add_argument('cat_filename', help='FITS catalog whose errors to use')
+    parser.add_argument('x', help='x axis', choices=clustr.valid_axes)
+    parser.add_argument('y', help='y axis', choices=clustr.valid_axes)
+    parser.add_argument('config_file', help='the filename of the config to run')
+    parser.add_argument('-p', '--prefix', help='prefix for output files')
+    parser.add_argument('-n', '--trials', type=int, default=100,
+        help='number of mock fits')
+    parser.add_argument('-w', '--workers', type=int,
+        help='number of fits to run in parallel (default: all CPUs)')
+    parser.add_argument('--seed', type=int, default=0, help='root random seed')
+    parser.add_argument('--intercept', type=float,
+        help='true ln(y) at the pivot (default: MAP fit of the data)')
+    parser.add_argument('--slope', type=float,
+        help='true slope (default: MAP fit of the data)')
+    parser.add_argument('--sigma', type=float,
+        help='true intrinsic scatter (default: MAP fit of the data)')
+    args = parser.parse_args(argv)
+
+    cli = Namespace(config_file=args.config_file, x=args.x, y=args.y,
+                    prefix=args.prefix)
+    config = clustr.Config(cli)
+    try:
+        preflightlib.preflight(config, args.cat_filename)
+    except preflightlib.PreflightError as e:
+        raise SystemExit(f'ERROR: {args.config_file} failed preflight checks:\n{e}')
+    # Per-trial chain stores or streamed bands are not needed.
+    config['chain_store'] = None
+    config['stream_bands'] = False
+
+    catalog = clustr.Catalog(args.cat_filename, config)
+    data = clustr.Data(config, catalog)
+
+    # Default truth: the MAP fit of the real data, at its pivot.
+    if config['piv_type'] == 'median':
+        piv = np.log(np.median(np.asarray(data.x, dtype=float)))
+    else:
+        piv = np.log(config['piv_value'])
+
+    truth = {'piv': float(piv)}
+    given = {'intercept': args.intercept, 'slope': args.slope, 'sigma': args.sigma}
+    if any(v is None for v in given.values()):
+        fit = reglib.fit_map(*coresetlib.log_arrays(data, piv), delta=data.delta_)
+        fitted = dict(zip(params, fit['theta'][:3]))
+        fitted['sigma'] = np.exp(fitted['sigma'])
+        given = {p: v if v is not None else float(fitted[p])
+                 for p, v in given.items()}
+    truth.update(given)
+
+    print('Injecting intercept = {intercept:.4g}, slope = {slope:.4g}, '
+          'sigma = {sigma:.4g} at ln(x_piv) = {piv:.4g}'.format(**truth))
+
+    base = 'Inject-{}{}-{}'.format(args.prefix or '', data.ylabel, data.xlabel)
+    table = run(data, config, truth, args.trials, base + '.csv', base + '.json',
+                workers=args.workers, seed=args.seed)
+
+    print('\n' + summary(table))
+    print(f'Wrote trials to {base}.csv and the summary to {base}.json')
+
+    return
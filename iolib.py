@@ -0,0 +1,349 @@
+''' Results I/O library for CluStR '''
+
+# Each run can be saved to a single `.npz` archive (see `save_data` and
+# `output_filename` in config.yml) holding the post-cut data, the posterior
+# chains, the pivot, convergence diagnostics, per-cluster residual scores and
+# the resolved config (and the binned corner plot, if one was made). Every
+# array is its own member of the archive, so
+# readers only load what they touch, and members of uncompressed archives are
+# memory-mapped:
+#
+#   archive = iolib.open_archive('Test1_lr2500_lambda.npz')
+#   slope = archive['chain_slope']     # read (or mapped) on access
+#   archive.config['piv_type']
+
+import os
+import time
+import zipfile
+import numpy as np
+import reglib
+
+# pylint: disable=invalid-name
+
+# Data arrays stored in the archive, by archive name and Data attribute.
+data_arrays = {
+    'data_x': 'x',
+    'data_y': 'y',
+    'data_x_err': 'x_err',
+    'data_y_err': 'y_err',
+    'data_x_err_low': 'x_err_low',
+    'data_x_err_high': 'x_err_high',
+    'data_y_err_low': 'y_err_low',
+    'data_y_err_high': 'y_err_high',
+    'data_delta': 'delta_',
+    'data_ids': 'ids',
+}
+
+# Per-cluster residual scores, by archive name and Fitter.residual_scores key.
+score_arrays = {
+    'score_residual': 'residual',
+    'score_residual_std': 'residual_std',
+    'score_pvalue': 'pvalue',
+    'score_outlier_prob': 'outlier_prob',
+}
+
+# Posterior chains, by archive name and Fitter attribute.
+chain_arrays = {
+    'chain_intercept': 'kelly_b',
+    'chain_slope': 'kelly_m',
+    'chain_sigma': 'kelly_sigsqr',
+}
+
+# Corner plot summary (see plotlib.corner_histograms), by archive name and
+# summary key. Its 2-D histograms and contour levels are stacked by
+# parameter pair in `corner_hist2d` and `corner_levels`.
+corner_arrays = {
+    'corner_edges': 'edges',
+    'corner_centers': 'centers',
+    'corner_range': 'range',
+    'corner_hist1d': 'hist1d',
+    'corner_quantiles': 'quantiles',
+    'corner_points': 'points',
+}
+
+def archive_filename(config):
+    '''Name of the archive for a config, from `output_filename`.'''
+
+    filename = config['output_filename']
+    if not filename.endswith('.npz'):
+        filename += '.npz'
+
+    return filename
+
+def save_archive(filename, config, data, fitter, catalog=None, compress=False,
+                 full_data=None):
+    '''
+    Writes the post-cut data, chains, pivot, diagnostics, per-cluster
+    residual scores and resolved config of a run to a single `.npz` archive.
+    Members are stored uncompressed, so open_archive() can memory-map them,
+    unless `compress` is set. If the catalog is given and the config sets
+    `id_column`, the IDs of every catalog row are stored as well so later
+    runs can refit incrementally. If `data` is a subsample of `full_data`
+    (a coreset), the clusters left out of the fit are not counted as seen,
+    so an incremental refit adds them back.
+    '''
+
+    import yaml
+
+    arrays = {}
+    for name, attr in data_arrays.items():
+        arrays[name] = np.asarray(getattr(data, attr))
+    for name, attr in chain_arrays.items():
+        arrays[name] = np.asarray(getattr(fitter, attr))
+    scores = fitter.residual_scores()
+    for name, key in score_arrays.items():
+        arrays[name] = scores[key]
+
+    if (catalog is not None and 'id_column' in config
+            and config['id_column'] in catalog):
+        seen = np.asarray(catalog[config['id_column']])
+        if full_data is not None:
+            unfitted = np.setdiff1d(np.asarray(full_data.ids), np.asarray(data.ids))
+            seen = seen[~np.isin(seen, unfitted)]
+        arrays['seen_ids'] = seen
+
+    arrays['piv'] = np.asarray(fitter.piv)
+    arrays['xlabel'] = np.asarray(fitter.data_xlabel)
+    arrays['ylabel'] = np.asarray(fitter.data_ylabel)
+    arrays['created'] = np.asarray(time.time())
+
+    if getattr(fitter, 'corner_hists', None):
+        # The newest binning of the corner plot, and the settings it used.
+        key, summary = list(fitter.corner_hists.items())[-1]
+        for name, field in corner_arrays.items():
+            arrays[name] = np.asarray(summary[field])
+        pairs = sorted(summary['hist2d'])
+        arrays['corner_pairs'] = np.array(pairs)
+        arrays['corner_hist2d'] = np.array([summary['hist2d'][p] for p in pairs])
+        arrays['corner_levels'] = np.array([summary['levels'][p] for p in pairs])
+        arrays['corner_key'] = np.asarray(repr(key))
+
+    if getattr(fitter, 'tempering', None) is not None:
+        arrays['log_evidence'] = np.asarray(fitter.tempering['log_evidence'])
+        arrays['log_evidence_err'] = np.asarray(fitter.tempering['log_evidence_err'])
+
+    diagnostics = reglib.check_convergence(
+        fitter.kelly_b, fitter.kelly_m, fitter.kelly_sigsqr)
+    for param, stats in diagnostics.items():
+        for stat, value in stats.items():
+            arrays[f'diag_{param}_{stat}'] = np.asarray(value)
+
+    arrays['config'] = np.asarray(yaml.safe_dump(config.to_dict()))
+    arrays['config_axes'] = np.asarray([str(config.x), str(config.y)])
+
+    save = np.savez_compressed if compress else np.savez
+    save(filename, **arrays)
+
+    return filename
+
+class Archive:
+    """
+    Lazy reader for a results archive. Members are only read when accessed;
+    uncompressed members are returned as read-only memory maps.
+    """
+
+    def __init__(self, filename, mmap=True):
+        self.filename = filename
+        self.mmap = mmap
+        self._zip = zipfile.ZipFile(filename)
+        self._members = {
+            info.filename[:-len('.npy')]: info
+            for info in self._zip.infolist()
+            if info.filename.endswith('.npy')
+        }
+        self._cache = {}
+
+        return
+
+    def _memmap(self, info):
+        '''Maps a stored (uncompressed) .npy member straight from the file.'''
+
+        with open(self.filename, 'rb') as f:
+            # Skip the zip local file header to reach the .npy payload.
+            f.seek(info.header_offset + 26)
+            name_len, extra_len = np.frombuffer(f.read(4), dtype='<u2')
+            f.seek(info.header_offset + 30 + int(name_len) + int(extra_len))
+
+            version = np.lib.format.read_magic(f)
+            if version == (1, 0):
+                shape, fortran, dtype = np.lib.format.read_array_header_1_0(f)
+            else:
+                shape, fortran, dtype = np.lib.format.read_array_header_2_0(f)
+            offset = f.tell()
+
+        if dtype.hasobject or np.prod(shape) == 0:
+            return None
+
+        return np.memmap(self.filename, dtype=dtype, mode='r', offset=offset,
+                         shape=shape, order='F' if fortran else 'C')
+
+    def __getitem__(self, key):
+        if key in self._cache:
+            return self._cache[key]
+
+        info = self._members[key]
+
+        value = None
+        if self.mmap and info.compress_type == zipfile.ZIP_STORED:
+            value = self._memmap(info)
+        if value is None:
+            with self._zip.open(info) as f:
+                value = np.lib.format.read_array(f)
+
+        if value.ndim == 0:
+            value = value[()]
+
+        self._cache[key] = value
+
+        return value
+
+    def __contains__(self, key):
+        return key in self._members
+
+    def __iter__(self):
+        return iter(self._members)
+
+    def __len__(self):
+        return len(self._members)
+
+    def keys(self):
+        return list(self._members)
+
+    @property
+    def config(self):
+        '''The resolved config of the archived run, as a dictionary.'''
+
+        import yaml
+
+        return yaml.safe_load(str(self['config']))
+
+    @property
+    def chains(self):
+        return {name[len('chain_'):]: self[name] for name in chain_arrays}
+
+    @property
+    def corner(self):
+        '''
+        The corner plot summary of the archived run, as returned by
+        plotlib.corner_histograms (for plotlib.render_corner), or None.
+        '''
+
+        if 'corner_key' not in self:
+            return None
+
+        summary = {field: self[name] for name, field in corner_arrays.items()}
+        pairs = [tuple(int(i) for i in p) for p in self['corner_pairs']]
+        summary['hist2d'] = dict(zip(pairs, self['corner_hist2d']))
+        summary['levels'] = dict(zip(pairs, self['corner_levels']))
+
+        return summary
+
+    def close(self):
+        self._zip.close()
+        self._cache.clear()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __repr__(self):
+        return 'Archive({!r}: {})'.format(self.filename, ', '.join(self._members))
+
+def open_archive(filename, mmap=True):
+    '''Opens a results archive for lazy reading.'''
+
+    return Archive(filename, mmap=mmap)
+
+class ChainStore:
+    """
+    Disk-backed, memory-mapped store for MCMC draws, written block by block
+    while sampling so that memory use does not grow with the chain length.
+    Raw draws are kept as (nchains, capacity) arrays; finalize() writes the
+    second half of every chain, concatenated like linmix, as 1-D `.npy`
+    files and returns them as read-only memory maps.
+
+    Every store gets its own `chains-*` subdirectory of `directory`, so
+    concurrent or successive fits never share files. The finalized chains
+    stay there after the run (they back the returned memory maps); remove
+    the subdirectory once they are no longer needed, e.g. after archiving.
+    """
+
+    params = ('alpha', 'beta', 'sigsqr')
+
+    def __init__(self, directory, nchains, capacity):
+        import tempfile
+
+        os.makedirs(directory, exist_ok=True)
+
+        self.directory = tempfile.mkdtemp(prefix='chains-', dir=directory)
+        self.nchains = nchains
+        self.capacity = capacity
+        self.niter = 0
+        self.raw = {
+            p: np.lib.format.open_memmap(
+                os.path.join(self.directory, f'raw_{p}.npy'), mode='w+',
+                dtype=float, shape=(nchains, capacity))
+            for p in self.params
+        }
+
+        return
+
+    def append(self, block):
+        '''Writes a block of draws, each an (nchains, niter) array.'''
+
+        n = np.shape(block[self.params[0]])[1]
+        if self.niter + n > self.capacity:
+            raise ValueError('ChainStore is full ({} iterations).'
+                             .format(self.capacity))
+
+        for p in self.params:
+            self.raw[p][:, self.niter:self.niter+n] = block[p]
+        self.niter += n
+
+        return
+
+    def second_half(self, p, max_draws=100000):
+        '''
+        Second half of every chain of parameter p, thinned to at most
+        max_draws per chain, as an (nchains, n) array.
+        '''
+
+        start = self.niter // 2
+        stride = max(1, (self.niter - start) // max_draws)
+
+        return np.asarray(self.raw[p][:, start:self.niter:stride])
+
+    def finalize(self, blocksize=2**20):
+        '''
+        Writes the posterior (second halves of all chains) to alpha.npy,
+        beta.npy and sigma.npy, with sigma = sqrt(sigsqr) computed block by
+        block, removes the raw draws and returns the memory-mapped chains.
+        '''
+
+        start = self.niter // 2
+        n = self.niter - start
+
+        chains = {}
+        for p, name, f in (('alpha', 'alpha', None), ('beta', 'beta', None),
+                           ('sigsqr', 'sigma', np.sqrt)):
+            filename = os.path.join(self.directory, f'{name}.npy')
+            out = np.lib.format.open_memmap(
+                filename, mode='w+', dtype=float, shape=(self.nchains*n,))
+            for c in range(self.nchains):
+                for i in range(0, n, blocksize):
+                    j = min(i + blocksize, n)
+                    block = self.raw[p][c, start+i:start+j]
+                    out[c*n+i:c*n+j] = block if f is None else f(block)
+            out.flush()
+            del out
+
+            chains[name] = np.load(filename, mmap_mode='r')
+
+        for p in self.params:
+            filename = self.raw[p].filename
+            del self.raw[p]
+            os.remove(filename)
+
+        return chains
@@ -0,0 +1,155 @@
+''' Catalog join library for CluStR '''
+
+# Joins the catalogs of several pipelines (e.g. XMM and MATCHA outputs) to the
+# main catalog on a cluster key column, so relations between their columns can
+# be fit directly. Configured in config.yml:
+#
+#   Join:
+#       key: ID
+#       how: inner            # or left: keep every main catalog row
+#       catalogs: [xmm.fits, matcha.fits]
+#       columns: []           # more columns to take, besides those the
+#                             # config refers to
+#       cache: join_cache     # directory caching join indices
+#
+# Only the needed columns of the joined catalogs are read (from memory-mapped
+# FITS data). Rows are matched through a sorted index on the key, and the
+# resulting row indices are cached under a digest of the catalog files, so a
+# rerun on unchanged catalogs only gathers columns.
+
+import hashlib
+import os
+import numpy as np
+
+# pylint: disable=invalid-name
+
+def read_columns(filename, names):
+    '''Reads only the named columns of the first table in a FITS file.'''
+
+    from astropy.io import fits
+
+    with fits.open(filename, memmap=True) as hdul:
+        for hdu in hdul:
+            if isinstance(hdu, (fits.BinTableHDU, fits.TableHDU)):
+                available = set(hdu.columns.names)
+                missing = [n for n in names if n not in available]
+                if missing:
+                    raise ValueError(
+                        f'{filename} has no column(s) {", ".join(missing)}.')
+                # Copy, so the arrays outlive the memory map.
+                return {n: np.array(hdu.data.field(n)) for n in names}
+
+    raise ValueError(f'{filename} has no table.')
+
+def match(left_keys, right_keys):
+    '''
+    Row of right_keys matching every left key (-1 if none), through a sorted
+    index of right_keys. Keys must be unique on the right.
+    '''
+
+    right_keys = np.asarray(right_keys)
+    order = np.argsort(right_keys, kind='stable')
+    ordered = right_keys[order]
+
+    dup = ordered[1:] == ordered[:-1]
+    if np.any(dup):
+        raise ValueError('Duplicate join keys, e.g. {!r}.'.format(ordered[1:][dup][0]))
+
+    pos = np.searchsorted(ordered, left_keys)
+    pos = np.minimum(pos, max(len(ordered) - 1, 0))
+    found = (ordered[pos] == left_keys) if len(ordered) else np.zeros(len(left_keys), bool)
+
+    return np.where(found, order[pos], -1)
+
+def index_digest(filenames, key, how):
+    '''Digest of the catalog files (path, size, mtime) and join settings.'''
+
+    h = hashlib.sha256()
+    for filename in filenames:
+        st = os.stat(filename)
+        h.update(f'{os.path.abspath(filename)}\0{st.st_size}\0{st.st_mtime_ns}\0'.encode())
+    h.update(f'{key}\0{how}'.encode())
+
+    return h.hexdigest()
+
+def join_index(main_keys, filenames, key, how='inner', cache_dir=None,
+               main_filename=None):
+    # pylint: disable = too-many-arguments
+    '''
+    Row indices joining the catalogs in `filenames` to the main catalog on
+    `key`. Returns (rows, matches): the main catalog rows kept, and for
+    every joined catalog the matching row of each kept row (-1 where a left
+    join found none). With a cache_dir, indices are stored under
+    index_digest() and reused while the files are unchanged.
+    '''
+
+    if how not in ('inner', 'left'):
+        raise ValueError(f'Join type must be `inner` or `left`, not `{how}`.')
+
+    cache = None
+    if cache_dir and main_filename:
+        os.makedirs(cache_dir, exist_ok=True)
+        digest = index_digest([main_filename] + list(filenames), key, how)
+        cache = os.path.join(cache_dir, f'{digest}.npz')
+        if os.path.exists(cache):
+            with np.load(cache) as f:
+                return f['rows'], [f[f'match{i}'] for i in range(len(filenames))]
+
+    main_keys = np.asarray(main_keys)
+    matches = [
+        match(main_keys, read_columns(filename, [key])[key])
+        for filename in filenames
+    ]
+
+    rows = np.arange(len(main_keys))
+    if how == 'inner':
+        keep = np.all([m >= 0 for m in matches], axis=0) if matches else np.ones(len(rows), bool)
+        rows = rows[keep]
+        matches = [m[keep] for m in matches]
+
+    if cache is not None:
+        tmp = f'{cache}.{os.getpid()}.npz'
+        np.savez(tmp, rows=rows, **{f'match{i}': m for i, m in enumerate(matches)})
+        os.replace(tmp, cache)
+
+    return rows, matches
+
+def gather(values, indices):
+    '''
+    values[indices], with the rows of -1 indices missing: NaN for float
+    columns, masked otherwise.
+    '''
+
+    from astropy.table import MaskedColumn
+
+    missing = indices < 0
+    out = values[np.where(missing, 0, indices)] if len(values) else values[:0]
+    if not np.any(missing):
+        return out
+
+    if np.issubdtype(out.dtype, np.floating):
+        out = out.copy()
+        out[missing] = np.nan
+        return out
+
+    return MaskedColumn(out, mask=missing)
+
+def needed_columns(config, available, extra=()):
+    '''
+    Columns to take from joined catalogs: those the config refers to (see
+    preflightlib.validate_config) and `extra`, that the main catalog, with
+    columns `available`, does not have.
+    '''
+
+    import preflightlib
+
+    joint = list(config['y_err_columns'] or {}) if 'y_err_columns' in config else []
+    _, columns = preflightlib.validate_config(
+        config, getattr(config, 'x', None), getattr(config, 'y', None), joint)
+
+    names = []
+    for name in list(columns) + list(extra):
+        if name not in available and name not in names:
+            names.append(name)
+
+    return names
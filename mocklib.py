@@ -0,0 +1,200 @@
+''' Synthetic catalog library for CluStR '''
+
+# Writes FITS catalogs with the same column names as a CluStR config
+# (observables, their errors, bool/cutoff/range flag columns, redshift and
+# the censoring column), with planted power-law relations between every
+# observable and a latent mass. Used for benchmarks and validation runs:
+#
+#   python clustr.py mock mock.fits config.yml -n 100000
+
+from argparse import ArgumentParser
+import warnings
+import numpy as np
+
+# pylint: disable=invalid-name
+
+# Planted relations ln(Q) = ln(norm) + slope * lnM + N(0, scatter), chosen by
+# the first keyword found in the column name.
+relations = [
+    (('lambda', 'lam'), (40.0, 1.0, 0.2)),
+    (('lumin', 'lx'), (1.0, 1.6, 0.4)),
+    (('temperature', 'kt', 'tx'), (4.0, 0.6, 0.15)),
+    (('sigma',), (600.0, 0.33, 0.1)),
+]
+default_relation = (10.0, 1.0, 0.3)
+
+def planted_relation(column):
+    '''Returns (norm, slope, scatter) of the planted relation for a column.'''
+
+    name = column.lower()
+    for keys, relation in relations:
+        if any(k in name for k in keys):
+            return relation
+
+    return default_relation
+
+def _flag_columns(config):
+    '''Names of the bool, cutoff and range flag columns used by a config.'''
+
+    bools = {}
+    for bflags in config['Bool_Flag'].values():
+        for bflag_, bool_type in (bflags or {}).items():
+            if isinstance(bool_type, bool):
+                bools[bflag_.replace('_bool_type', '')] = bool_type
+
+    cutoffs = {}
+    for cflag_, TFc in config['Cutoff_Flag'].items():
+        if cflag_ == 'Other':
+            continue
+        for cvalues in TFc.values():
+            cutoffs[cflag_] = float(list(cvalues.values())[0])
+            break
+
+    ranges = [r for r in config['Range_Flag'] if r != 'Other']
+
+    return bools, cutoffs, ranges
+
+def make_mock_catalog(n, config, axes=None, censored_frac=0.1, flag_frac=0.03,
+                      nan_frac=0.005, seed=None):
+    '''
+    Draws a synthetic catalog of n clusters as an astropy Table.
+
+    Every column in config['Column_Names'] (or only those of `axes`, to keep
+    very large catalogs in memory) follows the planted power law returned by
+    planted_relation(), with `<column>_err_low/_high` errors as well as the
+    error columns named in the config. Bool flags are set for a fraction
+    `flag_frac` of clusters, cutoff columns scatter around their cut value and
+    range columns are drawn uniformly. A fraction `censored_frac` of the
+    faintest clusters is marked undetected in the censoring column and carries
+    upper limits in every observable but the x axis (the first of `axes`, or
+    the column of `xlabel_err_low`), as CluStR only censors y. A fraction
+    `nan_frac` of the error entries are NaN. The planted
+    slopes and scatters are recorded in the table meta.
+    '''
+
+    from astropy.table import Table
+
+    rng = np.random.default_rng(seed)
+    n = int(n)
+
+    table = Table()
+    table['ID'] = np.arange(1, n+1, dtype=np.int64)
+
+    # Latent log-mass shared by all observables.
+    lnM = rng.normal(0.0, 0.7, n)
+
+    redshift = config['Redshift'] if 'Redshift' in config else 'Redshift'
+    table[redshift] = rng.uniform(0.05, 1.0, n)
+
+    # Faintest clusters are not detected.
+    cenTF = list(config['Censored'].keys())[0]
+    cenName = config['Censored'][cenTF] or 'Detected'
+    detected = lnM + rng.normal(0.0, 0.3, n) > np.quantile(lnM, censored_frac)
+    table[cenName] = detected.astype(np.int64)
+
+    # Error columns named in the config belong to the x/y observables;
+    # everything else gets `<column>_err_low/_high`.
+    column_names = config['Column_Names']
+    if axes is not None:
+        columns = [column_names[a] for a in axes]
+        errors = {
+            column_names[a]: (config[f'{ax}label_err_low'], config[f'{ax}label_err_high'])
+            for a, ax in zip(axes, 'xy')
+        }
+    else:
+        columns = list(dict.fromkeys(column_names.values()))
+        errors = {
+            config[f'{ax}label_err_low'].replace('_err_low', ''):
+                (config[f'{ax}label_err_low'], config[f'{ax}label_err_high'])
+            for ax in 'xy'
+        }
+
+    # Censoring only applies to y; the x observable is always measured.
+    if axes is not None:
+        x_column = column_names[axes[0]]
+    else:
+        x_column = config['xlabel_err_low'].replace('_err_low', '')
+
+    for column in columns:
+        norm, slope, scatter = planted_relation(column)
+        value = norm * np.exp(slope * lnM + rng.normal(0.0, scatter, n))
+
+        frac = rng.uniform(0.05, 0.2, n)
+        err_low = frac * value
+        err_high = frac * value * rng.uniform(0.8, 1.25, n)
+
+        # Undetected clusters report an upper limit on the y observables.
+        inflate = np.exp(np.abs(rng.normal(0.0, 0.3, n)))
+        if column != x_column:
+            value = np.where(detected, value, value * inflate)
+
+        err_low[rng.random(n) < nan_frac] = np.nan
+        err_high[rng.random(n) < nan_frac] = np.nan
+
+        table[column] = value
+        low, high = errors.get(column, (f'{column}_err_low', f'{column}_err_high'))
+        table[low] = err_low
+        table[high] = err_high
+
+        table.meta[f'SLOPE_{column}'[:68]] = slope
+        table.meta[f'SCAT_{column}'[:68]] = scatter
+
+    bools, cutoffs, ranges = _flag_columns(config)
+
+    for bflag, bool_type in bools.items():
+        if bflag == cenName:
+            continue
+        flagged = rng.random(n) < flag_frac
+        table[bflag] = np.where(flagged, bool_type, not bool_type)
+
+    for cflag, cutoff in cutoffs.items():
+        value = np.exp(rng.normal(np.log(1.5*abs(cutoff) + 1e-3), 0.6, n))
+        value[rng.random(n) < nan_frac] = np.nan
+        table[cflag] = value
+
+    for rflag in ranges:
+        if rflag not in table.colnames:
+            table[rflag] = rng.uniform(0.0, 1.0, n)
+
+    return table
+
+def write_mock_catalog(filename, n, config, **kwargs):
+    '''Draws a synthetic catalog and writes it to a FITS file.'''
+
+    from astropy.io.fits.verify import VerifyWarning
+
+    table = make_mock_catalog(n, config, **kwargs)
+
+    # The SLOPE_/SCAT_ meta keys are long and become HIERARCH cards.
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', VerifyWarning)
+        table.write(filename, format='fits', overwrite=True)
+
+    return table
+
+def main(argv=None):
+    import yaml
+
+    parser = ArgumentParser(prog='clustr.py mock')
+    parser.add_argument('filename', help='FITS catalog to write')
+    parser.add_argument('config_file', help='config whose column names to use')
+    parser.add_argument('-n', '--size', type=float, default=1e4,
+        help='number of clusters (1e2 to 1e7)')
+    parser.add_argument('--axes', nargs=2, metavar=('X', 'Y'),
+        help='only write these two observables (saves memory for huge catalogs)')
+    parser.add_argument('--censored-frac', type=float, default=0.1,
+        help='fraction of undetected clusters')
+    parser.add_argument('--seed', type=int, help='random seed')
+    args = parser.parse_args(argv)
+
+    with open(args.config_file, 'r') as stream:
+        config = yaml.safe_load(stream)
+
+    table = write_mock_catalog(args.filename, args.size, config,
+                               axes=args.axes,
+                               censored_frac=args.censored_frac,
+                               seed=args.seed)
+
+    print(f'Wrote {len(table)} clusters to {args.filename}')
+
+    return
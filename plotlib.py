@@ -1,10 +1,8 @@
 '''Plotting library for CluStR '''
 
 import os
-import clustr
-import corner
-import PyPDF2
 import numpy as np
+import proflib
 import matplotlib
 import matplotlib.pyplot as plt
 import scipy.stats as stats
@@ -141,46 +139,38 @@ def plot_scatter(args, fitter, config):
 
 def plot_residuals(args, fitter, config):
     '''
-    FIX: Description
+    Histogram of the per-cluster residuals from the fitted relation, each the
+    posterior mean over the full chains of the residual normalised by the
+    measurement errors and intrinsic scatter (Fitter.residual_scores). These
+    should follow a unit normal; clusters that are likely outliers are
+    shown separately.
     '''
 
-    (lx_obs, ly_obs, _lx_err_obs, _ly_err_obs) = fitter.log_x, fitter.log_y, fitter.log_x_err, fitter.log_y_err
-    _x_piv = fitter.piv
-
-    (B, M, _S) = fitter.kelly_b, fitter.kelly_m, fitter.kelly_sigsqr
-
-    b, m = np.mean(B), np.mean(M)
-
-    # Calculate residuals
-    x_fit = lx_obs
-    y_fit = m*x_fit+b
-    # FIX: Find out which normalization to use!
-    # residuals = (ly_obs - y_fit) / ly_err_obs
-    residuals = (ly_obs - y_fit) / np.std(ly_obs)
-
-    '''
-    # Make residual plot fig1 = plt.figure(1) #Plot Data-model frame1 =
-    fig1.add_axes((.1,.3,.8,.6)) #xstart, ystart, xend, yend [units are
-    fraction of the image frame, from bottom left corner]
-    plt.errorbar(lx_obs, ly_obs, xerr=lx_err_obs, yerr=ly_err_obs, c='r',
-    fmt='o') plt.plot(x_fit,y_fit,'b') #Best fit model
-    frame1.set_xticklabels([]) #Remove x-tic labels for the first frame
-
-    #Residual plot frame2 = fig1.add_axes((.1,.1,.8,.2))
-    plt.plot(lx_obs,residuals,'ob')
-    plt.plot([np.min(lx_obs),np.max(lx_obs)],[0,0],'k--',linewidth=2)
-
-    plt.title('{} Method'.format(method.capitalize()),fontsize=14)
-    '''
+    scores = fitter.residual_scores()
+    residuals = scores['residual']
+    outliers = scores['outlier_prob'] > 0.5
 
     # Bin number
     # FIX: make bins automatically consistent with Michigan group
     nbin = 18
 
     plt.style.use('seaborn')
-    plt.hist(residuals, nbin)
-    plt.xlabel(r'$\Delta(\ln X)/\sigma_{\ln X}$', fontsize=11)
-    plt.ylabel('Count', fontsize=11)
+    fig, ax = plt.subplots()
+
+    bins = np.histogram_bin_edges(residuals, nbin)
+    ax.hist([residuals[~outliers], residuals[outliers]], bins, stacked=True,
+            color=['C0', 'C3'],
+            label=['Clusters', r'Outliers ($P(|r| > {:g}\sigma) > 0.5$)'
+                   .format(fitter.outlier_nsigma)])
+
+    # Expected distribution for a good fit.
+    r = np.linspace(bins[0], bins[-1], 200)
+    ax.plot(r, len(residuals) * np.diff(bins)[0] * stats.norm.pdf(r), 'k--',
+            label=r'$\mathcal{N}(0, 1)$')
+
+    ax.set_xlabel(r'$\Delta(\ln X)/\sigma_{\ln X}$', fontsize=11)
+    ax.set_ylabel('Count', fontsize=11)
+    ax.legend(loc='best', fontsize='x-small')
 
     plt.title(
         '{} Residuals'
@@ -193,65 +183,229 @@ def plot_residuals(args, fitter, config):
         .format(
             args.prefix,
             fitter.data_ylabel,
-            fitter.data_ylabel
+            fitter.data_xlabel
         )
     )
 
     return
 
+def plot_ppc(args, config, fitter):
+    '''
+    Posterior predictive check: for every discrepancy statistic, the
+    histogram over posterior samples of its value for a replicated dataset
+    minus that of the data (Fitter.posterior_predictive). A good fit puts
+    zero well inside the histogram; the p-value is the fraction above it.
+    '''
 
-def plot_corners(args, config, fitter):
+    import ppclib
+
+    result = fitter.posterior_predictive()
+
+    plt.style.use('seaborn')
+    fig, axes = plt.subplots(2, 2, figsize=(9, 7))
+
+    for ax, k in zip(np.ravel(axes), ppclib.statistics):
+        diff = result['replicated'][k] - result['observed'][k]
+        ax.hist(diff, bins=40, color='C0')
+        ax.axvline(0., color='k', linestyle='--')
+        ax.set_xlabel(r'$T(y^{\rm rep}) - T(y)$', fontsize=10)
+        ax.set_title('{}\np = {:.3f}'.format(
+            ppclib.labels[k].format(result['tail']), result['pvalue'][k]),
+            fontsize=10)
+
+    fig.suptitle(
+        '{} vs. {} Posterior Predictive Check'
+        .format(fitter.data_ylabel, fitter.data_xlabel),
+        fontsize=12
+    )
+    fig.tight_layout()
+
+    plt.savefig(
+        'PPC-{}{}-{}.pdf'
+        .format(
+            args.prefix,
+            fitter.data_ylabel,
+            fitter.data_xlabel
+        )
+    )
+
+    return
+
+def corner_histograms(fitter, config, bins=40, smooth=1.0, levels=(0.68, 0.95),
+                      quantiles=(0.16, 0.5, 0.84), npoints=2000,
+                      blocksize=2**20, fine_bins=4096):
     '''
-    Makes corner plots for the desired Kelly method parameter
-    posteriors. Burn is the burn in period parameter.
+    Bins the (B, M, S) posterior for the corner plot in a single vectorized
+    pass and caches the result on the fitter, next to the chains. Returns a
+    dictionary holding the 1-D marginals, the smoothed 2-D histograms with
+    their contour levels, the quantiles and a thinned set of points to draw.
+    Re-rendering with different styling reuses the cached histograms; the
+    results archive stores them too (see plot_archived_corner).
+
+    The chains are read in blocks of `blocksize` samples, so memory-mapped
+    chains are never loaded whole; quantiles come from a `fine_bins`
+    histogram built in the same pass.
     '''
 
     burn = config['burn']
 
-    # FIX: Is this still being used?
-    N = np.size(9)  # Number of subplots
-    n = 1  # Subplot counter
+    key = (burn, bins, smooth, tuple(levels), tuple(quantiles), npoints)
+    if key in fitter.corner_hists:
+        return fitter.corner_hists[key]
 
-    # Set up subplot
-    plt.style.use('seaborn')
-    plt.subplot(N, 1, n)
+    from scipy.ndimage import gaussian_filter
 
-    (B, M, S) = fitter.kelly_b, fitter.kelly_m, fitter.kelly_sigsqr
+    chains = [np.asarray(c)[burn:] for c in
+              (fitter.kelly_b, fitter.kelly_m, fitter.kelly_sigsqr)]
+    ndim = len(chains)
+    nsamp = np.size(chains[0])
 
     # Paramter Limits
-    blo, bhi = min(B[burn:]), max(B[burn:])
-    mlo, mhi = min(M[burn:]), max(M[burn:])
-    slo, shi = min(S[burn:]), max(S[burn:])
+    lo = np.array([np.min(c) for c in chains])
+    hi = np.array([np.max(c) for c in chains])
 
     # FIX: maybe use lo = -hi for symmetry?? Can cause issues for small min
 
     sf = 0.25  # scale factor
-    db = sf*abs(bhi - blo)
-    dm = sf*abs(mhi - mlo)
-    ds = sf*abs(shi - slo)
-    blo, bhi = blo-db, bhi+db
-    mlo, mhi = mlo-db, mhi+dm
-    slo, shi = slo-ds, shi+ds
-    # blo, bhi = blo-abs(blo)*sf, bhi+abs(bhi)*sf
-    # mlo, mhi = mlo-abs(mlo)*sf, mhi+abs(mhi)*sf
-    # slo, shi = slo-abs(slo)*sf, shi+abs(shi)*sf
-
-    data1 = np.transpose((B, M, S))
-
-    fig = corner.corner(
-        data1,
-        labels=['b', 'm', 's'],
-        range=[(blo, bhi), (mlo, mhi), (slo, shi)],
-        quantiles=[0.16, 0.5, 0.84],
-        show_titles=True,
-        title_args={"fontsize": 18},
-        plot_datapoints=True,
-        fill_contours=False,
-        levels=[0.68, 0.95],
-        color='k',
-        bins=40,
-        smooth=1.0
-    )
+    pad = sf*np.abs(hi - lo)
+    lo, hi = lo - pad, hi + pad
+    hi[hi == lo] += 1.
+
+    width = (hi - lo) / bins
+    edges = lo[:, None] + width[:, None] * np.arange(bins+1)
+    pairs = [(i, j) for i in range(ndim) for j in range(i)]
+
+    # Each corner bin is split into `per` fine bins.
+    per = max(1, fine_bins // bins)
+    fine_bins = per * bins
+
+    fine = np.zeros((ndim, fine_bins))
+    counts = {pair: np.zeros(bins*bins) for pair in pairs}
+
+    for start in range(0, nsamp, blocksize):
+        block = np.vstack([c[start:start+blocksize] for c in chains])
+
+        # Bin index of every sample along every parameter, computed once.
+        fidx = np.floor((block - lo[:, None]) / (hi - lo)[:, None] * fine_bins)
+        fidx = np.clip(fidx, 0, fine_bins-1).astype(np.int64)
+        idx = fidx // per
+
+        for i in range(ndim):
+            fine[i] += np.bincount(fidx[i], minlength=fine_bins)
+        for (i, j) in pairs:
+            counts[(i, j)] += np.bincount(idx[j] * bins + idx[i],
+                                          minlength=bins*bins)
+
+    hist1d = fine.reshape(ndim, bins, per).sum(axis=2)
+
+    # Quantiles from the cumulative fine histogram.
+    fine_edges = lo[:, None] + (hi - lo)[:, None] * np.arange(fine_bins+1) / fine_bins
+    cdf = np.hstack((np.zeros((ndim, 1)), np.cumsum(fine, axis=1)))
+    cdf /= cdf[:, -1:]
+    qs = np.array([np.interp(quantiles, cdf[i], fine_edges[i]) for i in range(ndim)])
+
+    hist2d = {}
+    contour_levels = {}
+    for (i, j) in pairs:
+        H = counts[(i, j)].reshape(bins, bins)
+        if smooth:
+            H = gaussian_filter(H, smooth)
+
+        # Density levels enclosing the requested posterior mass.
+        Hflat = np.sort(H.ravel())[::-1]
+        sm = np.cumsum(Hflat)
+        sm /= sm[-1]
+        V = Hflat[np.clip(np.searchsorted(sm, levels, side='right') - 1,
+                          0, None)]
+        V.sort()
+        m = np.diff(V) == 0
+        while np.any(m):
+            V[np.where(m)[0][0]] *= 1.0 - 1e-4
+            m = np.diff(V) == 0
+        V.sort()
+
+        hist2d[(i, j)] = H
+        contour_levels[(i, j)] = V
+
+    step = max(1, nsamp // npoints)
+
+    summary = {
+        'edges': edges,
+        'centers': 0.5 * (edges[:, 1:] + edges[:, :-1]),
+        'range': np.transpose((lo, hi)),
+        'hist1d': hist1d,
+        'hist2d': hist2d,
+        'levels': contour_levels,
+        'quantiles': qs,
+        'points': np.array([c[::step] for c in chains]),
+    }
+
+    fitter.corner_hists[key] = summary
+
+    return summary
+
+def render_corner(summary, labels, color='k'):
+    '''
+    Draws a corner plot from the precomputed histograms returned by
+    corner_histograms(). No binning is done here.
+    '''
+
+    ndim = len(labels)
+    fig, axes = plt.subplots(ndim, ndim, figsize=(2.5*ndim, 2.5*ndim))
+    centers = summary['centers']
+    edges = summary['edges']
+    rng = summary['range']
+
+    for i in range(ndim):
+        for j in range(ndim):
+            ax = axes[i, j]
+
+            if j > i:
+                ax.set_visible(False)
+                continue
+
+            if i == j:
+                ax.hist(centers[i], bins=edges[i], weights=summary['hist1d'][i],
+                        histtype='step', color=color)
+                q = summary['quantiles'][i]
+                for qv in q:
+                    ax.axvline(qv, ls='dashed', color=color)
+                ax.set_title(
+                    '{0} = ${1:.2f}_{{-{2:.2f}}}^{{+{3:.2f}}}$'
+                    .format(labels[i], q[1], q[1]-q[0], q[-1]-q[1])
+                )
+                ax.set_yticks([])
+            else:
+                ax.plot(summary['points'][j], summary['points'][i], 'o',
+                        color=color, ms=2, alpha=0.1, rasterized=True)
+                ax.contour(centers[j], centers[i], summary['hist2d'][(i, j)].T,
+                           summary['levels'][(i, j)], colors=color)
+                ax.set_ylim(rng[i])
+
+            ax.set_xlim(rng[j])
+
+            if i < ndim - 1:
+                ax.set_xticklabels([])
+            else:
+                ax.set_xlabel(labels[j])
+            if 0 < j or i == 0:
+                ax.set_yticklabels([])
+            else:
+                ax.set_ylabel(labels[i])
+
+    return fig
+
+def plot_corners(args, config, fitter):
+    '''
+    Makes corner plots for the desired Kelly method parameter
+    posteriors. Burn is the burn in period parameter.
+    '''
+
+    plt.style.use('seaborn')
+
+    summary = corner_histograms(fitter, config)
+
+    fig = render_corner(summary, labels=['b', 'm', 's'])
     fig.suptitle('Posterior Distributioon',
                      fontsize=14)
 
@@ -264,10 +418,35 @@ def plot_corners(args, config, fitter):
         )
     )
 
-    n += 1  # Iterate counter
-
     return
 
+def plot_archived_corner(archive_filename, filename=None, color='k'):
+    '''
+    Redraws the corner plot of a saved run from the binning stored in its
+    results archive (see iolib.Archive.corner), without reading the chains,
+    e.g. to restyle it. Writes `Corner-<archive name>.pdf` by default.
+    '''
+
+    import iolib
+
+    with iolib.open_archive(archive_filename) as archive:
+        summary = archive.corner
+        if summary is None:
+            raise ValueError(f'{archive_filename} holds no corner plot binning; '
+                             'save it with `corner: True`.')
+        fig = render_corner(summary, labels=['b', 'm', 's'], color=color)
+
+    fig.suptitle('Posterior Distribution', fontsize=14)
+    if filename is None:
+        filename = 'Corner-{}.pdf'.format(
+            os.path.splitext(os.path.basename(archive_filename))[0])
+    fig.savefig(filename)
+
+    return filename
+
+
+# Maximum number of samples per parameter drawn by plot_chains.
+max_chain_points = 20000
 
 def plot_chains(args, config, fitter):
     '''
@@ -290,26 +469,30 @@ def plot_chains(args, config, fitter):
     # Length of chain
     nmc = np.size(B)
 
+    # Only draw every `step`-th sample of very long (e.g. disk-backed) chains.
+    step = max(1, nmc // max_chain_points)
+    n = np.arange(0, nmc, step)
+
     plt.style.use('ggplot')
     fig = plt.figure()
 
     plt.subplot(311)
 
-    plt.plot(M, 'o', markerfacecolor="None")
+    plt.plot(n, M[::step], 'o', markerfacecolor="None")
     plt.plot((0, nmc), (m, m), 'r--')
     plt.xlabel('Chain Number')
     plt.ylabel('Slope')
 
     plt.subplot(312)
 
-    plt.plot(B, 'o', markerfacecolor="None")
+    plt.plot(n, B[::step], 'o', markerfacecolor="None")
     plt.plot((0, nmc), (b, b), 'r--')
     plt.xlabel('Chain Number')
     plt.ylabel('Intercept')
 
     plt.subplot(313)
 
-    plt.plot(S, 'o', markerfacecolor="None")
+    plt.plot(n, S[::step], 'o', markerfacecolor="None")
     plt.plot((0, nmc), (s, s), 'r--')
     plt.xlabel('Chain Number')
     plt.ylabel(r'$\sigma^2$')
@@ -337,81 +520,252 @@ def plot_chains(args, config, fitter):
 
     return
 
+def plot_trend(args, data, results, trends, column):
+    '''
+    Intercept, slope and scatter of the binned fits (see binlib) against the
+    bin centres, with the fitted linear trend of each.
+    '''
+
+    fitted = [r for r in results if 'slope' in r]
+    labels = {'intercept': 'Intercept', 'slope': 'Slope', 'sigma': r'$\sigma$'}
+
+    fig, axes = plt.subplots(3, 1, sharex=True, figsize=(5, 7))
+
+    z = np.array([r['center'] for r in fitted])
+    zerr = np.array([[r['center'] - r['lo'] for r in fitted],
+                     [r['hi'] - r['center'] for r in fitted]])
+
+    for ax, (p, label) in zip(axes, labels.items()):
+        ax.errorbar(z, [r[f'{p}_mean'] for r in fitted],
+                    xerr=zerr, yerr=[r[f'{p}_std'] for r in fitted],
+                    fmt='o', color='navy', ecolor='k', capsize=2)
+        if p in trends:
+            t = trends[p]
+            zz = np.array([fitted[0]['lo'], fitted[-1]['hi']])
+            ax.plot(zz, t['value'] + t['slope'] * zz, 'k--', lw=1,
+                    label='{:.3g} $\\pm$ {:.2g} per unit {}'.format(
+                        t['slope'], t['slope_err'], column))
+            ax.legend(loc='best', fontsize='x-small')
+        ax.set_ylabel(label, fontsize=10)
+
+    axes[-1].set_xlabel(column, fontsize=10)
+    axes[0].set_title('{} vs {}'.format(data.ylabel, data.xlabel), fontsize=11)
+
+    plt.savefig(
+        'Trend-{}{}-{}-{}.pdf'
+        .format(
+            args.prefix,
+            data.ylabel,
+            data.xlabel,
+            column
+        ),
+        bbox_inches='tight'
+    )
+
+    return
+
 
 # ----------------------------------------------------------------------
 # Make all plots
 
-def make_plots(args, config, fitter):
+# Config keys that change how a figure looks, included in its cache key.
+plot_config_keys = ('Plot_Labels', 'burn', 'scale_line', 'outlier_nsigma',
+                    'asymmetric_err', 'stream_bands', 'ppc_samples', 'ppc_seed')
+
+class PlotCache:
+    """
+    Content-addressed store of rendered figures. Each figure is filed under
+    a digest of everything it is drawn from (see plot_digest), so an unchanged
+    figure is hard-linked into place instead of redrawn. The oldest used
+    entries are evicted once the cache holds more than max_bytes.
+    """
+
+    def __init__(self, directory, max_bytes=500*2**20):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+
+        return
+
+    def _path(self, key, filename):
+        return os.path.join(self.directory, key + os.path.splitext(filename)[1])
+
+    @staticmethod
+    def _link(src, dst):
+        """Hard-links src to dst atomically, copying across filesystems."""
+
+        import shutil
+
+        tmp = '{}.{}.tmp'.format(dst, os.getpid())
+        try:
+            os.link(src, tmp)
+        except OSError:
+            shutil.copyfile(src, tmp)
+        os.replace(tmp, dst)
+
+        return
+
+    def fetch(self, key, filename):
+        """Puts the cached figure at filename. Returns False on a miss."""
+
+        path = self._path(key, filename)
+        if not os.path.exists(path):
+            return False
+
+        self._link(path, filename)
+        # Mark as recently used for eviction.
+        os.utime(path)
+
+        return True
+
+    def store(self, key, filename):
+        """Adds a freshly rendered figure, then evicts down to max_bytes."""
+
+        self._link(filename, self._path(key, filename))
+        self.evict()
+
+        return
+
+    def evict(self):
+        entries = []
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            if name.endswith('.tmp'):
+                continue
+            st = os.stat(path)
+            entries.append((st.st_mtime, st.st_size, path))
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+
+        return
+
+def _hash_array(h, values, blocksize=2**20):
+    """Adds an array to a hash in blocks, without copying it whole."""
+
+    values = np.ravel(np.asarray(values))
+    h.update(f'{values.dtype.str}{values.shape}'.encode())
+    for start in range(0, np.size(values), blocksize):
+        h.update(np.ascontiguousarray(values[start:start+blocksize]).tobytes())
+
+    return
+
+def plot_digest(fitter, config):
+    """
+    Digest of everything that decides the figures of a fit seeded with
+    `seed`: the fitted data, the sampler settings, the warm start, the
+    seed, where the bands came from, the plot settings in
+    `plot_config_keys` and the source of the sampling and plotting modules,
+    so that code changes also invalidate the cache. The chains themselves
+    are not hashed; with the same inputs and seed they come out the same.
+    """
+
+    import hashlib
+    import reglib
+    import ptlib
+
+    h = hashlib.sha256()
+    h.update(f'{fitter.data_xlabel}\0{fitter.data_ylabel}\0{fitter.piv!r}\0'.encode())
+    h.update(repr((fitter.algorithm, fitter.Nmin, fitter.Nmax, fitter.pt_temps,
+                   fitter.pt_ladders, config['seed'] if 'seed' in config else None,
+                   getattr(fitter, '_streamed', None))).encode())
+    for name in ('data_x', 'data_y', 'data_x_err_obs', 'data_y_err_obs',
+                 'data_x_err_low_obs', 'data_x_err_high_obs',
+                 'data_y_err_low_obs', 'data_y_err_high_obs', 'data_delta'):
+        _hash_array(h, getattr(fitter, name))
+    for name, values in sorted((fitter.init or {}).items()):
+        h.update(name.encode())
+        _hash_array(h, values)
+    for key in plot_config_keys:
+        h.update(repr(config[key] if key in config else None).encode())
+    for module in (__file__, reglib.__file__, ptlib.__file__):
+        with open(module, 'rb') as f:
+            h.update(f.read())
+
+    return h.hexdigest()
+
+def plot_key(kind, digest):
+    """Cache key of one figure: its plot kind and the plot_digest of its fit."""
+
+    import hashlib
+
+    return hashlib.sha256(f'{kind}\0{digest}'.encode()).hexdigest()
+
+def make_plots(args, config, fitter, profiler=None):
     '''
     Calls both plotting functions and then combines all outputs into a single
-    PDF.
+    PDF. If a proflib.Profiler is passed, each plot is timed as its own stage.
+    With `plot_cache` set and the sampler seeded (`seed`), figures whose
+    data, fit and plot settings did not change are reused from the cache
+    instead of redrawn.
     '''
 
-    # pylint: disable=global-statement
+    if profiler is None:
+        profiler = proflib.Profiler(enabled=False)
 
-    # OLD: now uses METHODS
-    # Retreive methods list
+    cache = None
+    if 'plot_cache' in config and config['plot_cache'] and not (
+            'seed' in config and config['seed'] is not None):
+        print('WARNING: `plot_cache` needs a `seed`; unseeded chains differ '
+              'every run. Drawing all plots.')
+    elif 'plot_cache' in config and config['plot_cache']:
+        size = config['plot_cache_size'] if 'plot_cache_size' in config else 500
+        cache = PlotCache(config['plot_cache'], max_bytes=size * 2**20)
+        digest = plot_digest(fitter, config)
 
     # Initialize pdf list
     pdfs = []
 
-    if config['scatter'] is True:
-        plot_scatter(args, fitter, config)
-        # Add scatter/fit plot
-        pdfs.append(
-            'Scatter-{}{}-{}.pdf'
-            .format(
-                args.prefix,
-                fitter.data_ylabel,
-                fitter.data_xlabel
-            )
-        )
+    plots = (
+        ('scatter', 'Scatter', plot_scatter, (args, fitter, config)),
+        ('residuals', 'Residuals', plot_residuals, (args, fitter, config)),
+        ('corner', 'Corner', plot_corners, (args, config, fitter)),
+        ('chains', 'Chains', plot_chains, (args, config, fitter)),
+        ('ppc', 'PPC', plot_ppc, (args, config, fitter)),
+    )
 
-    if config['residuals'] is True:
-        plot_residuals(args, fitter, config)
-        # Add residual plot(s)
-        pdfs.append(
-            'Residuals-{}{}-{}.pdf'.format(
-                args.prefix,
-                fitter.data_ylabel,
-                fitter.data_xlabel
-            )
-        )
+    for kind, name, plot, plot_args in plots:
+        if kind not in config or config[kind] is not True:
+            continue
 
-    if config['corner'] is True:
-        plot_corners(args, config, fitter)
-        # Add corner plot(s)
-        pdfs.append(
-            'Corner-{}{}-{}.pdf'
-            .format(
-                args.prefix,
-                fitter.data_ylabel,
-                fitter.data_xlabel
-            )
-        )
+        filename = '{}-{}{}-{}.pdf'.format(
+            name, args.prefix, fitter.data_ylabel, fitter.data_xlabel)
+
+        with profiler.stage(f'plotlib.{plot.__name__}') as info:
+            key = plot_key(kind, digest) if cache is not None else None
+            info['cached'] = cache is not None and cache.fetch(key, filename)
+            if not info['cached']:
+                # The old file may be a hard link into the cache; never
+                # overwrite it in place.
+                if os.path.exists(filename):
+                    os.remove(filename)
+                plot(*plot_args)
+                if cache is not None:
+                    cache.store(key, filename)
+
+        pdfs.append(filename)
 
-    if config['chains'] is True:
-        plot_chains(args, config, fitter)
-        # Add chain plot(s)
-        pdfs.append(
-            'Chains-{}{}-{}.pdf'
-            .format(
-                args.prefix,
-                fitter.data_ylabel,
-                fitter.data_xlabel
-            )
-        )
     if config['save_all_plots'] is True:
-        merger = PyPDF2.PdfFileMerger()
+        import PyPDF2
 
-        for pdf in pdfs:
-            merger.append(pdf)
+        with profiler.stage('PDF merging'):
+            merger = PyPDF2.PdfFileMerger()
 
-        # Save combined output file
-        merger.write(
-            '{}{}-{}.pdf'
-            .format(args.prefix, fitter.data_ylabel, fitter.data_xlabel)
-        )
+            for pdf in pdfs:
+                merger.append(pdf)
+
+            # Save combined output file
+            merger.write(
+                '{}{}-{}.pdf'
+                .format(args.prefix, fitter.data_ylabel, fitter.data_xlabel)
+            )
     else:
         pass
 
@@ -0,0 +1,152 @@
+''' Posterior predictive check library for CluStR '''
+
+# Checks whether the fitted Kelly model reproduces the observed scatter, tails
+# and censoring of the data. For every posterior sample s a replicated dataset
+# is drawn from the model at the observed x, with the observed x and y errors:
+#
+#   y_rep_si = a_s + b_s x_i + N(0, err_y_i^2 + (b_s err_x_i)^2 + sigma_s^2)
+#
+# (the spread residual_scores normalises by), and a replicated cluster is
+# censored if it falls below the detection limit of its x. Discrepancy
+# statistics T(y, theta_s) of the data and T(y_rep, theta_s) of the replicas
+# are computed for all samples at once, as (samples x clusters) arrays in
+# blocks below a memory budget. The posterior predictive p-value of each
+# statistic is P(T(y_rep) >= T(y)); values near 0 or 1 flag a misfit.
+# Enabled by `ppc` in config.yml.
+
+import numpy as np
+
+# pylint: disable=invalid-name
+
+statistics = ('scatter', 'tail_low', 'tail_high', 'censored_frac')
+
+labels = {
+    'scatter': r'RMS residual in $\ln Y$ (detected)',
+    'tail_low': 'Fraction below the line by > {:g}$\\sigma$',
+    'tail_high': 'Fraction above the line by > {:g}$\\sigma$',
+    'censored_frac': 'Censored fraction',
+}
+
+def detection_limits(x, y, delta=None):
+    '''
+    Detection limit in y of every cluster, for censoring the replicas:
+    censored clusters (delta == 0) report theirs as the upper limit y, and
+    a line fit to those limits against x gives that of detected clusters.
+    Without (enough) censored clusters nothing is censored.
+    '''
+
+    x, y = np.asarray(x, dtype=float), np.asarray(y, dtype=float)
+    if delta is None:
+        return np.full(np.size(x), -np.inf)
+
+    censored = np.asarray(delta) == 0
+    if np.count_nonzero(censored) == 0:
+        return np.full(np.size(x), -np.inf)
+
+    if np.count_nonzero(censored) < 2 or np.ptp(x[censored]) == 0:
+        limits = np.full(np.size(x), np.max(y[censored]))
+    else:
+        slope, intercept = np.polyfit(x[censored], y[censored], 1)
+        limits = intercept + slope * x
+
+    return np.where(censored, y, limits)
+
+def discrepancies(y, detected, line, spread, tail=2.):
+    '''
+    Discrepancy statistics of every row of a (samples x clusters) block of
+    datasets `y`, about the lines and total spreads of the same samples.
+    Scatter and tail fractions are over the `detected` clusters of each row.
+    '''
+
+    r = y - line
+    ndet = np.maximum(detected.sum(axis=1), 1)
+    z = r / spread
+
+    return {
+        'scatter': np.sqrt(np.where(detected, r**2, 0.).sum(axis=1) / ndet),
+        'tail_low': (detected & (z < -tail)).sum(axis=1) / ndet,
+        'tail_high': (detected & (z > tail)).sum(axis=1) / ndet,
+        'censored_frac': 1. - detected.mean(axis=1),
+    }
+
+def posterior_predictive(x, y, err_x, err_y, intercept, slope, sigma,
+                         delta=None, nsamples=2000, tail=2., budget=2**26,
+                         seed=None):
+    # pylint: disable = too-many-arguments
+    # pylint: disable = too-many-locals
+    '''
+    Posterior predictive check of the fitted relation (in log space, as
+    fitted) over `nsamples` posterior samples, thinned evenly from the
+    chains. Returns a dictionary with the `observed` and `replicated`
+    statistics per sample, and the `pvalue` of each (ties count half).
+    '''
+
+    x, y = np.asarray(x, dtype=float), np.asarray(y, dtype=float)
+    var_x = np.asarray(err_x, dtype=float)**2
+    var_y = np.asarray(err_y, dtype=float)**2
+    N = np.size(x)
+    if delta is None:
+        detected_obs = np.ones(N, dtype=bool)
+    else:
+        detected_obs = np.asarray(delta) != 0
+    limits = detection_limits(x, y, delta)
+
+    nchain = np.size(intercept)
+    take = np.unique(np.linspace(0, nchain - 1, min(nsamples, nchain)).astype(int))
+    a_all = np.asarray(intercept)[take]
+    b_all = np.asarray(slope)[take]
+    s_all = np.asarray(sigma)[take]
+    n = np.size(take)
+
+    rng = np.random.default_rng(seed)
+
+    # About eight (samples x clusters) temporaries are alive at once.
+    nrow = max(1, budget // (8 * 8 * N))
+
+    observed = {k: np.empty(n) for k in statistics}
+    replicated = {k: np.empty(n) for k in statistics}
+    for start in range(0, n, nrow):
+        rows = slice(start, start + nrow)
+        a = a_all[rows, None]
+        b = b_all[rows, None]
+
+        line = a + b * x
+        spread = np.sqrt(var_y + b**2 * var_x + s_all[rows, None]**2)
+
+        y_rep = line + spread * rng.standard_normal((np.size(a), N))
+        detected_rep = y_rep >= limits
+
+        obs = discrepancies(y, np.broadcast_to(detected_obs, y_rep.shape),
+                            line, spread, tail)
+        rep = discrepancies(y_rep, detected_rep, line, spread, tail)
+        for k in statistics:
+            observed[k][rows] = obs[k]
+            replicated[k][rows] = rep[k]
+
+    pvalue = {
+        k: np.mean(replicated[k] > observed[k])
+           + 0.5 * np.mean(replicated[k] == observed[k])
+        for k in statistics
+    }
+
+    return {
+        'observed': observed,
+        'replicated': replicated,
+        'pvalue': pvalue,
+        'nsamples': n,
+        'tail': tail,
+    }
+
+def summary(result):
+    '''Human-readable posterior predictive check report.'''
+
+    lines = ['Posterior predictive check over {} samples:'.format(result['nsamples'])]
+    for k in statistics:
+        obs, rep = result['observed'][k], result['replicated'][k]
+        p = result['pvalue'][k]
+        lines.append(
+            '  {:<14} observed {:.4g}, replicated {:.4g} +/- {:.2g}: p = {:.3f}{}'
+            .format(k, np.mean(obs), np.mean(rep), np.std(rep), p,
+                    '  (misfit?)' if min(p, 1. - p) < 0.025 else ''))
+
+    return '\n'.join(lines)
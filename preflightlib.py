@@ -0,0 +1,366 @@
+''' Preflight checks for CluStR '''
+
+# Validates a config and the catalog it will be run on before any data is
+# loaded: the config is checked against the schema below, and every column it
+# references is looked up in the FITS header (TTYPEn/TFORMn cards) only, with
+# its type. All problems are reported at once, so a misconfigured batch job
+# fails in milliseconds instead of after the catalog has been read:
+#
+#   python clustr.py check cat.fits lambda tr2500 config.yml
+
+from argparse import ArgumentParser, Namespace
+import numbers
+import numpy as np
+
+# pylint: disable=invalid-name
+
+class PreflightError(ValueError):
+    """A config or catalog problem found before any data is loaded."""
+
+    def __init__(self, problems):
+        self.problems = problems
+        super().__init__('\n'.join(f'  - {p}' for p in problems))
+
+        return
+
+# FITS TFORM codes allowed for each kind of column. Flags are compared with
+# True/False, so any numeric or logical column will do.
+formats_by_kind = {
+    'numeric': set('BIJKEDF'),
+    'flag': set('LBIJKEDF'),
+}
+
+def _number(value):
+    return isinstance(value, numbers.Number) and not isinstance(value, bool)
+
+def _first_key(section):
+    '''The key that decides whether a flag is used, as create_cuts reads it.'''
+
+    return list(section.keys())[0] if isinstance(section, dict) and section else None
+
+def validate_config(config, x=None, y=None, joint=()):
+    # pylint: disable = too-many-branches
+    # pylint: disable = too-many-statements
+    '''
+    Problems with the values of a config (a clustr.Config or dictionary) for
+    a fit of y (and the `joint` axes) against x, as a list of messages. Also
+    returns the columns the run reads, as a dictionary of column name to
+    (kind, where it comes from), kind being 'numeric' or 'flag'.
+    '''
+
+    problems = []
+    columns = {}
+
+    def need(key, check, what):
+        if key not in config:
+            problems.append(f'Missing required key `{key}`.')
+            return False
+        if not check(config[key]):
+            problems.append(f'`{key}` must be {what}, not {config[key]!r}.')
+            return False
+        return True
+
+    def optional(key, check, what):
+        if key in config and config[key] is not None and not check(config[key]):
+            problems.append(f'`{key}` must be {what}, not {config[key]!r}.')
+
+    def column(name, kind, where):
+        if not isinstance(name, str) or not name:
+            problems.append(f'{where} must name a column, not {name!r}.')
+        else:
+            columns.setdefault(name, (kind, where))
+
+    # Axes
+    if need('Column_Names', lambda v: isinstance(v, dict), 'a mapping of axes to columns'):
+        names = config['Column_Names']
+        for axis, label in (('x', x), ('y', y)):
+            if label is None:
+                continue
+            if label not in names:
+                problems.append(f'{axis} axis `{label}` is not in `Column_Names`.')
+            else:
+                column(names[label], 'numeric', f'`Column_Names: {label}`')
+
+        err_columns = config['y_err_columns'] if 'y_err_columns' in config else None
+        for label in joint:
+            if label == y:
+                continue
+            if label not in names:
+                problems.append(f'Joint axis `{label}` is not in `Column_Names`.')
+                continue
+            column(names[label], 'numeric', f'`Column_Names: {label}`')
+            if not err_columns or label not in err_columns:
+                problems.append(f'Joint axis `{label}` has no `y_err_columns` entry.')
+            elif not isinstance(err_columns[label], list) or len(err_columns[label]) != 2:
+                problems.append(f'`y_err_columns: {label}` must be [low, high] columns.')
+            else:
+                for name in err_columns[label]:
+                    column(name, 'numeric', f'`y_err_columns: {label}`')
+
+    for key in ('xlabel_err_low', 'xlabel_err_high', 'ylabel_err_low', 'ylabel_err_high'):
+        if need(key, lambda v: isinstance(v, str), 'a column name'):
+            column(config[key], 'numeric', f'`{key}`')
+
+    # Pivot and sampling
+    if need('piv_type', lambda v: isinstance(v, str), 'a string'):
+        if config['piv_type'] != 'median':
+            need('piv_value', lambda v: _number(v) and v > 0, 'a positive number')
+
+    optional('fit_method', lambda v: v in ('linmix', 'map', 'tempering'),
+             '`linmix`, `map` or `tempering`')
+    optional('pt_temps', lambda v: isinstance(v, int) and not isinstance(v, bool) and v >= 3,
+             'an integer of at least 3')
+    optional('pt_ladders', lambda v: isinstance(v, int) and not isinstance(v, bool) and v >= 1,
+             'a positive integer')
+    for key in ('Nmin', 'Nmax', 'warm_Nmin', 'burn'):
+        optional(key, lambda v: isinstance(v, int) and not isinstance(v, bool) and v >= 0,
+                 'a non-negative integer')
+    if ('Nmin' in config and 'Nmax' in config and isinstance(config['Nmin'], int)
+            and isinstance(config['Nmax'], int) and config['Nmin'] > config['Nmax']):
+        problems.append(f"`Nmin` ({config['Nmin']}) is larger than `Nmax` ({config['Nmax']}).")
+    for key in ('outlier_nsigma', 'telemetry_interval', 'scale_line', 'plot_cache_size'):
+        optional(key, lambda v: _number(v) and v > 0, 'a positive number')
+    for key in ('coreset_size', 'ppc_samples'):
+        optional(key, lambda v: isinstance(v, int) and v > 0, 'a positive integer')
+    for key in ('seed', 'ppc_seed'):
+        optional(key, lambda v: isinstance(v, int) and 0 <= v < 2**32,
+                 'an integer from 0 to 2**32 - 1')
+    optional('Om', lambda v: _number(v) and 0 < v <= 1, 'a number in (0, 1]')
+    optional('H_0', lambda v: _number(v) and v > 0, 'a positive number')
+    for key in ('ez_power_x', 'ez_power_y'):
+        optional(key, _number, 'a number')
+    for key in ('scale_x_by_ez', 'scale_y_by_ez', 'asymmetric_err', 'stream_bands',
+                'ppc', 'save_data', 'compress_archive', 'scatter', 'corner',
+                'chains', 'residuals', 'save_all_plots'):
+        optional(key, lambda v: isinstance(v, bool), '`True` or `False`')
+
+    if any(key in config and config[key] is True
+           for key in ('scale_x_by_ez', 'scale_y_by_ez')):
+        if need('Redshift', lambda v: isinstance(v, str), 'a column name'):
+            column(config['Redshift'], 'numeric', '`Redshift`')
+
+    # Censoring
+    if 'Censored' in config:
+        censored = config['Censored']
+        if not isinstance(censored, dict) or not isinstance(_first_key(censored), bool):
+            problems.append('`Censored` must map `True` or `False` to a column.')
+        elif _first_key(censored):
+            column(censored[True], 'flag', '`Censored`')
+
+    # Flags, read the way Data.create_cuts reads them.
+    bool_flags = config['Bool_Flag'] if 'Bool_Flag' in config else {}
+    if not isinstance(bool_flags, dict) or not isinstance(_first_key(bool_flags), bool):
+        problems.append('`Bool_Flag` must map `True` or `False` to flags.')
+    elif _first_key(bool_flags):
+        for flag, value in (bool_flags[True] or {}).items():
+            if not isinstance(value, bool):
+                problems.append(
+                    f'Boolean flag `{flag}` must be `True` or `False`, not {value!r}.')
+            column(flag.replace('_bool_type', ''), 'flag', f'`Bool_Flag: {flag}`')
+
+    cutoff_flags = config['Cutoff_Flag'] if 'Cutoff_Flag' in config else {}
+    for flag, section in (cutoff_flags or {}).items():
+        if flag == 'Other' or not isinstance(section, dict):
+            continue
+        if _first_key(section) is False:
+            continue
+        values = list(section[_first_key(section)].values()) if isinstance(
+            section[_first_key(section)], dict) else []
+        if len(values) < 2:
+            problems.append(f'Cutoff flag `{flag}` needs a cutoff value and a cut type.')
+            continue
+        if not _number(values[0]):
+            problems.append(f'Cutoff of `{flag}` must be a number, not {values[0]!r}.')
+        if values[1] not in ('above', 'below'):
+            problems.append(
+                f'Cut type of `{flag}` must be `above` or `below`, not {values[1]!r}.')
+        column(flag, 'numeric', f'`Cutoff_Flag: {flag}`')
+
+    range_flags = config['Range_Flag'] if 'Range_Flag' in config else {}
+    for flag, section in (range_flags or {}).items():
+        if flag == 'Other' or not isinstance(section, dict):
+            continue
+        if _first_key(section) is False:
+            continue
+        ranges = section[_first_key(section)]
+        for name, rvalues in (ranges.items() if isinstance(ranges, dict) else []):
+            values = list(rvalues.values()) if isinstance(rvalues, dict) else []
+            if len(values) < 3:
+                problems.append(f'Range `{name}` of `{flag}` needs a min, a max and a type.')
+                continue
+            if not (_number(values[0]) and _number(values[1])):
+                problems.append(f'Range `{name}` of `{flag}` must have numeric bounds, '
+                                f'not {values[0]!r} and {values[1]!r}.')
+            elif values[0] > values[1]:
+                problems.append(f'Range `{name}` of `{flag}` has min {values[0]} > max {values[1]}.')
+            if values[2] not in ('inside', 'outside'):
+                problems.append(f'Range type of `{flag}` must be `inside` or `outside`, '
+                                f'not {values[2]!r}.')
+        column(flag, 'numeric', f'`Range_Flag: {flag}`')
+
+    return problems, columns
+
+def _read_header(f):
+    '''
+    Cards of the FITS header at the current position of f, as a dictionary,
+    parsed from its 2880-byte blocks without astropy. Returns None at the
+    end of the file.
+    '''
+
+    cards = {}
+    while True:
+        block = f.read(2880)
+        if len(block) < 2880:
+            return None
+        for i in range(0, 2880, 80):
+            card = block[i:i+80].decode('ascii', 'replace')
+            key = card[:8].strip()
+            if key == 'END':
+                return cards
+            if card[8:10] != '= ':
+                continue
+            value = card[10:]
+            if value.lstrip().startswith("'"):
+                # String value, up to the closing quote ('' is a quote).
+                value = value.lstrip()[1:]
+                value = value[:value.replace("''", '\0\0').find("'")]
+                cards[key] = value.replace("''", "'").rstrip()
+            else:
+                value = value.split('/')[0].strip()
+                try:
+                    cards[key] = int(value)
+                except ValueError:
+                    cards[key] = value
+
+def header_columns(filename):
+    '''
+    Column names and TFORM codes of the first table extension of a FITS
+    file, read from the headers only. Returns None if the file is not FITS.
+    '''
+
+    with open(filename, 'rb') as f:
+        if f.read(6) != b'SIMPLE':
+            return None
+        f.seek(0)
+
+        while True:
+            header = _read_header(f)
+            if header is None:
+                return {}
+
+            if header.get('XTENSION') in ('BINTABLE', 'TABLE'):
+                return {
+                    header[f'TTYPE{i}'].strip():
+                        str(header[f'TFORM{i}']).strip().lstrip('0123456789')
+                    for i in range(1, header['TFIELDS'] + 1)
+                }
+
+            # Skip this HDU's data, padded to whole blocks.
+            naxis = [header.get(f'NAXIS{i}', 0) for i in range(1, header.get('NAXIS', 0) + 1)]
+            size = int(np.prod(naxis)) if naxis else 0
+            size = (size + header.get('PCOUNT', 0)) * abs(int(header.get('BITPIX', 8))) // 8
+            f.seek(-(-size // 2880) * 2880, 1)
+
+def check_columns(columns, formats, filename):
+    '''Problems with the referenced columns against a catalog's columns.'''
+
+    problems = []
+    for name, (kind, where) in columns.items():
+        if name not in formats:
+            problems.append(f'Column `{name}` ({where}) is not in {filename}.')
+            continue
+        code = formats[name][:1]
+        if code not in formats_by_kind[kind]:
+            problems.append(f'Column `{name}` ({where}) has FITS format '
+                            f'`{formats[name]}`; expected a {kind} column.')
+
+    return problems
+
+def join_settings(config, cat_filename):
+    '''
+    The main catalog, the catalogs joined to it (from a list of filenames
+    and the `Join` section, see joinlib) and the `Join` section. A config
+    of None (the catalogs serverlib caches) joins only listed catalogs.
+    '''
+
+    filenames = list(cat_filename) if isinstance(cat_filename, (list, tuple)) else [cat_filename]
+    join = (config['Join'] if config is not None and 'Join' in config else None) or {}
+    joined = filenames[1:] + list(join.get('catalogs') or [])
+
+    return filenames[0], joined, join
+
+def preflight(config, cat_filename, x=None, y=None, joint=(), extra=()):
+    # pylint: disable = too-many-arguments
+    # pylint: disable = too-many-locals
+    '''
+    Validates config for a fit of y (and the `joint` axes) against x on the
+    catalog cat_filename (or a list of catalogs to join), reading only FITS
+    headers. `extra` names more numeric columns the run reads, e.g. a
+    `--bin-by` column. Raises PreflightError listing every problem.
+    Catalogs that are not FITS only get the config checks.
+    '''
+
+    x = config.x if x is None and hasattr(config, 'x') else x
+    y = config.y if y is None and hasattr(config, 'y') else y
+
+    problems, columns = validate_config(config, x, y, joint)
+    for name in extra:
+        columns.setdefault(name, ('numeric', 'the command line'))
+
+    main_filename, joined, join = join_settings(config, cat_filename)
+    key = join.get('key') or (config['id_column'] if 'id_column' in config else None)
+    if joined:
+        if not key:
+            problems.append('Joining catalogs needs a `key` in `Join` (or `id_column`).')
+        if join.get('how', 'inner') not in ('inner', 'left'):
+            problems.append(
+                f"`Join: how` must be `inner` or `left`, not {join['how']!r}.")
+
+    # Columns of all catalogs; the main catalog wins name clashes.
+    formats = {}
+    for filename in [main_filename] + joined:
+        try:
+            header = header_columns(filename)
+        except OSError as e:
+            problems.append(f'Cannot read catalog {filename}: {e}')
+            continue
+        if header is None:
+            formats = None
+            break
+        if joined and key and key not in header:
+            problems.append(f'Join key `{key}` is not in {filename}.')
+        for name, code in header.items():
+            formats.setdefault(name, code)
+
+    if formats:
+        names = ', '.join([main_filename] + joined)
+        problems += check_columns(columns, formats, names)
+
+    if problems:
+        raise PreflightError(problems)
+
+    return columns
+
+def main(argv=None):
+    import clustr
+
+    parser = ArgumentParser(prog='clustr.py check')
+    parser.add_argument('cat_filename', help='FITS catalog to check')
+    parser.add_argument('x', help='x axis', choices=clustr.valid_axes)
+    parser.add_argument('y', help='y axis', choices=clustr.valid_axes)
+    parser.add_argument('config_file', help='the filename of the config to check')
+    parser.add_argument('--join', nargs='+', default=[], metavar='CATALOG',
+        help='FITS catalogs to join to the main one on the `Join` key')
+    args = parser.parse_args(argv)
+
+    config = clustr.Config(Namespace(config_file=args.config_file, x=args.x,
+                                     y=args.y, prefix=None))
+    try:
+        columns = preflight(config, [args.cat_filename] + args.join)
+    except PreflightError as e:
+        raise SystemExit(f'ERROR: {args.config_file} failed preflight checks:\n{e}')
+
+    print('OK: {} columns found in {}'.format(
+        len(columns), ', '.join([args.cat_filename] + args.join)))
+
+    return
@@ -0,0 +1,130 @@
+''' Profiling library for CluStR '''
+
+# Per-stage wall time and memory instrumentation used by `clustr.py --profile`
+# and the benchmarks. Stages are timed with a context manager:
+#
+#   profiler = Profiler()
+#   with profiler.stage('Catalog'):
+#       catalog = Catalog(...)
+#   profiler.write('profile.json')
+
+import contextlib
+import json
+import os
+import platform
+import resource
+import sys
+import time
+import tracemalloc
+
+# pylint: disable=invalid-name
+
+def peak_rss_mb():
+    '''Peak resident set size of this process so far, in MB.'''
+
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in kilobytes elsewhere.
+    if sys.platform == 'darwin':
+        return maxrss / 2**20
+
+    return maxrss / 2**10
+
+class Profiler:
+    """
+    Records the wall time, peak traced (tracemalloc) memory and peak RSS of
+    named pipeline stages. A disabled profiler adds no overhead, so callers
+    can always wrap their stages.
+    """
+
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self.stages = []
+        self.metrics = {}
+        self._start = time.time()
+        # Peak traced memory of every open stage, up to its newest sub-stage.
+        self._peaks = []
+
+        if enabled and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+        return
+
+    @contextlib.contextmanager
+    def stage(self, name, **info):
+        '''
+        Times the enclosed block as stage `name`, also if it raises. Stages
+        may nest; an enclosing stage's peak includes those of its sub-stages.
+        '''
+
+        if not self.enabled:
+            yield info
+            return
+
+        # tracemalloc has a single peak; carry the enclosing stage's over.
+        _, peak = tracemalloc.get_traced_memory()
+        if self._peaks:
+            self._peaks[-1] = max(self._peaks[-1], peak)
+        self._peaks.append(0)
+        tracemalloc.reset_peak()
+        start = time.perf_counter()
+
+        try:
+            yield info
+        finally:
+            seconds = time.perf_counter() - start
+            _, peak = tracemalloc.get_traced_memory()
+            peak = max(self._peaks.pop(), peak)
+            if self._peaks:
+                self._peaks[-1] = max(self._peaks[-1], peak)
+
+            self.stages.append(dict(
+                info,
+                name=name,
+                seconds=seconds,
+                peak_traced_mb=peak / 2**20,
+                peak_rss_mb=peak_rss_mb(),
+            ))
+
+        return
+
+    def __getitem__(self, name):
+        for s in self.stages:
+            if s['name'] == name:
+                return s
+        raise KeyError(name)
+
+    def report(self):
+        '''Machine-readable summary of all recorded stages.'''
+
+        return {
+            'started': self._start,
+            'total_seconds': sum(s['seconds'] for s in self.stages),
+            'peak_rss_mb': peak_rss_mb(),
+            'argv': sys.argv,
+            'cwd': os.getcwd(),
+            'host': platform.node(),
+            'python': platform.python_version(),
+            'metrics': self.metrics,
+            'stages': self.stages,
+        }
+
+    def summary(self):
+        '''Human-readable table of the recorded stages.'''
+
+        lines = ['{:<28} {:>10} {:>12} {:>12}'.format(
+            'Stage', 'Time (s)', 'Traced (MB)', 'RSS (MB)')]
+        for s in self.stages:
+            lines.append('{:<28} {:>10.3f} {:>12.1f} {:>12.1f}'.format(
+                s['name'], s['seconds'], s['peak_traced_mb'], s['peak_rss_mb']))
+        for k, v in self.metrics.items():
+            lines.append(f'{k}: {v:.4g}')
+
+        return '\n'.join(lines)
+
+    def write(self, filename):
+        '''Writes the JSON report.'''
+
+        with open(filename, 'w') as f:
+            json.dump(self.report(), f, indent=2)
+
+        return
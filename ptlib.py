@@ -0,0 +1,455 @@
+''' Parallel tempering library for CluStR '''
+
+# Sampler backend for poorly identified relations (small or heavily censored
+# samples), where the linmix Gibbs chains mix slowly. Selected with
+# `fit_method: tempering` in config.yml. Each temperature ladder samples the
+# power posteriors
+#
+#   p_beta(theta) ~ L(theta)^beta prior(theta),   1 = beta_0 > ... > beta_n = 0
+#
+# of the Kelly model marginal likelihood (reglib.kelly_loglike), with a
+# Metropolis chain per temperature and swaps between neighbouring
+# temperatures. Independent ladders run in separate processes and are
+# compared for convergence like linmix chains.
+#
+# During burn-in (the first Nmin/2 iterations) the proposal scales and the
+# temperatures are adapted so that every pair of neighbours swaps at the
+# same rate (after Vousden, Farr & Mandel 2016). The hottest finite
+# temperature stays where the likelihood no longer matters, so the prior end
+# of the integral below stays resolved. Swaps follow the deterministic
+# even/odd schedule, which moves replicas across the ladder much faster
+# than random pair choices. The ladder is frozen afterwards, and the mean
+# log-likelihood at each temperature gives the evidence by thermodynamic
+# integration,
+#
+#   ln Z = int_0^1 <ln L>_beta dbeta,
+#
+# so runs on different cut sets (or models) can be compared through their
+# evidence ratios. The priors below are proper and fixed, as the evidence
+# requires.
+
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+import threading
+import numpy as np
+import reglib
+
+# pylint: disable=invalid-name
+
+# Independent Gaussian priors (mean, standard deviation) on the parameters
+# of reglib.kelly_loglike, in log space with x pivoted.
+prior = {
+    'alpha': (0., 10.),
+    'beta': (0., 10.),
+    'lnsig': (np.log(0.3), 2.),
+    'logit': (0., 2.),
+    'mu': (0., 10.),
+    'lntau': (0., 2.),
+}
+
+# Target acceptance rate of the Metropolis moves.
+target_acceptance = 0.234
+
+# Gain of the temperature adaptation: 1/adapt_time, decaying after
+# adapt_lag iterations.
+adapt_time = 100.
+adapt_lag = 1000.
+
+def prior_moments(K=2):
+    '''Prior means and standard deviations of a theta with K components.'''
+
+    names = (['alpha', 'beta', 'lnsig'] + ['logit'] * (K-1) + ['mu'] * K
+             + ['lntau'] * K)
+
+    return (np.array([prior[n][0] for n in names]),
+            np.array([prior[n][1] for n in names]))
+
+def log_prior(theta, K=2):
+    '''Normalised log prior density of theta (or of every row of it).'''
+
+    mean, sd = prior_moments(K)
+    z = (np.asarray(theta) - mean) / sd
+
+    return -0.5 * np.sum(z**2 + np.log(2*np.pi*sd**2), axis=-1)
+
+def initial_ladder(ntemps, beta_min):
+    '''
+    Inverse temperatures falling geometrically from 1 to beta_min, then 0
+    (the prior), before adaptation.
+    '''
+
+    if ntemps < 2:
+        raise ValueError('Parallel tempering needs at least 2 temperatures.')
+
+    return np.append(np.geomspace(1., beta_min, ntemps-1), 0.)
+
+def default_beta_min(data, K=2, ndraws=256, seed=None):
+    '''
+    Hottest finite inverse temperature: small enough that the interval from
+    it to the prior contributes less than ~0.01 to ln Z, from the mean ln L
+    of prior draws (but at most one over the number of clusters).
+    '''
+
+    rng = np.random.default_rng(seed)
+    mean, sd = prior_moments(K)
+    theta = mean + sd * rng.standard_normal((ndraws, len(mean)))
+    ll = np.concatenate([
+        reglib.kelly_loglike(theta[i:i+32], *data, K=K)
+        for i in range(0, ndraws, 32)
+    ])
+    ll = np.where(np.isfinite(ll), ll, np.nan)
+    scale = abs(np.nanmean(ll)) if np.any(np.isfinite(ll)) else 1e10
+
+    return min(1. / np.size(data[0]), 0.01 / max(scale, 1.))
+
+def _hermite(b, E, V):
+    '''Integral of E over ascending betas b, starting at b = 0.'''
+
+    head = b[1] * (E[0] + E[1]) / 2.
+
+    u = np.log(b[1:])
+    f = b[1:] * E[1:]
+    df = b[1:] * (E[1:] + b[1:] * V[1:])
+    h = np.diff(u)
+
+    return (head + np.sum(h * (f[1:] + f[:-1]) / 2.)
+            + np.sum(h**2 * (df[:-1] - df[1:]) / 12.))
+
+def thermodynamic_integration(betas, mean_loglike, var_loglike):
+    '''
+    ln Z from the mean and variance of ln L at every inverse temperature of
+    a ladder ending at beta = 0. Over the finite temperatures the integral
+    is taken in ln(beta), of beta <ln L>, which is smooth there; its
+    derivative beta (<ln L> + beta Var(ln L)) gives the cubic (Hermite)
+    correction to the trapezoid rule, as Friel, Hurn & Wyse (2014) do in
+    beta. The interval from the prior to the hottest finite temperature is
+    a trapezoid. Returns the estimate and its discretisation error, from
+    the estimate on every other temperature (the error falls as the fourth
+    power of the spacing).
+    '''
+
+    order = np.argsort(betas)
+    b = np.asarray(betas, dtype=float)[order]
+    E = np.asarray(mean_loglike, dtype=float)[order]
+    V = np.asarray(var_loglike, dtype=float)[order]
+    if b[0] != 0:
+        raise ValueError('The ladder must include beta = 0.')
+
+    logZ = _hermite(b, E, V)
+    if len(b) < 4:
+        return logZ, np.nan
+
+    # Every other finite temperature, keeping both ends.
+    coarse = np.unique(np.r_[0, np.arange(1, len(b), 2), len(b) - 1])
+
+    return logZ, abs(logZ - _hermite(b[coarse], E[coarse], V[coarse])) / 15.
+
+class Ladder:
+    """
+    One parallel tempering ensemble: a Metropolis chain at each inverse
+    temperature of `betas`, all updated at once. Proposals at each
+    temperature follow the Gaussian approximation of its power posterior,
+    built from the precision H of the Laplace approximation at beta = 1;
+    the beta = 0 chain draws straight from the prior. Pickled to and from
+    the worker processes between rounds, with its random state.
+    """
+
+    def __init__(self, data, theta0, H, betas, seed, K=2):
+        # pylint: disable = too-many-arguments
+        self.data = data
+        self.K = K
+        self.H = H
+        self.betas = np.array(betas, dtype=float)
+        self.rng = np.random.default_rng(seed)
+        self.mean, self.sd = prior_moments(K)
+
+        n, P = len(self.betas), np.size(theta0)
+        self.log_scale = np.full(n, np.log(2.38 / np.sqrt(P)))
+        self._factorize()
+
+        # Start every temperature from its own approximate power posterior.
+        self.theta = theta0 + np.einsum('kij,kj->ki', self.chol,
+                                        self.rng.standard_normal((n, P)))
+        self.theta[self.betas == 0] = self._prior_draws(np.count_nonzero(self.betas == 0))
+        self.loglike = self._loglike(self.theta)
+        self.logprior = log_prior(self.theta, K)
+
+        # Replica at every temperature, and whether each replica last
+        # visited the cold (1) or hot (-1) end, for counting round trips.
+        self.replica = np.arange(n)
+        self.direction = np.zeros(n, dtype=int)
+        self.round_trips = 0
+
+        self.swap_attempts = np.zeros(n-1)
+        self.swap_accepts = np.zeros(n-1)
+        self.move_attempts = np.zeros(n)
+        self.move_accepts = np.zeros(n)
+
+        self.niter = 0
+        self.adapted = 0
+        # Draws after adaptation: beta = 1 theta and ln L at every temperature.
+        self.cold = []
+        self.loglikes = []
+
+        return
+
+    def _factorize(self):
+        '''Cholesky factors of the proposal shape at every temperature.'''
+
+        prec = self.betas[:, None, None] * self.H + np.diag(1. / self.sd**2)
+        self.chol = np.linalg.cholesky(np.linalg.inv(prec))
+
+        return
+
+    def _prior_draws(self, n):
+        return self.mean + self.sd * self.rng.standard_normal((n, len(self.mean)))
+
+    def _loglike(self, theta):
+        ll = reglib.kelly_loglike(theta, *self.data, K=self.K)
+        return np.where(np.isfinite(ll), ll, -np.inf)
+
+    def _tempered(self, ll):
+        return np.where(self.betas > 0, self.betas * ll, 0.)
+
+    def step(self, adapt):
+        '''One Metropolis move at every temperature, then a round of swaps.'''
+
+        n, P = self.theta.shape
+        rng = self.rng
+
+        step = np.exp(self.log_scale)[:, None] * np.einsum(
+            'kij,kj->ki', self.chol, rng.standard_normal((n, P)))
+        proposal = self.theta + step
+        hot = self.betas == 0
+        proposal[hot] = self._prior_draws(np.count_nonzero(hot))
+
+        ll = self._loglike(proposal)
+        lp = log_prior(proposal, self.K)
+        with np.errstate(invalid='ignore'):
+            logr = (self._tempered(ll) + lp
+                    - self._tempered(self.loglike) - self.logprior)
+        logr[hot] = 0.
+
+        accept = np.log(rng.random(n)) < logr
+        self.theta[accept] = proposal[accept]
+        self.loglike[accept] = ll[accept]
+        self.logprior[accept] = lp[accept]
+        self.move_attempts += 1
+        self.move_accepts += accept
+
+        if adapt:
+            prob = np.nan_to_num(np.exp(np.minimum(logr, 0.)))
+            gain = (self.niter + 1.)**-0.6
+            self.log_scale += np.where(hot, 0., gain * (prob - target_acceptance))
+
+        self._swap(adapt)
+        self.niter += 1
+
+        return
+
+    def _swap(self, adapt):
+        '''Even/odd swaps between neighbouring temperatures.'''
+
+        b, ll = self.betas, self.loglike
+        with np.errstate(invalid='ignore', over='ignore'):
+            logr = (b[:-1] - b[1:]) * (ll[1:] - ll[:-1])
+            prob = np.nan_to_num(np.exp(np.minimum(logr, 0.)))
+
+        for j in range(self.niter % 2, len(b) - 1, 2):
+            self.swap_attempts[j] += 1
+            if self.rng.random() < prob[j]:
+                self.swap_accepts[j] += 1
+                for a in (self.theta, self.loglike, self.logprior, self.replica):
+                    a[[j, j+1]] = a[[j+1, j]]
+
+        # Round trips: cold end, then hot end, then cold end again.
+        cold, hot = self.replica[0], self.replica[-1]
+        if self.direction[cold] == -1:
+            self.round_trips += 1
+        self.direction[cold] = 1
+        self.direction[hot] = -1
+
+        if adapt and len(b) > 3:
+            self._adapt_ladder(prob)
+
+        return
+
+    def _adapt_ladder(self, prob):
+        '''
+        Moves the finite temperatures between the fixed coldest and hottest
+        ones so neighbours swap at equal rates: the gap in ln T of a pair
+        that swaps more often than average grows, and the others shrink.
+        '''
+
+        kappa = adapt_lag / (self.niter + adapt_lag) / adapt_time
+        finite = prob[:-1]
+        lnT = -np.log(self.betas[:-1])
+        gaps = np.exp(np.log(np.diff(lnT)) + kappa * (finite - np.mean(finite)))
+        gaps *= lnT[-1] / np.sum(gaps)
+        self.betas[:-1] = np.exp(-np.concatenate(([0.], np.cumsum(gaps))))
+        self._factorize()
+
+        return
+
+    def run(self, nsteps, adapt_until):
+        '''Steps the ladder, adapting it for the first adapt_until iterations.'''
+
+        P = self.theta.shape[1]
+        start = max(self.niter, adapt_until)
+        nkeep = self.niter + nsteps - start
+        cold = np.empty((max(nkeep, 0), P))
+        loglikes = np.empty((max(nkeep, 0), len(self.betas)))
+
+        for _ in range(nsteps):
+            adapt = self.niter < adapt_until
+            self.step(adapt)
+            if adapt and self.niter == adapt_until:
+                # The ladder is fixed from here on; count its exchanges only.
+                self.swap_attempts[:] = self.swap_accepts[:] = 0.
+                self.move_attempts[:] = self.move_accepts[:] = 0.
+                self.round_trips = 0
+                self.adapted = self.niter
+            elif not adapt:
+                i = self.niter - 1 - start
+                cold[i] = self.theta[0]
+                loglikes[i] = self.loglike
+
+        self.cold.append(cold)
+        self.loglikes.append(loglikes)
+
+        return self
+
+    def second_half(self):
+        '''Draws of the second half of all iterations: (cold theta, ln L).'''
+
+        cold, loglikes = np.vstack(self.cold), np.vstack(self.loglikes)
+        skip = max(self.niter // 2 - self.adapted, 0)
+
+        return cold[skip:], loglikes[skip:]
+
+def _advance(ladder, nsteps, adapt_until):
+    '''Worker: steps one ladder and returns it.'''
+
+    return ladder.run(nsteps, adapt_until)
+
+def _in_worker():
+    '''Whether this runs in a child process or a non-main thread.'''
+
+    return (multiprocessing.parent_process() is not None
+            or threading.current_thread() is not threading.main_thread())
+
+def run_tempering(x, y, err_x, err_y, delta=None, K=2, Nmin=5000, Nmax=10000,
+                  ntemps=20, nladders=2, beta_min=None, checkiter=1000,
+                  workers=None, seed=None, vb=True):
+    # pylint: disable = too-many-arguments
+    # pylint: disable = too-many-locals
+    '''
+    Samples the Kelly model with `nladders` independent parallel tempering
+    ladders of `ntemps` temperatures, on a pool of `workers` processes (in
+    this process if workers is 1). By default there is a process per ladder,
+    unless this already is a worker process or thread (of binlib, injectlib,
+    serverlib or `queue work -n`), which runs its ladders itself rather than
+    oversubscribing the machine. Like run_linmix, it runs at least Nmin
+    and at most Nmax iterations, stopping once the R-hat of alpha, beta and
+    sigma over the second half of the beta = 1 chains drops below 1.1, and
+    returns those second halves concatenated. The hottest finite
+    temperature is beta_min (default: see default_beta_min).
+
+    Returns a dictionary with the `alpha`, `beta` and `sigma` chains, the
+    full `theta` draws, the thermodynamic integration `log_evidence` and
+    its error `log_evidence_err` (the scatter between ladders and the
+    discretisation error), and per ladder the final `betas`,
+    `swap_acceptance` of every neighbouring pair, `move_acceptance` at
+    every temperature, `round_trips` and the `mean_loglike` at each
+    temperature.
+    '''
+
+    x, y = np.asarray(x, dtype=float), np.asarray(y, dtype=float)
+    err_x, err_y = np.asarray(err_x, dtype=float), np.asarray(err_y, dtype=float)
+    delta = None if delta is None else np.asarray(delta)
+    data = (x, y, err_x, err_y, delta)
+
+    # Proposals are shaped by the Laplace approximation at the MAP.
+    fit = reglib.fit_map(x, y, err_x, err_y, delta=delta, K=K)
+    H = np.linalg.pinv(fit['cov'])
+    H = (H + H.T) / 2.
+
+    if seed is None:
+        seed = np.random.randint(2**31)
+    betas = initial_ladder(ntemps, beta_min or default_beta_min(data, K, seed=seed))
+    ladders = [
+        Ladder(data, fit['theta'], H, betas, s, K)
+        for s in np.random.SeedSequence(seed).spawn(nladders)
+    ]
+
+    adapt_until = Nmin // 2
+    if workers is None:
+        workers = 1 if _in_worker() else nladders
+    pool = ProcessPoolExecutor(workers) if workers > 1 else None
+    try:
+        niter = 0
+        while niter < Nmax:
+            nsteps = Nmin if niter == 0 else min(checkiter, Nmax - niter)
+            if pool is None:
+                ladders = [l.run(nsteps, adapt_until) for l in ladders]
+            else:
+                ladders = list(pool.map(_advance, ladders, [nsteps] * nladders,
+                                        [adapt_until] * nladders))
+            niter += nsteps
+
+            cold = [l.second_half()[0] for l in ladders]
+            rhat = [
+                reglib.split_rhat(np.concatenate([c[:, i] for c in cold]),
+                                  nsplit=nladders)
+                for i in range(3)
+            ]
+            if not vb:
+                print('Iteration: ', niter, ' Rhat: ', rhat)
+            if nladders < 2 or np.all(np.array(rhat) < 1.1):
+                break
+    finally:
+        if pool is not None:
+            pool.shutdown()
+
+    halves = [l.second_half() for l in ladders]
+    theta = np.vstack([h[0] for h in halves])
+
+    evidence = []
+    for l, (_, loglikes) in zip(ladders, halves):
+        evidence.append(thermodynamic_integration(
+            l.betas, loglikes.mean(axis=0), loglikes.var(axis=0)))
+    logZ = np.array([e[0] for e in evidence])
+    scatter = np.std(logZ, ddof=1) / np.sqrt(nladders) if nladders > 1 else 0.
+    discretization = np.mean([e[1] for e in evidence])
+
+    return {
+        'alpha': theta[:, 0],
+        'beta': theta[:, 1],
+        'sigma': np.exp(theta[:, 2]),
+        'theta': theta,
+        'niter': niter,
+        'log_evidence': float(np.mean(logZ)),
+        'log_evidence_err': float(np.hypot(scatter, discretization)),
+        'ladder_log_evidence': logZ,
+        'betas': np.array([l.betas for l in ladders]),
+        'swap_acceptance': np.array([
+            l.swap_accepts / np.maximum(l.swap_attempts, 1) for l in ladders]),
+        'move_acceptance': np.array([
+            l.move_accepts / np.maximum(l.move_attempts, 1) for l in ladders]),
+        'round_trips': np.array([l.round_trips for l in ladders]),
+        'mean_loglike': np.array([h[1].mean(axis=0) for h in halves]),
+    }
+
+def summary(result):
+    '''Human-readable exchange statistics and evidence of a tempering run.'''
+
+    lines = ['Parallel tempering: {} ladders of {} temperatures, {} iterations'.format(
+        *result['betas'].shape, result['niter'])]
+    for i, (betas, swaps) in enumerate(zip(result['betas'], result['swap_acceptance'])):
+        lines.append('  Ladder {}: beta {:.3g} ... {:.3g}, swap acceptance {:.2f}-{:.2f}, '
+                     '{} round trips'.format(i, betas[0], betas[-2], np.min(swaps),
+                                             np.max(swaps), result['round_trips'][i]))
+    lines.append('  ln(evidence) = {:.2f} +/- {:.2f} (thermodynamic integration)'.format(
+        result['log_evidence'], result['log_evidence_err']))
+
+    return '\n'.join(lines)
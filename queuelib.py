@@ -0,0 +1,465 @@
+''' Shared-filesystem work queue for CluStR '''
+
+# Distributes fit jobs over any number of worker processes, on any nodes that
+# see the same directory, without a broker. A queue is a directory:
+#
+#   <root>/pending/<id>.json   jobs waiting to run
+#   <root>/running/<id>.json   claimed jobs, with <id>.lease heartbeats
+#   <root>/done/<id>.json      finished jobs, results in <id>.npz
+#   <root>/failed/<id>.json    jobs that raised or ran out of attempts
+#
+# Jobs are claimed by renaming them from pending/ to running/, which only one
+# worker can win. A running worker touches the job's lease file every few
+# seconds; jobs whose lease has gone stale (dead worker or node) are moved
+# back to pending/ by whichever worker or coordinator reaps next.
+#
+#   python clustr.py queue submit /shared/q sweep.yml
+#   python clustr.py queue work /shared/q -n 4      # on every node
+#   python clustr.py queue status /shared/q
+
+from argparse import ArgumentParser, Namespace
+import itertools
+import json
+import multiprocessing
+import os
+import socket
+import threading
+import time
+import traceback
+import uuid
+
+# pylint: disable=invalid-name
+
+states = ('pending', 'running', 'done', 'failed')
+
+def init_queue(root):
+    '''Creates the queue directories.'''
+
+    for d in states + ('tmp',):
+        os.makedirs(os.path.join(root, d), exist_ok=True)
+
+    return
+
+def _path(root, state, job_id, ext='.json'):
+    return os.path.join(root, state, job_id + ext)
+
+def _write_atomic(filename, obj, root):
+    '''Writes JSON to a temporary file in the queue, then renames it in place.'''
+
+    tmp = os.path.join(root, 'tmp', uuid.uuid4().hex)
+    with open(tmp, 'w') as f:
+        json.dump(obj, f, indent=2)
+    os.replace(tmp, filename)
+
+    return
+
+def _read(filename):
+    with open(filename, 'r') as f:
+        return json.load(f)
+
+def expand_jobs(spec):
+    '''
+    Jobs from a sweep specification: either a list of jobs, or a dictionary
+    with a `base` job and a `grid` of keys to lists of values, expanded to
+    every combination. Keys of a job are `catalog`, `config_file`, `x`, `y`,
+    `prefix` and `config` (overrides of config_file keys); a grid key of the
+    form `config.<key>` sets an override.
+    '''
+
+    if isinstance(spec, list):
+        return spec
+
+    base = spec.get('base', {})
+    grid = spec.get('grid', {})
+
+    jobs = []
+    for values in itertools.product(*grid.values()):
+        job = dict(base, config=dict(base.get('config', {})))
+        for key, value in zip(grid, values):
+            if key == 'axes':
+                job['x'], job['y'] = value
+            elif key.startswith('config.'):
+                job['config'][key[len('config.'):]] = value
+            else:
+                job[key] = value
+        jobs.append(job)
+
+    return jobs
+
+def submit(root, jobs, max_attempts=3):
+    '''Puts jobs in the queue; returns their IDs.'''
+
+    init_queue(root)
+
+    ids = []
+    for job in jobs:
+        for key in ('catalog', 'config_file', 'x', 'y'):
+            if key not in job:
+                raise ValueError(f'Job is missing `{key}`: {job}')
+
+        job_id = '{:.6f}-{}'.format(time.time(), uuid.uuid4().hex[:8])
+        job = dict(job, id=job_id, attempts=0, max_attempts=max_attempts,
+                   submitted=time.time())
+        _write_atomic(_path(root, 'pending', job_id), job, root)
+        ids.append(job_id)
+
+    return ids
+
+def claim(root, worker):
+    '''
+    Claims the oldest pending job by renaming it into running/. Returns the
+    job, with the claim `token` its lease is tied to, or None if the queue
+    is empty.
+    '''
+
+    for name in sorted(os.listdir(os.path.join(root, 'pending'))):
+        if not name.endswith('.json'):
+            continue
+        job_id = name[:-len('.json')]
+        running = _path(root, 'running', job_id)
+        try:
+            os.rename(_path(root, 'pending', job_id), running)
+        except FileNotFoundError:
+            # Another worker was faster.
+            continue
+
+        # The lease starts now, not when the job was submitted.
+        os.utime(running)
+        job = _read(running)
+        job['token'] = '{}/{}'.format(worker, job.get('attempts', 0))
+        _write_atomic(_path(root, 'running', job_id, '.lease'),
+                      {'worker': worker, 'token': job['token'],
+                       'time': time.time()}, root)
+
+        return job
+
+    return None
+
+def _holds(root, job):
+    '''Whether the lease of a running job still carries the job's claim token.'''
+
+    try:
+        lease = _read(_path(root, 'running', job['id'], '.lease'))
+    except (FileNotFoundError, ValueError):
+        return False
+
+    return lease.get('token') == job['token']
+
+def heartbeat(root, job):
+    '''
+    Renews the lease of a running job claimed by this worker. Returns False,
+    without touching the lease, if the job was reaped (and possibly claimed
+    again by another worker) meanwhile.
+    '''
+
+    if not _holds(root, job):
+        return False
+    try:
+        os.utime(_path(root, 'running', job['id'], '.lease'))
+    except FileNotFoundError:
+        return False
+
+    return True
+
+def _last_beat(root, job_id):
+    '''Time of the last sign of life of a running job.'''
+
+    times = []
+    for ext in ('.lease', '.json'):
+        try:
+            times.append(os.path.getmtime(_path(root, 'running', job_id, ext)))
+        except FileNotFoundError:
+            pass
+
+    return max(times) if times else None
+
+def reap(root, lease_timeout=60.):
+    '''
+    Moves running jobs whose lease is older than lease_timeout seconds back
+    to pending/ (or to failed/ once they used up their attempts). Safe to
+    run from many processes at once. Returns the IDs of reaped jobs.
+    '''
+
+    reaped = []
+    now = time.time()
+    for name in os.listdir(os.path.join(root, 'running')):
+        if not name.endswith('.json'):
+            continue
+        job_id = name[:-len('.json')]
+
+        beat = _last_beat(root, job_id)
+        if beat is None or now - beat < lease_timeout:
+            continue
+
+        # Take the job away from the dead worker; only one reaper wins.
+        claimed = os.path.join(root, 'tmp', f'{job_id}.reap-{uuid.uuid4().hex}')
+        try:
+            os.rename(_path(root, 'running', job_id), claimed)
+        except FileNotFoundError:
+            continue
+
+        job = _read(claimed)
+        job['attempts'] = job.get('attempts', 0) + 1
+        job.setdefault('history', []).append(
+            {'reaped': now, 'last_beat': beat})
+
+        if job['attempts'] >= job.get('max_attempts', 3):
+            job['error'] = 'Lease expired too many times.'
+            _write_atomic(_path(root, 'failed', job_id), job, root)
+        else:
+            _write_atomic(_path(root, 'pending', job_id), job, root)
+
+        os.remove(claimed)
+        try:
+            os.remove(_path(root, 'running', job_id, '.lease'))
+        except FileNotFoundError:
+            pass
+
+        reaped.append(job_id)
+
+    return reaped
+
+def job_config(job):
+    '''The clustr.Config of a job: its config file plus its overrides.'''
+
+    import clustr
+
+    args = Namespace(config_file=job['config_file'], x=job['x'], y=job['y'],
+                     prefix=job.get('prefix'))
+    config = clustr.Config(args)
+    for key, value in job.get('config', {}).items():
+        config[key] = value
+
+    return config
+
+def check_jobs(jobs):
+    '''
+    Runs the preflight checks of every job (see preflightlib), reading only
+    catalog headers. Returns a list of (job, problems) for jobs that fail.
+    '''
+
+    import preflightlib
+
+    failed = []
+    for job in jobs:
+        try:
+            preflightlib.preflight(job_config(job), job['catalog'])
+        except preflightlib.PreflightError as e:
+            failed.append((job, e.problems))
+        except (OSError, KeyError) as e:
+            failed.append((job, [str(e)]))
+
+    return failed
+
+def run_job(root, job):
+    '''Runs the Data -> Fitter path of a job and writes its results archive.'''
+
+    import clustr
+    import iolib
+
+    config = job_config(job)
+
+    catalog = clustr.Catalog(job['catalog'], config)
+    data = clustr.Data(config, catalog)
+    fitter = clustr.Fitter(data, config)
+
+    archive = _path(root, 'done', job['id'], '.npz')
+    tmp = os.path.join(root, 'tmp', '{}-{}.npz'.format(job['id'], uuid.uuid4().hex))
+    compress = 'compress_archive' in config and config['compress_archive'] is True
+    iolib.save_archive(tmp, config, data, fitter, catalog=catalog, compress=compress)
+    os.replace(tmp, archive)
+
+    return {
+        'archive': archive,
+        'piv': float(fitter.piv),
+        'intercept': float(fitter.mean_int),
+        'slope': float(fitter.mean_slope),
+        'sigma': float(fitter.mean_sigsqr),
+        'fit_seconds': fitter.fit_seconds,
+    }
+
+def _finish(root, job, state, **info):
+    '''
+    Records a job as done or failed. Returns False if the job's lease was
+    lost meanwhile (it has been re-queued and the result is dropped).
+    '''
+
+    if not _holds(root, job):
+        return False
+
+    running = _path(root, 'running', job['id'])
+    claimed = os.path.join(root, 'tmp', f"{job['id']}.finish-{uuid.uuid4().hex}")
+    try:
+        os.rename(running, claimed)
+    except FileNotFoundError:
+        return False
+
+    # Reaped and claimed again between the lease check and the rename: the
+    # job file now belongs to a later attempt, give it back.
+    if _read(claimed).get('attempts', 0) != job.get('attempts', 0):
+        os.rename(claimed, running)
+        return False
+
+    _write_atomic(_path(root, state, job['id']), dict(job, **info), root)
+    os.remove(claimed)
+    try:
+        os.remove(_path(root, 'running', job['id'], '.lease'))
+    except FileNotFoundError:
+        pass
+
+    return True
+
+def work(root, interval=10., lease_timeout=60., poll=2., drain=False):
+    '''
+    Worker loop: reaps stale leases, claims a job, runs it while a thread
+    renews its lease every `interval` seconds, and records the result. With
+    `drain` the worker exits once nothing is pending or running; otherwise
+    it polls for new jobs every `poll` seconds.
+    '''
+
+    import numpy as np
+
+    worker = '{}-{}'.format(socket.gethostname(), os.getpid())
+    init_queue(root)
+
+    # Forked workers inherit the parent's random state; draw fresh entropy so
+    # they do not all run identical chains.
+    np.random.seed()
+
+    while True:
+        reap(root, lease_timeout)
+
+        job = claim(root, worker)
+        if job is None:
+            if drain and not os.listdir(os.path.join(root, 'running')):
+                return
+            time.sleep(poll)
+            continue
+
+        print(f"[{worker}] running job {job['id']}")
+
+        stop = threading.Event()
+
+        def beat(job=job):
+            while not stop.wait(interval):
+                if not heartbeat(root, job):
+                    print(f"[{worker}] lost the lease of job {job['id']}")
+                    return
+
+        thread = threading.Thread(target=beat, daemon=True)
+        thread.start()
+
+        start = time.time()
+        try:
+            result = run_job(root, job)
+            state, info = 'done', {'result': result}
+        except (Exception, SystemExit) as e:  # pylint: disable=broad-except
+            state = 'failed'
+            info = {'error': ''.join(traceback.format_exception_only(type(e), e))}
+        finally:
+            stop.set()
+            thread.join()
+
+        info.update(worker=worker, seconds=time.time() - start)
+        if not _finish(root, job, state, **info):
+            print(f"[{worker}] lost the lease of job {job['id']}; dropped")
+        else:
+            print(f"[{worker}] job {job['id']} {state}")
+
+def status(root):
+    '''Number of jobs in each state, and the age of every running lease.'''
+
+    init_queue(root)
+
+    counts = {
+        s: len([n for n in os.listdir(os.path.join(root, s)) if n.endswith('.json')])
+        for s in states
+    }
+    now = time.time()
+    leases = {}
+    for name in os.listdir(os.path.join(root, 'running')):
+        if name.endswith('.json'):
+            job_id = name[:-len('.json')]
+            beat = _last_beat(root, job_id)
+            leases[job_id] = None if beat is None else now - beat
+
+    return counts, leases
+
+def main(argv=None):
+    import yaml
+
+    parser = ArgumentParser(prog='clustr.py queue')
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    p = sub.add_parser('submit', help='add the jobs of a sweep file to a queue')
+    p.add_argument('root', help='queue directory (on a shared filesystem)')
+    p.add_argument('jobs', help='YAML/JSON list of jobs, or a base job and a grid')
+    p.add_argument('--max-attempts', type=int, default=3,
+        help='times a job may lose its worker before it fails')
+    p.add_argument('--no-preflight', action='store_true',
+        help='submit without checking configs against the catalog headers')
+
+    p = sub.add_parser('work', help='run jobs from a queue')
+    p.add_argument('root', help='queue directory (on a shared filesystem)')
+    p.add_argument('-n', '--processes', type=int, default=1,
+        help='worker processes to start on this node')
+    p.add_argument('--interval', type=float, default=10.,
+        help='seconds between lease heartbeats')
+    p.add_argument('--lease-timeout', type=float, default=60.,
+        help='seconds without a heartbeat before a job is re-queued')
+    p.add_argument('--drain', action='store_true',
+        help='exit once the queue is empty instead of waiting for jobs')
+
+    p = sub.add_parser('reap', help='re-queue jobs with stale leases')
+    p.add_argument('root', help='queue directory')
+    p.add_argument('--lease-timeout', type=float, default=60.,
+        help='seconds without a heartbeat before a job is re-queued')
+
+    p = sub.add_parser('status', help='show the number of jobs in each state')
+    p.add_argument('root', help='queue directory')
+
+    args = parser.parse_args(argv)
+
+    if args.command == 'submit':
+        with open(args.jobs, 'r') as stream:
+            spec = yaml.safe_load(stream)
+        jobs = expand_jobs(spec)
+        if not args.no_preflight:
+            failed = check_jobs(jobs)
+            for job, problems in failed:
+                print('Job {} ({} vs {}) failed preflight checks:'.format(
+                    job.get('catalog'), job.get('y'), job.get('x')))
+                print('\n'.join(f'  - {p}' for p in problems))
+            if failed:
+                raise SystemExit(f'ERROR: {len(failed)} of {len(jobs)} jobs are '
+                                 'misconfigured; nothing was submitted.')
+        ids = submit(args.root, jobs, max_attempts=args.max_attempts)
+        print(f'Submitted {len(ids)} jobs to {args.root}')
+
+    elif args.command == 'work':
+        kwargs = dict(interval=args.interval, lease_timeout=args.lease_timeout,
+                      drain=args.drain)
+        if args.processes == 1:
+            work(args.root, **kwargs)
+        else:
+            procs = [
+                multiprocessing.Process(target=work, args=(args.root,), kwargs=kwargs)
+                for _ in range(args.processes)
+            ]
+            for proc in procs:
+                proc.start()
+            for proc in procs:
+                proc.join()
+
+    elif args.command == 'reap':
+        reaped = reap(args.root, args.lease_timeout)
+        print(f'Re-queued {len(reaped)} jobs')
+
+    elif args.command == 'status':
+        counts, leases = status(args.root)
+        print(', '.join(f'{s}: {n}' for s, n in counts.items()))
+        for job_id, age in sorted(leases.items()):
+            if age is not None:
+                print(f'  {job_id}: last heartbeat {age:.1f} s ago')
+
+    return
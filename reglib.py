@@ -3,7 +3,6 @@
 #import rpy2.robjects as robjects
 #from rpy2.robjects.packages import importr
 import numpy as np
-from linmix import linmix
 
 # Imports the necessary R packages needed to run lrgs in python
 #RLRGS = importr('lrgs')  # Multivariate regression package by Adam Mantz
@@ -72,9 +71,19 @@ def run_lrgs(x, y, err_x, err_y, _xycov=None, nmc=500, dirichlet=True):
     # Return fit parameters consistently with run_linmix
     return (intercept, slope, sigma)
 
-def run_linmix(x, y, err_x, err_y, Nmin=5000, Nmax=10000, vb=True, delta=None):
+def run_linmix(x, y, err_x, err_y, Nmin=5000, Nmax=10000, vb=True, delta=None,
+               init=None, callback=None, checkiter=100, store=None, stats=None):
     # pylint: disable = too-many-arguments
-    ''' Runs the Kelly regression algorithm through the package linmix.'''
+    '''
+    Runs the Kelly regression algorithm through the package linmix.
+
+    By default linmix runs its own sampling loop. If `init` (a dictionary of
+    'alpha', 'beta' and 'sigsqr' draws to warm-start the chains from),
+    `callback` or `store` (a directory for a disk-backed iolib.ChainStore)
+    is given, the chains are stepped here instead, see step_linmix(). With
+    a store, the returned chains are read-only memory maps. A `stats`
+    dictionary receives the iterations `niter` each of `nchains` chains ran.
+    '''
 
     ''' For convenience, here are the linmix arguments:
 
@@ -107,25 +116,776 @@ def run_linmix(x, y, err_x, err_y, Nmin=5000, Nmax=10000, vb=True, delta=None):
     assert np.size(err_x) == np.size(err_y)
     assert np.size(x) == np.size(err_x)
 
+    from linmix import linmix
+
     L = np.size(x)
 
     # Run linmix MCMC
     xycov = np.zeros(L)
-    model = linmix.LinMix(x, y, err_x, err_y, xycov, delta, 2, 2)
-    model.run_mcmc(Nmin, Nmax, silent=vb)
+    if init is None and callback is None and store is None:
+        nchains = 2
+        model = linmix.LinMix(x, y, err_x, err_y, xycov, delta, 2, nchains)
+        model.run_mcmc(Nmin, Nmax, silent=vb)
+        chain = model.chain
+        if stats is not None:
+            # The chain holds the second half of every chain's iterations.
+            stats.update(niter=2 * np.size(chain) // nchains, nchains=nchains)
+    elif store is not None:
+        import iolib
+
+        nchains = 2
+        capacity = checkiter * int(np.ceil(Nmax / checkiter))
+        chain = step_linmix(x, y, err_x, err_y, xycov, delta, Nmin, Nmax,
+                            init=init, callback=callback, checkiter=checkiter,
+                            nchains=nchains, vb=vb, stats=stats,
+                            store=iolib.ChainStore(store, nchains, capacity))
+
+        return (chain['alpha'], chain['beta'], chain['sigma'])
+    else:
+        chain = step_linmix(x, y, err_x, err_y, xycov, delta, Nmin, Nmax,
+                            init=init, callback=callback, checkiter=checkiter,
+                            vb=vb, stats=stats)
 
     # return intercept, slope, intrinsic scatter
-    intercept = model.chain['alpha']
-    slope = model.chain['beta']
-    sigma = np.sqrt(model.chain['sigsqr'])
+    intercept = chain['alpha']
+    slope = chain['beta']
+    sigma = np.sqrt(chain['sigsqr'])
 
     # Return fit parameters consistently with run_lrgs
     return (intercept, slope, sigma)
 
 
-def check_convergence(_intercept, _slope, _sigma):
+def unpack_kelly(theta, K=2):
+    '''
+    Splits a Kelly model parameter vector into its parts. theta holds
+    [alpha, beta, ln(sigma), K-1 mixture logits, K means mu, K ln(tau)]:
+    the intercept, slope and intrinsic scatter of the relation and the
+    weights, means and widths of the Gaussian mixture for the covariate.
+    A (samples x parameters) theta gives arrays with a leading sample axis.
+    '''
+
+    from scipy.special import logsumexp
+
+    theta = np.asarray(theta, dtype=float)
+    alpha, beta, lnsig = theta[..., 0], theta[..., 1], theta[..., 2]
+    logits = np.concatenate(
+        (np.zeros(theta.shape[:-1] + (1,)), theta[..., 3:K+2]), axis=-1)
+
+    return {
+        'alpha': alpha,
+        'beta': beta,
+        'sigma': np.exp(lnsig),
+        'logpi': logits - logsumexp(logits, axis=-1, keepdims=True),
+        'mu': theta[..., K+2:2*K+2],
+        'tau': np.exp(theta[..., 2*K+2:3*K+2]),
+    }
+
+def kelly_loglike(theta, x, y, err_x, err_y, delta=None, K=2):
+    # pylint: disable = too-many-arguments
+    '''
+    Marginal log-likelihood of the Kelly (2007) measurement-error model, the
+    model linmix samples, vectorized over clusters and mixture components.
+    The true covariate xi follows a mixture of K Gaussians and
+    eta = alpha + beta xi + N(0, sigma^2); integrating out xi and eta leaves
+    a bivariate Gaussian mixture for the observed (x, y), which is evaluated
+    as p(x) p(y | x). Censored clusters (delta == 0) contribute
+    P(y_true < y | x) instead of p(y | x). theta is laid out as in
+    unpack_kelly(); a (samples x parameters) theta gives the log-likelihood
+    of every sample.
+    '''
+
+    from scipy.special import log_ndtr
+
+    p = unpack_kelly(theta, K)
+
+    # Samples (if any) along the first axis, then components, then clusters.
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    vx_err = np.asarray(err_x, dtype=float)**2
+    vy_err = np.asarray(err_y, dtype=float)**2
+
+    alpha = p['alpha'][..., None, None]
+    beta = p['beta'][..., None, None]
+    sigma = p['sigma'][..., None, None]
+    tau2 = p['tau'][..., None]**2
+    mu = p['mu'][..., None]
+    dx = x - mu
+
+    # p(x): the mixture convolved with the x errors.
+    vx = tau2 + vx_err
+    lpx = -0.5 * (np.log(2*np.pi*vx) + dx**2 / vx)
+
+    # p(y | x) for every component.
+    cxy = beta * tau2
+    my = alpha + beta * mu + cxy / vx * dx
+    # beta^2 tau^2 - cxy^2/vx, without the cancellation for wide components.
+    vy = beta**2 * tau2 * vx_err / vx + sigma**2 + vy_err
+    z = (y - my) / np.sqrt(vy)
+
+    lpy = -0.5 * (np.log(2*np.pi*vy) + z**2)
+    if delta is not None:
+        censored = np.asarray(delta) == 0
+        if np.any(censored):
+            lpy[..., censored] = log_ndtr(z[..., censored])
+
+    return np.sum(np.logaddexp.reduce(p['logpi'][..., None] + lpx + lpy, axis=-2),
+                  axis=-1)
+
+def _hessian(f, theta, rel_step=1e-4):
+    '''Central finite-difference Hessian of a scalar function.'''
+
+    n = np.size(theta)
+    h = rel_step * np.maximum(np.abs(theta), 1.)
+    H = np.empty((n, n))
+    f0 = f(theta)
+
+    for i in range(n):
+        ei = np.zeros(n)
+        ei[i] = h[i]
+        H[i, i] = (f(theta + ei) - 2*f0 + f(theta - ei)) / h[i]**2
+        for j in range(i):
+            ej = np.zeros(n)
+            ej[j] = h[j]
+            H[i, j] = H[j, i] = (
+                f(theta + ei + ej) - f(theta + ei - ej)
+                - f(theta - ei + ej) + f(theta - ei - ej)
+            ) / (4 * h[i] * h[j])
+
+    return H
+
+def kelly_guess(x, y, err_x, err_y, K=2):
+    '''Starting point for the Kelly model: least squares and x quantiles.'''
+
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+
+    beta, alpha = np.polyfit(x, y, 1)
+    resid = np.var(y - alpha - beta*x) - np.mean(np.asarray(err_y)**2)
+    sigma = np.sqrt(max(resid, 0.01 * np.var(y)))
+
+    mu = np.quantile(x, (np.arange(K) + 0.5) / K)
+    tau = np.sqrt(max(np.var(x) - np.mean(np.asarray(err_x)**2),
+                      0.01 * np.var(x)) / K)
+
+    return np.concatenate((
+        [alpha, beta, np.log(sigma)], np.zeros(K-1), mu,
+        np.full(K, np.log(tau))
+    ))
+
+def fit_map(x, y, err_x, err_y, delta=None, K=2, theta0=None):
+    # pylint: disable = too-many-arguments
+    '''
+    Maximum a posteriori fit of the Kelly model with scipy.optimize, under
+    flat priors on the parameters of kelly_loglike() (so this is also the
+    maximum-likelihood fit), plus its Laplace approximation: the inverse
+    Hessian of -log L at the optimum. Returns a dictionary with the MAP
+    parameter vector `theta`, its covariance `cov`, the log-likelihood and
+    the optimizer result.
+    '''
+
+    from scipy.optimize import minimize
+
+    def nll(theta):
+        value = -kelly_loglike(theta, x, y, err_x, err_y, delta, K)
+        return value if np.isfinite(value) else 1e300
+
+    if theta0 is None:
+        theta0 = kelly_guess(x, y, err_x, err_y, K)
+
+    result = minimize(nll, theta0, method='L-BFGS-B')
+    if not result.success:
+        print(f'WARNING: MAP fit did not converge: {result.message}')
+
+    H = _hessian(nll, result.x)
+    try:
+        cov = np.linalg.inv(H)
+        np.linalg.cholesky(cov)
+    except np.linalg.LinAlgError:
+        print('WARNING: Hessian at the MAP is not positive definite; '
+              'Laplace errors are unreliable.')
+        cov = np.linalg.pinv(H)
+        w, v = np.linalg.eigh((cov + cov.T) / 2.)
+        cov = (v * np.maximum(w, 0.)) @ v.T
+
+    return {
+        'theta': result.x,
+        'cov': cov,
+        'loglike': -result.fun,
+        'K': K,
+        'result': result,
+    }
+
+def run_map(x, y, err_x, err_y, delta=None, K=2, nsamples=10000):
+    # pylint: disable = too-many-arguments
+    '''
+    Fast alternative to run_linmix: the MAP fit of the same model with
+    Laplace-approximation errors (see fit_map). Returns `nsamples` draws of
+    (intercept, slope, sigma) from the Gaussian approximation, so callers
+    can treat them like chains.
+    '''
+
+    fit = fit_map(x, y, err_x, err_y, delta=delta, K=K)
+
+    draws = np.random.multivariate_normal(fit['theta'][:3], fit['cov'][:3, :3],
+                                          size=nsamples)
+
+    # Return fit parameters consistently with run_linmix
+    return (draws[:, 0], draws[:, 1], np.exp(draws[:, 2]))
+
+def step_linmix(x, y, err_x, err_y, xycov, delta, Nmin, Nmax, init=None,
+                callback=None, checkiter=100, nchains=2, K=2, vb=True,
+                store=None, stats=None):
+    # pylint: disable = too-many-arguments
+    # pylint: disable = too-many-locals
+    '''
+    Steps linmix Gibbs chains in blocks of `checkiter` iterations, mirroring
+    LinMix.run_mcmc: at least Nmin and at most Nmax iterations, stopping once
+    the R-hat of alpha, beta and sigsqr over the second half of the chains
+    drops below 1.1. Returns the second halves of all chains concatenated,
+    like linmix.
+
+    init: dictionary of 'alpha', 'beta' and 'sigsqr' draws (e.g. a previous
+          posterior). Each chain starts from a random draw instead of the
+          linmix initial guess.
+    callback: called as callback(niter, block) after every block, where
+              block maps 'alpha', 'beta' and 'sigsqr' to the newest draws as
+              (nchains, checkiter) arrays.
+    store: an iolib.ChainStore. Every block is written to it and the
+           in-memory chains only ever hold one block; the store's finalized
+           memory-mapped chains are returned instead.
+    stats: a dictionary that receives the iterations `niter` each of the
+           `nchains` chains ran.
+    '''
+
+    from linmix import linmix
+
+    chains = [
+        linmix.Chain(x, y, err_x, err_y, xycov, delta, K, nchains)
+        for _ in range(nchains)
+    ]
+
+    for c in chains:
+        c.initial_guess()
+        if init is not None:
+            j = np.random.randint(np.size(init['alpha']))
+            c.alpha = init['alpha'][j]
+            c.beta = init['beta'][j]
+            c.sigsqr = init['sigsqr'][j]
+        c.initialize_chain(checkiter if store is not None else Nmin)
+
+    params = ('alpha', 'beta', 'sigsqr')
+    niter = 0
+    # Iterations already flushed to the store.
+    offset = 0
+    while niter < Nmax:
+        for c in chains:
+            if len(c.chain) < niter - offset + checkiter:
+                c.chain = np.hstack(
+                    (c.chain, np.empty(checkiter, dtype=c.chain.dtype)))
+            c.step(checkiter)
+        niter += checkiter
+
+        block = {
+            p: np.array([c.chain[p][niter-offset-checkiter:niter-offset]
+                         for c in chains])
+            for p in params
+        }
+
+        if store is not None:
+            store.append(block)
+            for c in chains:
+                c.initialize_chain(checkiter)
+            offset = niter
+
+        if callback is not None:
+            callback(niter, block)
+
+        if niter >= Nmin:
+            if store is not None:
+                halves = {p: store.second_half(p) for p in params}
+            else:
+                halves = {
+                    p: np.array([c.chain[p][niter//2:niter] for c in chains])
+                    for p in params
+                }
+            rhat = [split_rhat(np.hstack(halves[p]), nsplit=nchains)
+                    for p in params]
+            if not vb:
+                print('Iteration: ', niter, ' Rhat: ', rhat)
+            if np.all(np.array(rhat) < 1.1):
+                break
+
+    if stats is not None:
+        stats.update(niter=niter, nchains=nchains)
+
+    if store is not None:
+        return store.finalize()
+
+    return np.hstack([c.chain[niter//2:niter] for c in chains])
+
+class JointChain:
+    """
+    Gibbs sampler for the Kelly (2007) model with several responses of one
+    covariate: the true covariate xi follows a mixture of K Gaussians, as in
+    linmix, and the true responses are eta = alpha + beta xi + N(0, Sigma)
+    with vectors alpha and beta and a full M x M intrinsic scatter
+    covariance Sigma (Jeffreys prior, so inverse-Wishart draws). Every
+    response is fit against the same xi draws. Measurement errors are
+    independent; censored responses (delta == 0) are upper limits and are
+    redrawn below their limit every iteration. Like linmix.Chain, draws come
+    from the global NumPy RNG.
+
+    x, err_x: (N,) arrays; y, err_y, delta: (N, M) arrays.
+    """
+
+    def __init__(self, x, y, err_x, err_y, delta=None, K=2):
+        # pylint: disable = too-many-arguments
+        self.x = np.asarray(x, dtype=float)
+        self.y_obs = np.asarray(y, dtype=float)
+        self.err_y = np.asarray(err_y, dtype=float)
+        self.wx = 1. / np.asarray(err_x, dtype=float)**2
+        self.wy = 1. / self.err_y**2
+        self.censored = (np.zeros(self.y_obs.shape, dtype=bool) if delta is None
+                         else np.asarray(delta) == 0)
+        self.K = K
+
+        return
+
+    def initial_guess(self):
+        '''Least-squares relation and quantile-spaced mixture components.'''
+
+        x, y = self.x, self.y_obs
+        N, M = y.shape
+        K = self.K
+
+        self.xi = x.copy()
+        self.y = y.copy()
+        self.eta = y.copy()
+
+        X = np.column_stack((np.ones(N), x))
+        B = np.linalg.lstsq(X, y, rcond=None)[0]
+        self.alpha, self.beta = B[0], B[1]
+        resid = y - X @ B
+        cov = np.atleast_2d(np.cov(resid.T))
+        floor = 0.01 * np.var(y, axis=0)
+        cov[np.diag_indices(M)] = np.maximum(
+            np.diag(cov) - np.mean(self.err_y**2, axis=0), floor)
+        self.Sigma = cov
+
+        self.pi = np.full(K, 1. / K)
+        self.mu = np.quantile(x, (np.arange(K) + 0.5) / K)
+        self.tausqr = np.full(K, np.var(x) / K)
+        self.G = np.random.randint(K, size=N)
+        self.mu0 = np.mean(x)
+        self.usqr = np.var(x) / 2.
+        self.wsqr = np.var(x)
+
+        return
+
+    def _update_y(self):
+        '''Draws censored responses below their upper limits.'''
+
+        from scipy.special import ndtr, ndtri
+
+        c = self.censored
+        if not np.any(c):
+            return
+
+        eta, s = self.eta[c], self.err_y[c]
+        top = ndtr((self.y_obs[c] - eta) / s)
+        u = np.random.uniform(size=np.size(eta)) * top
+        self.y[c] = eta + s * ndtri(np.clip(u, 1e-300, 1.))
+
+        return
+
+    def _update_eta(self):
+        M = self.y.shape[1]
+        Sinv = np.linalg.inv(self.Sigma)
+
+        # Per-cluster posterior precision Sigma^-1 + diag(1/err_y^2).
+        P = Sinv[None, :, :] + self.wy[:, :, None] * np.eye(M)[None, :, :]
+        prior = self.alpha[None, :] + self.xi[:, None] * self.beta[None, :]
+        rhs = prior @ Sinv + self.wy * self.y
+
+        L = np.linalg.cholesky(P)
+        mean = np.linalg.solve(P, rhs[:, :, None])
+        z = np.random.normal(size=mean.shape)
+        self.eta = (mean + np.linalg.solve(np.swapaxes(L, -1, -2), z))[:, :, 0]
+
+        return Sinv
+
+    def _update_xi(self, Sinv):
+        Sb = Sinv @ self.beta
+        tausqr = self.tausqr[self.G]
+
+        prec = 1. / tausqr + self.wx + self.beta @ Sb
+        mean = (self.mu[self.G] / tausqr + self.wx * self.x
+                + (self.eta - self.alpha) @ Sb) / prec
+        self.xi = mean + np.random.normal(size=np.size(mean)) / np.sqrt(prec)
+
+        return
+
+    def _update_coefs(self):
+        from scipy.stats import invwishart
+
+        N, M = self.eta.shape
+        X = np.column_stack((np.ones(N), self.xi))
+
+        # Multivariate regression of eta on (1, xi) under a flat prior.
+        XtX_inv = np.linalg.inv(X.T @ X)
+        B = XtX_inv @ (X.T @ self.eta)
+        Z = np.random.normal(size=(2, M))
+        B = B + np.linalg.cholesky(XtX_inv) @ Z @ np.linalg.cholesky(self.Sigma).T
+        self.alpha, self.beta = B[0], B[1]
+
+        E = self.eta - X @ B
+        self.Sigma = np.atleast_2d(invwishart.rvs(df=N, scale=E.T @ E))
+
+        return
+
+    def _update_mixture(self):
+        K = self.K
+        xi, G = self.xi, self.G
+
+        # Component labels, with the Gumbel-max trick.
+        logp = (np.log(self.pi) - 0.5*np.log(self.tausqr)
+                - 0.5 * (xi[:, None] - self.mu)**2 / self.tausqr)
+        self.G = G = np.argmax(logp + np.random.gumbel(size=logp.shape), axis=1)
+
+        nk = np.bincount(G, minlength=K)
+        self.pi = np.random.dirichlet(nk + 1)
+
+        sk = np.bincount(G, weights=xi, minlength=K)
+        prec = nk / self.tausqr + 1. / self.usqr
+        mean = (sk / self.tausqr + self.mu0 / self.usqr) / prec
+        self.mu = mean + np.random.normal(size=K) / np.sqrt(prec)
+
+        ssk = np.bincount(G, weights=(xi - self.mu[G])**2, minlength=K)
+        self.tausqr = (self.wsqr + ssk) / np.random.chisquare(nk + 1)
+
+        # Hyperparameters of the mixture, as in Kelly (2007).
+        self.mu0 = np.mean(self.mu) + np.random.normal() * np.sqrt(self.usqr / K)
+        self.usqr = ((self.wsqr + np.sum((self.mu - self.mu0)**2))
+                     / np.random.chisquare(K + 1))
+        self.wsqr = np.random.gamma((K + 3) / 2.,
+                                    2. / (1. / self.usqr + np.sum(1. / self.tausqr)))
+
+        return
+
+    def step(self, niter):
+        '''
+        Runs niter Gibbs iterations. Returns the draws of 'alpha' and 'beta'
+        as (niter, M) arrays and of 'cov' (Sigma) as an (niter, M, M) array.
+        '''
+
+        M = self.y.shape[1]
+        draws = {
+            'alpha': np.empty((niter, M)),
+            'beta': np.empty((niter, M)),
+            'cov': np.empty((niter, M, M)),
+        }
+
+        for i in range(niter):
+            self._update_y()
+            Sinv = self._update_eta()
+            self._update_xi(Sinv)
+            self._update_coefs()
+            self._update_mixture()
+
+            draws['alpha'][i] = self.alpha
+            draws['beta'][i] = self.beta
+            draws['cov'][i] = self.Sigma
+
+        return draws
+
+def run_joint_linmix(x, y, err_x, err_y, delta=None, K=2, Nmin=5000,
+                     Nmax=10000, nchains=2, checkiter=100, vb=True, stats=None):
+    # pylint: disable = too-many-arguments
+    # pylint: disable = too-many-locals
     '''
-    FIX: In future, should implement a function that checks the convergence of
-    the MCMC using autocorrelation, etc. and display plots/statistics.
+    Fits M responses y (an (N, M) array, errors err_y likewise) against one
+    covariate x in a single sampler, see JointChain. Chains are stepped in
+    blocks of `checkiter` iterations like step_linmix: at least Nmin and at
+    most Nmax iterations, stopping once the R-hat of every intercept, slope
+    and scatter over the second half of the chains drops below 1.1. Returns
+    the second halves of all chains concatenated: 'alpha' and 'beta' as
+    (n, M) arrays and the intrinsic scatter covariance 'cov' as (n, M, M).
+    A `stats` dictionary receives the iterations `niter` each of `nchains`
+    chains ran, as in step_linmix.
     '''
-    pass
+
+    y = np.asarray(y, dtype=float)
+    if y.ndim == 1:
+        y = y[:, None]
+    err_y = np.asarray(err_y, dtype=float).reshape(y.shape)
+    if delta is not None:
+        delta = np.broadcast_to(np.asarray(delta).reshape(len(y), -1), y.shape)
+
+    chains = [JointChain(x, y, err_x, err_y, delta, K) for _ in range(nchains)]
+    for c in chains:
+        c.initial_guess()
+
+    params = ('alpha', 'beta', 'cov')
+    blocks = [{p: [] for p in params} for _ in chains]
+    niter = 0
+    while niter < Nmax:
+        for c, b in zip(chains, blocks):
+            draws = c.step(checkiter)
+            for p in params:
+                b[p].append(draws[p])
+        niter += checkiter
+
+        if niter >= Nmin:
+            halves = {
+                p: [np.concatenate(b[p])[niter//2:] for b in blocks]
+                for p in params
+            }
+            M = y.shape[1]
+            rhat = [
+                split_rhat(np.concatenate(h), nsplit=nchains)
+                for h in ([[c[:, j] for c in halves['alpha']] for j in range(M)]
+                          + [[c[:, j] for c in halves['beta']] for j in range(M)]
+                          + [[c[:, j, j] for c in halves['cov']] for j in range(M)])
+            ]
+            if not vb:
+                print('Iteration: ', niter, ' Rhat: ', rhat)
+            if np.all(np.array(rhat) < 1.1):
+                break
+
+    if stats is not None:
+        stats.update(niter=niter, nchains=nchains)
+
+    return {
+        p: np.concatenate([np.concatenate(b[p])[niter//2:niter] for b in blocks])
+        for p in params
+    }
+
+class HistogramQuantiles:
+    """
+    Streaming percentiles of many variables at once (e.g. the fitted line at
+    every grid point) from a fixed-bin histogram per variable. Draws are
+    added in blocks with update(), so memory stays at nvar x nbins counts
+    however many draws there are. Each histogram's range is set by the first
+    block and doubled, merging neighbouring bins, whenever later draws fall
+    outside of it. Percentiles are interpolated within a bin.
+    """
+
+    def __init__(self, nvar, nbins=256):
+        if nbins % 2:
+            raise ValueError('nbins must be even.')
+
+        self.nvar = nvar
+        self.nbins = nbins
+        self.n = 0
+        self.counts = np.zeros((nvar, nbins), dtype=np.int64)
+        self.lo = None
+        self.width = None
+
+        return
+
+    def update(self, draws):
+        '''Adds a block of finite draws, as an (ndraws, nvar) array.'''
+
+        draws = np.asarray(draws, dtype=float).reshape(-1, self.nvar)
+        if len(draws) == 0:
+            return
+
+        vmin = np.min(draws, axis=0)
+        vmax = np.max(draws, axis=0)
+
+        if self.lo is None:
+            span = vmax - vmin
+            span[span == 0] = 1e-6 * np.maximum(np.abs(vmax[span == 0]), 1.)
+            self.lo = vmin - 0.5*span
+            self.width = 2. * span / self.nbins
+        else:
+            self._expand(vmin, vmax)
+
+        idx = np.floor((draws - self.lo) / self.width).astype(np.int64)
+        np.clip(idx, 0, self.nbins-1, out=idx)
+        idx += np.arange(self.nvar) * self.nbins
+
+        self.counts += np.bincount(
+            idx.ravel(), minlength=self.nvar*self.nbins
+        ).reshape(self.nvar, self.nbins)
+        self.n += len(draws)
+
+        return
+
+    def _expand(self, vmin, vmax):
+        '''Doubles the range of every histogram that misses [vmin, vmax].'''
+
+        half = self.nbins // 2
+        while True:
+            down = vmin < self.lo
+            up = vmax >= self.lo + self.nbins * self.width
+            cols = np.where(down | up)[0]
+            if len(cols) == 0:
+                return
+
+            # Grow downwards first if both ends are missed; the next pass
+            # takes care of the upper end.
+            d = down[cols]
+            merged = self.counts[cols].reshape(len(cols), half, 2).sum(axis=2)
+            counts = np.zeros((len(cols), self.nbins), dtype=self.counts.dtype)
+            counts[~d, :half] = merged[~d]
+            counts[d, half:] = merged[d]
+
+            self.counts[cols] = counts
+            self.lo[cols] -= np.where(d, self.nbins * self.width[cols], 0.)
+            self.width[cols] *= 2.
+
+    def percentiles(self, q):
+        '''Percentiles q (0-100) of every variable, as a (len(q), nvar) array.'''
+
+        cum = np.cumsum(self.counts, axis=1)
+        rows = np.arange(self.nvar)
+
+        out = np.empty((len(q), self.nvar))
+        for i, p in enumerate(q):
+            target = p / 100. * self.n
+            k = np.minimum(np.sum(cum < target, axis=1), self.nbins-1)
+            below = np.where(k > 0, cum[rows, k-1], 0)
+            frac = (target - below) / np.maximum(self.counts[rows, k], 1)
+            out[i] = self.lo + (k + np.clip(frac, 0., 1.)) * self.width
+
+        return out
+
+def residual_scores(x, y, err_x, err_y, intercept, slope, sigma, delta=None,
+                    nsigma=3., budget=2**25):
+    # pylint: disable = too-many-arguments
+    # pylint: disable = too-many-locals
+    '''
+    Posterior summaries of every cluster's residual from the fitted line.
+    For each posterior sample s and cluster i the residual is normalised by
+    the total expected spread, measurement errors and intrinsic scatter:
+
+        r_si = (y_i - a_s - b_s x_i) / sqrt(err_y_i^2 + (b_s err_x_i)^2 + sigma_s^2)
+
+    and the (samples x clusters) matrix is evaluated in blocks that stay
+    below `budget` bytes. Returns a dictionary of per-cluster arrays: the
+    posterior mean and standard deviation of r, the posterior mean tail
+    probability `pvalue` and `outlier_prob`, the fraction of samples with
+    |r| > nsigma. Censored clusters (delta == 0) are upper limits, so only
+    residuals far below the line count against them.
+    '''
+
+    from scipy.special import ndtr
+
+    x, y = np.asarray(x, dtype=float), np.asarray(y, dtype=float)
+    var_x = np.asarray(err_x, dtype=float)**2
+    var_y = np.asarray(err_y, dtype=float)**2
+    if delta is None:
+        censored = np.zeros(np.size(x), dtype=bool)
+    else:
+        censored = np.asarray(delta) == 0
+
+    nsamp = np.size(intercept)
+    nrow = min(nsamp, 4096)
+    ncol = max(1, budget // (8 * nrow))
+
+    sums = {k: np.zeros(np.size(x)) for k in ('r', 'r2', 'p', 'out')}
+    for i in range(0, np.size(x), ncol):
+        cols = slice(i, i+ncol)
+        cen = censored[cols]
+        for j in range(0, nsamp, nrow):
+            a = np.asarray(intercept[j:j+nrow])[:, None]
+            b = np.asarray(slope[j:j+nrow])[:, None]
+            s2 = np.asarray(sigma[j:j+nrow])[:, None]**2
+
+            r = (y[cols] - a - b * x[cols])
+            r /= np.sqrt(var_y[cols] + b**2 * var_x[cols] + s2)
+
+            p = np.where(cen, ndtr(r), 2. * ndtr(-np.abs(r)))
+            out = np.where(cen, r < -nsigma, np.abs(r) > nsigma)
+
+            sums['r'][cols] += r.sum(axis=0)
+            sums['r2'][cols] += (r**2).sum(axis=0)
+            sums['p'][cols] += p.sum(axis=0)
+            sums['out'][cols] += out.sum(axis=0)
+
+    mean = sums['r'] / nsamp
+
+    return {
+        'residual': mean,
+        'residual_std': np.sqrt(np.maximum(sums['r2'] / nsamp - mean**2, 0.)),
+        'pvalue': sums['p'] / nsamp,
+        'outlier_prob': sums['out'] / nsamp,
+    }
+
+def autocorrelation_time(chain, c=5.0):
+    '''
+    Integrated autocorrelation time of a 1-D chain, estimated from the FFT
+    autocorrelation function with Sokal's automatic window of size c*tau.
+    '''
+
+    chain = np.asarray(chain, dtype=float)
+    n = np.size(chain)
+    if n < 2:
+        return 1.
+
+    x = chain - np.mean(chain)
+    nfft = 2**int(np.ceil(np.log2(2*n)))
+    f = np.fft.rfft(x, n=nfft)
+    acf = np.fft.irfft(f * np.conjugate(f), n=nfft)[:n]
+    if acf[0] <= 0:
+        return 1.
+    acf /= acf[0]
+
+    taus = 2.0*np.cumsum(acf) - 1.0
+    window = np.arange(n) < c*taus
+    m = np.argmin(window) if not np.all(window) else n - 1
+
+    return max(taus[m], 1.)
+
+def effective_sample_size(chain):
+    ''' Number of effectively independent samples in a 1-D chain. '''
+
+    return np.size(chain) / autocorrelation_time(chain)
+
+def split_rhat(chain, nsplit=4):
+    '''
+    Gelman-Rubin potential scale reduction factor of a 1-D chain split into
+    nsplit consecutive pieces. linmix returns its chains concatenated, so
+    an even nsplit also compares the independent chains with each other.
+    '''
+
+    chain = np.asarray(chain, dtype=float)
+    n = np.size(chain) // nsplit
+    if n < 2:
+        return np.nan
+
+    pieces = chain[:n*nsplit].reshape(nsplit, n)
+    W = np.mean(np.var(pieces, axis=1, ddof=1))
+    B = n * np.var(np.mean(pieces, axis=1), ddof=1)
+    if W == 0:
+        return 1.
+
+    var = (n - 1.) / n * W + B / n
+
+    return np.sqrt(var / W)
+
+def check_convergence(intercept, slope, sigma, max_draws=2**20):
+    '''
+    Checks the convergence of the MCMC with the split R-hat and the
+    autocorrelation-based effective sample size of each parameter. R-hat
+    values above ~1.1 mean the chains have not mixed.
+
+    Chains longer than `max_draws` (e.g. memory-mapped ones) are thinned
+    evenly to at most that many draws first, so only the thinned draws are
+    ever read into memory. The autocorrelation time `tau` is reported in
+    iterations of the full chain.
+    '''
+
+    diagnostics = {}
+    for name, chain in (('intercept', intercept), ('slope', slope), ('sigma', sigma)):
+        step = max(1, -(-np.size(chain) // max_draws))
+        thinned = np.asarray(chain[::step], dtype=float)
+        tau = autocorrelation_time(thinned)
+        diagnostics[name] = {
+            'rhat': split_rhat(thinned),
+            'ess': np.size(thinned) / tau,
+            'tau': tau * step,
+        }
+
+    return diagnostics
@@ -0,0 +1,371 @@
+''' Local fit server for CluStR '''
+
+# Keeps catalogs resident in memory and runs fit jobs from a priority queue on
+# a pool of worker threads, so repeated fits against the same catalog skip
+# interpreter start-up, imports and catalog loading.
+#
+# Start it with
+#
+#   python clustr.py serve config.yml --port 8765 --workers 2
+#
+# and talk to it over HTTP:
+#
+#   POST /jobs              {"catalog": "cat.fits", "x": "lambda", "y": "tr2500",
+#                            "config": {...overrides...}, "priority": 0}
+#   GET  /jobs/<id>         status and summary (add ?chains=1 for the chains)
+#   GET  /jobs/<id>/events  progress events streamed as JSON lines
+#   GET  /status            queue length, jobs and cached catalogs
+#
+# While sampling, jobs report the iteration count, throughput, ETA and
+# running R-hat/ESS every `telemetry_interval` seconds (see telemlib). Only
+# the newest `--keep-jobs` finished jobs are kept, with their chains.
+
+from argparse import ArgumentParser
+import itertools
+import json
+import os
+import queue
+import threading
+import time
+import traceback
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import numpy as np
+import clustr
+
+# pylint: disable=invalid-name
+
+class CatalogCache:
+    """
+    Catalogs kept in memory, keyed by path. A catalog is reloaded if its file
+    changed on disk since it was cached.
+    """
+
+    def __init__(self):
+        self._catalogs = {}
+        self._lock = threading.Lock()
+
+        return
+
+    def get(self, file_name):
+        path = os.path.abspath(file_name)
+        mtime = os.path.getmtime(path)
+
+        with self._lock:
+            cached = self._catalogs.get(path)
+            if cached is not None and cached[0] == mtime:
+                return cached[1]
+
+            catalog = clustr.Catalog(path, None)
+            self._catalogs[path] = (mtime, catalog)
+
+        return catalog
+
+    def __contains__(self, file_name):
+        return os.path.abspath(file_name) in self._catalogs
+
+    def __len__(self):
+        return len(self._catalogs)
+
+    def __iter__(self):
+        return iter(list(self._catalogs))
+
+class Job:
+    """A queued fit request and the progress events it has produced."""
+
+    def __init__(self, job_id, request):
+        self.id = job_id
+        self.request = request
+        self.priority = int(request.get('priority', 0))
+        self.status = 'queued'
+        self.result = None
+        self.error = None
+        self.events = []
+        self._cond = threading.Condition()
+
+        self.emit('queued')
+
+        return
+
+    def progress(self, line):
+        """Records a sampler telemetry line (see telemlib) as an event."""
+
+        info = {k: v for k, v in line.items()
+                if k not in ('status', 'time', 'label', 'host', 'pid', 'interval')}
+        self.emit('sampling', sampler=line['status'], **info)
+
+        return
+
+    def emit(self, status, **info):
+        """Records a progress event and wakes up any streaming clients."""
+
+        with self._cond:
+            self.status = status
+            self.events.append(dict(info, status=status, time=time.time()))
+            self._cond.notify_all()
+
+        return
+
+    def stream(self, timeout=1.0):
+        """Yields events as they arrive until the job has finished."""
+
+        n = 0
+        while True:
+            with self._cond:
+                while n == len(self.events) and not self.finished:
+                    self._cond.wait(timeout)
+                new = self.events[n:]
+                n = len(self.events)
+                finished = self.finished
+
+            for event in new:
+                yield event
+
+            if finished and n == len(self.events):
+                return
+
+    @property
+    def finished(self):
+        return self.status in ('done', 'failed')
+
+    def to_dict(self, chains=False):
+        d = {
+            'id': self.id,
+            'status': self.status,
+            'priority': self.priority,
+            'request': self.request,
+        }
+        if self.error is not None:
+            d['error'] = self.error
+        if self.result is not None:
+            d['piv'] = float(self.result.piv)
+            d['summary'] = {
+                name: {k: float(v) for k, v in stats.items()}
+                for name, stats in self.result.summary().items()
+            }
+            if chains:
+                d['chains'] = {
+                    name: np.asarray(chain).tolist()
+                    for name, chain in self.result.chains.items()
+                }
+
+        return d
+
+class FitServer(ThreadingHTTPServer):
+    """
+    HTTP server holding the catalog cache, the job table and the priority
+    queue. Jobs with a lower `priority` value run first. Beyond `keep_jobs`
+    finished jobs, the oldest are dropped along with their results.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, address, config, workers=1, keep_jobs=100):
+        super().__init__(address, FitRequestHandler)
+
+        self.config = config
+        self.catalogs = CatalogCache()
+        self.jobs = {}
+        self.keep_jobs = keep_jobs
+        self.queue = queue.PriorityQueue()
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+        self.workers = [
+            threading.Thread(target=self._work, daemon=True)
+            for _ in range(workers)
+        ]
+        for worker in self.workers:
+            worker.start()
+
+        return
+
+    def submit(self, request):
+        """Validates a fit request and puts it on the queue."""
+
+        if not isinstance(request, dict):
+            raise ValueError('Fit request must be a JSON object.')
+        for key in ('catalog', 'x', 'y'):
+            if key not in request:
+                raise ValueError(f'Fit request is missing `{key}`.')
+        if not isinstance(request.get('config', {}), dict):
+            raise ValueError('`config` must be a JSON object.')
+        try:
+            int(request.get('priority', 0))
+        except (TypeError, ValueError):
+            raise ValueError('`priority` must be an integer.') from None
+
+        with self._lock:
+            job_id = str(next(self._ids))
+            job = Job(job_id, request)
+            self.jobs[job_id] = job
+
+        self.queue.put((job.priority, int(job_id), job))
+
+        return job
+
+    def _work(self):
+        while True:
+            _, _, job = self.queue.get()
+            try:
+                self.run_job(job)
+            finally:
+                self.evict()
+                self.queue.task_done()
+
+    def evict(self):
+        """Drops the oldest finished jobs beyond `keep_jobs`."""
+
+        with self._lock:
+            finished = [i for i, j in self.jobs.items() if j.finished]
+            for job_id in finished[:max(len(finished) - self.keep_jobs, 0)]:
+                del self.jobs[job_id]
+
+        return
+
+    def run_job(self, job):
+        request = job.request
+
+        try:
+            cached = request['catalog'] in self.catalogs
+            job.emit('loading', catalog=request['catalog'], cached=cached)
+            catalog = self.catalogs.get(request['catalog'])
+
+            config = dict(self.config, **request.get('config', {}))
+
+            job.emit('sampling')
+            start = time.time()
+            job.result = clustr.run_fit(
+                catalog, config, request['x'], request['y'],
+                prefix=request.get('prefix'), progress=job.progress
+            )
+            job.emit('done', seconds=time.time() - start)
+
+        except Exception as e:  # pylint: disable=broad-except
+            job.error = ''.join(traceback.format_exception_only(type(e), e))
+            job.emit('failed', error=job.error)
+
+        except SystemExit:
+            # Data raises SystemExit when no clusters survive the cuts.
+            job.error = 'No data survived flag removal.'
+            job.emit('failed', error=job.error)
+
+        return
+
+class FitRequestHandler(BaseHTTPRequestHandler):
+    """Routes the HTTP API onto the FitServer."""
+
+    def _send_json(self, obj, code=200):
+        body = json.dumps(obj).encode()
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+        return
+
+    def _job(self, job_id):
+        job = self.server.jobs.get(job_id)
+        if job is None:
+            self._send_json({'error': f'No job `{job_id}`.'}, 404)
+        return job
+
+    def do_POST(self):
+        if self.path.rstrip('/') != '/jobs':
+            self._send_json({'error': f'Unknown path `{self.path}`.'}, 404)
+            return
+
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+            request = json.loads(self.rfile.read(length) or b'{}')
+            job = self.server.submit(request)
+        except ValueError as e:
+            self._send_json({'error': str(e)}, 400)
+            return
+
+        self._send_json(job.to_dict(), 202)
+
+        return
+
+    def do_GET(self):
+        path, _, query = self.path.partition('?')
+        parts = [p for p in path.split('/') if p]
+
+        if parts == ['status']:
+            self._send_json({
+                'queued': self.server.queue.qsize(),
+                'workers': len(self.server.workers),
+                'jobs': {i: j.status for i, j in list(self.server.jobs.items())},
+                'catalogs': list(self.server.catalogs),
+            })
+
+        elif len(parts) == 2 and parts[0] == 'jobs':
+            job = self._job(parts[1])
+            if job is not None:
+                self._send_json(job.to_dict(chains='chains=1' in query))
+
+        elif len(parts) == 3 and parts[0] == 'jobs' and parts[2] == 'events':
+            job = self._job(parts[1])
+            if job is not None:
+                self._stream(job)
+
+        else:
+            self._send_json({'error': f'Unknown path `{self.path}`.'}, 404)
+
+        return
+
+    def _stream(self, job):
+        """Streams job events as chunked JSON lines until the job finishes."""
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/x-ndjson')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+
+        for event in job.stream():
+            line = (json.dumps(event) + '\n').encode()
+            self.wfile.write(b'%x\r\n%s\r\n' % (len(line), line))
+            self.wfile.flush()
+
+        self.wfile.write(b'0\r\n\r\n')
+
+        return
+
+def main(argv=None):
+    import yaml
+
+    parser = ArgumentParser(prog='clustr.py serve')
+    parser.add_argument('config_file',
+        help='base config; jobs may override individual keys')
+    parser.add_argument('--host', default='127.0.0.1',
+        help='address to listen on')
+    parser.add_argument('--port', type=int, default=8765,
+        help='port to listen on')
+    parser.add_argument('-w', '--workers', type=int, default=1,
+        help='number of fits to run concurrently')
+    parser.add_argument('--preload', nargs='*', default=[],
+        help='catalogs to load before accepting jobs')
+    parser.add_argument('--keep-jobs', type=int, default=100,
+        help='finished jobs (and their chains) to keep for clients to fetch')
+    args = parser.parse_args(argv)
+
+    with open(args.config_file, 'r') as stream:
+        config = yaml.safe_load(stream)
+
+    server = FitServer((args.host, args.port), config, workers=args.workers,
+                       keep_jobs=args.keep_jobs)
+
+    for cat_filename in args.preload:
+        print(f'Loading {cat_filename}...')
+        server.catalogs.get(cat_filename)
+
+    print(f'Serving CluStR fits on http://{args.host}:{args.port}')
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+    return
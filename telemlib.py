@@ -0,0 +1,238 @@
+''' Sampling telemetry library for CluStR '''
+
+# Live progress of linmix fits. With `telemetry` set in config.yml, the
+# sampler appends a JSON line every `telemetry_interval` seconds with the
+# iteration count, throughput, ETA and running R-hat/ESS of alpha, beta and
+# sigsqr. `clustr.py watch` follows any number of these streams, e.g. all
+# fits of a farm writing to one shared directory:
+#
+#   python clustr.py watch /shared/telemetry/
+
+from argparse import ArgumentParser
+import glob
+import json
+import os
+import socket
+import sys
+import time
+import uuid
+import numpy as np
+import reglib
+
+# pylint: disable=invalid-name
+
+params = ('alpha', 'beta', 'sigsqr')
+
+class Telemetry:
+    """
+    step_linmix callback writing progress as JSON lines to `filename`, at
+    most every `interval` seconds. If filename is a directory, the stream is
+    `<label>-<host>-<pid>-<random>.jsonl` inside it, one per fit. Running
+    R-hat and ESS use the second half of the draws so far, as the
+    convergence check does, thinned to `max_draws` per chain. Samplers that
+    do not report progress pass interval=None and only write the `started`
+    and `done` lines. If a `sink` is given, every line is passed to it as a
+    dictionary instead of being written to a file.
+    """
+
+    def __init__(self, filename, label='', interval=10., Nmin=None, Nmax=None,
+                 max_draws=20000, sink=None):
+        # pylint: disable = too-many-arguments
+        if sink is None and (os.path.isdir(filename) or filename.endswith(os.sep)):
+            os.makedirs(filename, exist_ok=True)
+            filename = os.path.join(filename, '{}-{}-{}-{}.jsonl'.format(
+                label or 'fit', socket.gethostname(), os.getpid(),
+                uuid.uuid4().hex[:8]))
+
+        self.filename = filename
+        self.sink = sink
+        self.label = label
+        self.interval = interval
+        self.Nmin = Nmin
+        self.Nmax = Nmax
+        self.max_draws = max_draws
+
+        self.niter = 0
+        self._blocks = []
+        self._start = time.time()
+        self._last = (self._start, 0)
+
+        self.emit('started')
+
+        return
+
+    def __call__(self, niter, block):
+        # Keep only the draws that can still be in the second half.
+        self._blocks.append((niter, block))
+        while self._blocks and self._blocks[0][0] <= niter // 2:
+            self._blocks.pop(0)
+        self.niter = niter
+
+        if self.interval is not None and time.time() - self._last[0] >= self.interval:
+            self.emit('sampling')
+
+        return
+
+    def diagnostics(self):
+        '''Split R-hat and ESS of every parameter over the retained draws.'''
+
+        if not self._blocks:
+            return {}, {}
+
+        rhat, ess = {}, {}
+        for p in params:
+            draws = np.hstack([b[p] for _, b in self._blocks])
+            draws = draws[:, ::max(1, draws.shape[1] // self.max_draws)]
+            rhat[p] = reglib.split_rhat(np.ravel(draws), nsplit=len(draws))
+            ess[p] = sum(reglib.effective_sample_size(d) for d in draws)
+
+        return rhat, ess
+
+    def emit(self, status):
+        '''Appends one telemetry line.'''
+
+        now = time.time()
+        elapsed = now - self._start
+        rate = (self.niter - self._last[1]) / max(now - self._last[0], 1e-9)
+        mean_rate = self.niter / max(elapsed, 1e-9)
+        self._last = (now, self.niter)
+
+        rhat, ess = self.diagnostics()
+
+        line = {
+            'time': now,
+            'label': self.label,
+            'host': socket.gethostname(),
+            'pid': os.getpid(),
+            'status': status,
+            'niter': self.niter,
+            'Nmin': self.Nmin,
+            'Nmax': self.Nmax,
+            'elapsed_s': elapsed,
+            'iter_per_s': rate,
+            'mean_iter_per_s': mean_rate,
+            'rhat': {p: _finite(v) for p, v in rhat.items()},
+            'ess': {p: _finite(v) for p, v in ess.items()},
+            'interval': self.interval,
+        }
+        if mean_rate > 0 and status != 'done':
+            # Sampling stops between Nmin (if converged) and Nmax.
+            if self.Nmin:
+                line['eta_min_s'] = max(self.Nmin - self.niter, 0) / mean_rate
+            if self.Nmax:
+                line['eta_s'] = (self.Nmax - self.niter) / mean_rate
+
+        if self.sink is not None:
+            self.sink(line)
+            return
+
+        with open(self.filename, 'a') as f:
+            f.write(json.dumps(line) + '\n')
+
+        return
+
+    def close(self):
+        self.emit('done')
+
+def _finite(v):
+    return float(v) if np.isfinite(v) else None
+
+def streams(paths):
+    '''Telemetry files named by `paths`: files, directories or glob patterns.'''
+
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files += glob.glob(os.path.join(path, '*.jsonl'))
+        else:
+            files += glob.glob(path) or [path]
+
+    return sorted(set(files))
+
+class Follower:
+    """Reads the lines appended to telemetry files since the last call."""
+
+    def __init__(self):
+        self.offsets = {}
+        self.latest = {}
+
+        return
+
+    def update(self, files):
+        for filename in files:
+            try:
+                with open(filename, 'r') as f:
+                    f.seek(self.offsets.get(filename, 0))
+                    while True:
+                        line = f.readline()
+                        if not line.endswith('\n'):
+                            # Partially written; read it next time.
+                            break
+                        self.offsets[filename] = f.tell()
+                        try:
+                            self.latest[filename] = json.loads(line)
+                        except ValueError:
+                            pass
+            except FileNotFoundError:
+                continue
+
+        return self.latest
+
+def table(latest, now=None):
+    '''One status row per stream, flagging streams that stopped updating.'''
+
+    now = now or time.time()
+
+    lines = ['{:<36} {:>8} {:>15} {:>10} {:>9} {:>8} {:>9}  {}'.format(
+        'Fit', 'Status', 'Iterations', 'Iter/s', 'ETA (s)', 'R-hat', 'Min ESS',
+        'Last update')]
+    total_rate = 0.
+    for filename, t in sorted(latest.items()):
+        age = now - t['time']
+        status = t['status']
+        # Streams without an interval only report their start and end.
+        interval = t.get('interval', 10.)
+        if status != 'done' and interval and age > 3 * interval:
+            status = 'STALLED?'
+        elif status != 'done':
+            total_rate += t['iter_per_s']
+
+        rhat = [v for v in t['rhat'].values() if v is not None]
+        ess = [v for v in t['ess'].values() if v is not None]
+        name = t['label'] or os.path.basename(filename)
+        lines.append('{:<36} {:>8} {:>15} {:>10.1f} {:>9} {:>8} {:>9}  {:.0f} s ago'.format(
+            '{} ({}:{})'.format(name, t['host'], t['pid'])[:36], status,
+            '{}/{}'.format(t['niter'], t['Nmax'] or '?'), t['iter_per_s'],
+            '{:.0f}'.format(t['eta_s']) if 'eta_s' in t else '-',
+            '{:.3f}'.format(max(rhat)) if rhat else '-',
+            '{:.0f}'.format(min(ess)) if ess else '-', age))
+
+    lines.append(f'{len(latest)} fits, {total_rate:.1f} iterations/s in total')
+
+    return '\n'.join(lines)
+
+def main(argv=None):
+    parser = ArgumentParser(prog='clustr.py watch')
+    parser.add_argument('paths', nargs='+',
+        help='telemetry files, directories of them or glob patterns')
+    parser.add_argument('-n', '--refresh', type=float, default=2.,
+        help='seconds between refreshes')
+    parser.add_argument('--once', action='store_true',
+        help='print the current state once and exit')
+    args = parser.parse_args(argv)
+
+    follower = Follower()
+    try:
+        while True:
+            latest = follower.update(streams(args.paths))
+            if sys.stdout.isatty() and not args.once:
+                # Clear the screen and redraw.
+                print('\033[2J\033[H', end='')
+            print(table(latest))
+            if args.once:
+                return
+            time.sleep(args.refresh)
+    except KeyboardInterrupt:
+        pass
+
+    return